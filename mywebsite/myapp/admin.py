@@ -101,8 +101,8 @@ class LoanAdmin(admin.ModelAdmin):
 
 @admin.register(Fine)
 class FineAdmin(admin.ModelAdmin):
-    list_display = ("loan", "amount", "created_at", "paid_at")
-    list_filter = ("paid_at",)
+    list_display = ("loan", "amount", "created_at", "paid_at", "accruing")
+    list_filter = ("paid_at", "accruing")
     search_fields = ("loan__copy__barcode", "loan__borrower__username")
 
 
@@ -149,3 +149,61 @@ class PickupRequestAdmin(admin.ModelAdmin):
 class PickupRequestItemAdmin(admin.ModelAdmin):
     list_display = ("request", "book", "assigned_copy")
     search_fields = ("request__requester__username", "book__title", "assigned_copy__barcode")
+
+
+@admin.register(AccountSummary)
+class AccountSummaryAdmin(admin.ModelAdmin):
+    list_display = ("user", "active_loans", "overdue_loans", "unpaid_fines", "pending_requests", "cart_items", "refreshed_at")
+    search_fields = ("user__username",)
+
+
+@admin.register(Watermark)
+class WatermarkAdmin(admin.ModelAdmin):
+    list_display = ("name", "position", "updated_at")
+
+
+@admin.register(ReminderLog)
+class ReminderLogAdmin(admin.ModelAdmin):
+    list_display = ("loan", "kind", "due_at", "sent_at")
+    list_filter = ("kind",)
+    search_fields = ("loan__borrower__username", "loan__copy__barcode")
+
+
+@admin.register(Hold)
+class HoldAdmin(admin.ModelAdmin):
+    list_display = ("book", "patron", "seq", "status", "created_at", "offered_at")
+    list_filter = ("status",)
+    search_fields = ("book__title", "patron__username")
+
+
+@admin.register(CirculationEvent)
+class CirculationEventAdmin(admin.ModelAdmin):
+    list_display = ("id", "kind", "occurred_at", "user", "book", "copy", "loan", "request", "status", "amount")
+    list_filter = ("kind",)
+
+    # The ledger is append-only
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(DailyStat)
+class DailyStatAdmin(admin.ModelAdmin):
+    list_display = ("day", "loans", "returns", "renewals", "fines_assessed", "fines_paid")
+
+
+@admin.register(BookStat)
+class BookStatAdmin(admin.ModelAdmin):
+    list_display = ("book", "loans", "returns", "renewals", "fines_assessed", "fines_paid")
+    search_fields = ("book__title",)
+
+
+@admin.register(ReportJob)
+class ReportJobAdmin(admin.ModelAdmin):
+    list_display = ("id", "kind", "status", "requested_by", "created_at", "finished_at", "rows", "size")
+    list_filter = ("kind", "status")
@@ -4,3 +4,15 @@ from django.apps import AppConfig
 class MyappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'myapp'
+
+    def ready(self):
+        from django.conf import settings
+        from django.db.models.signals import post_delete, post_save
+
+        from .models import Policy
+        from .services.account import create_account_summary
+        from .services.policy import invalidate_policy
+
+        post_save.connect(invalidate_policy, sender=Policy, dispatch_uid='policy_snapshot_save')
+        post_delete.connect(invalidate_policy, sender=Policy, dispatch_uid='policy_snapshot_delete')
+        post_save.connect(create_account_summary, sender=settings.AUTH_USER_MODEL, dispatch_uid='account_summary_create')
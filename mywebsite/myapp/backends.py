@@ -0,0 +1,102 @@
+"""
+Cache backends used by the project settings.
+"""
+import sys
+import time
+
+from django.core.cache.backends.db import DatabaseCache
+from django.db import connections, router
+from django.utils import timezone
+
+
+class DeferredCullDatabaseCache(DatabaseCache):
+    """
+    DatabaseCache that never culls on the request path.
+
+    The stock backend deletes expired rows and then a third of the table from
+    inside ``set()`` once ``MAX_ENTRIES`` is exceeded, which shows up as
+    latency spikes on ordinary page views and session writes. Here the limit
+    is only enforced by ``cull()``, which the ``cull_cache`` management
+    command runs on a schedule in bounded batches.
+    """
+
+    def __init__(self, table, params):
+        super().__init__(table, params)
+        # Keep the configured limit for the scheduled cull and stop set()/add()
+        # from ever reaching DatabaseCache._cull().
+        self.cull_max_entries = self._max_entries
+        self._max_entries = sys.maxsize
+
+    def _cursor(self):
+        db = router.db_for_write(self.cache_model_class)
+        connection = connections[db]
+        return connection, connection.cursor()
+
+    def table_size(self):
+        connection, cursor = self._cursor()
+        with cursor:
+            cursor.execute("SELECT COUNT(*) FROM %s" % connection.ops.quote_name(self._table))
+            return cursor.fetchone()[0]
+
+    def _delete_batch(self, where, params, order_by, batch_size):
+        """Delete up to ``batch_size`` keys matching ``where``; return the count."""
+        connection, cursor = self._cursor()
+        quote_name = connection.ops.quote_name
+        with cursor:
+            cursor.execute(
+                "SELECT %s FROM %s %s ORDER BY %s LIMIT %d"
+                % (quote_name("cache_key"), quote_name(self._table), where, quote_name(order_by), int(batch_size)),
+                params,
+            )
+            keys = [row[0] for row in cursor.fetchall()]
+        if not keys:
+            return 0
+        self._base_delete_many(keys)
+        return len(keys)
+
+    def cull(self, batch_size=500, max_batches=None):
+        """
+        Expire and cull the cache table in batches of ``batch_size`` keys.
+
+        Expired rows go first; if the table is still above ``MAX_ENTRIES`` the
+        entries closest to expiry are removed until it is back at the limit.
+        ``max_batches`` bounds the total work done in one call. Returns a dict
+        of metrics for the run.
+        """
+        started = time.monotonic()
+        connection = connections[router.db_for_write(self.cache_model_class)]
+        now = timezone.now().replace(microsecond=0)
+        expires_where = "WHERE %s < %%s" % connection.ops.quote_name("expires")
+        expires_params = [connection.ops.adapt_datetimefield_value(now)]
+
+        size_before = self.table_size()
+        batches = expired = culled = 0
+
+        def budget_left():
+            return max_batches is None or batches < max_batches
+
+        while budget_left():
+            deleted = self._delete_batch(expires_where, expires_params, "expires", batch_size)
+            batches += 1
+            expired += deleted
+            if deleted < batch_size:
+                break
+
+        excess = size_before - expired - self.cull_max_entries
+        while excess > 0 and budget_left():
+            deleted = self._delete_batch("", [], "expires", min(batch_size, excess))
+            batches += 1
+            culled += deleted
+            excess -= deleted
+            if not deleted:
+                break
+
+        return {
+            "size_before": size_before,
+            "size_after": self.table_size(),
+            "max_entries": self.cull_max_entries,
+            "expired_deleted": expired,
+            "culled": culled,
+            "batches": batches,
+            "duration_ms": round((time.monotonic() - started) * 1000, 1),
+        }
@@ -0,0 +1,11 @@
+from django.utils.functional import SimpleLazyObject
+
+from .services.account import get_account_summary
+
+
+def account_summary(request):
+    """Expose the patron's AccountSummary as ``account_summary`` (queried only if a template uses it)."""
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return {}
+    return {'account_summary': SimpleLazyObject(lambda: get_account_summary(user))}
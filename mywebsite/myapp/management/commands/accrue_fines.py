@@ -0,0 +1,41 @@
+"""
+Management command to keep running overdue fines current for all open loans.
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from myapp.services.fines import accrue_fines
+from myapp.services.policy import current_policy
+
+
+class Command(BaseCommand):
+    help = "Upsert one running Fine per open overdue loan at the current Policy fine rate."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000, help='Loans processed per batch')
+        parser.add_argument(
+            '--interval',
+            type=int,
+            default=0,
+            help='Keep running as a worker, checking every N seconds and re-accruing when '
+                 'the date rolls over or the Policy changes (default: run once)',
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive.')
+
+        last_run = None
+        while True:
+            run_key = (timezone.now().date(), current_policy().version)
+            if run_key != last_run:
+                started = time.monotonic()
+                stats = accrue_fines(batch_size=options['batch_size'])
+                stats['duration_ms'] = int((time.monotonic() - started) * 1000)
+                self.stdout.write(' '.join(f'{key}={value}' for key, value in stats.items()))
+                last_run = run_key
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,32 @@
+"""
+Management command to assign available copies to pending pickup requests in FIFO order.
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from myapp.services.pickups import allocate_pending_requests
+
+
+class Command(BaseCommand):
+    help = "Reserve AVAILABLE copies for unassigned items of PENDING requests, oldest request first."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Requests allocated per transaction')
+        parser.add_argument(
+            '--interval',
+            type=int,
+            default=0,
+            help='Keep running as a worker, allocating every N seconds (default: run once)',
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive.')
+
+        while True:
+            stats = allocate_pending_requests(batch_size=options['batch_size'])
+            self.stdout.write(' '.join(f'{key}={value}' for key, value in stats.items()))
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,39 @@
+"""
+Management command to time the NumPy circulation analytics against ORM aggregation.
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from myapp.services import analytics
+
+
+class Command(BaseCommand):
+    help = (
+        "Time compute_analytics() (chunked column load + NumPy) against orm_summary() "
+        "(GROUP BY aggregation of the comparable metrics) over the current data."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=3, help='Runs per method; the best time is reported')
+        parser.add_argument('--chunk-size', type=int, default=analytics.ANALYTICS_CHUNK_ROWS, help='Rows converted per chunk')
+
+    def handle(self, *args, **options):
+        if not analytics.available():
+            raise CommandError('NumPy is not installed.')
+        if options['repeat'] < 1 or options['chunk_size'] < 1:
+            raise CommandError('--repeat and --chunk-size must be positive.')
+
+        def best(fn):
+            times = []
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                fn()
+                times.append(time.perf_counter() - started)
+            return int(min(times) * 1000)
+
+        stats = {
+            'numpy_ms': best(lambda: analytics.compute_analytics(chunk_size=options['chunk_size'])),
+            'orm_ms': best(analytics.orm_summary),
+        }
+        self.stdout.write(' '.join(f'{key}={value}' for key, value in stats.items()))
@@ -0,0 +1,41 @@
+"""
+Management command to expire and cull the database cache table off the request path.
+"""
+import time
+
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+
+from myapp.backends import DeferredCullDatabaseCache
+
+
+class Command(BaseCommand):
+    help = "Delete expired cache rows and cull the cache table down to MAX_ENTRIES in bounded batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--alias', default='default', help='Cache alias to cull (default: default)')
+        parser.add_argument('--batch-size', type=int, default=500, help='Keys deleted per statement')
+        parser.add_argument('--max-batches', type=int, default=None, help='Upper bound on batches per run')
+        parser.add_argument(
+            '--interval',
+            type=int,
+            default=0,
+            help='Keep running as a worker, culling every N seconds (default: run once)',
+        )
+
+    def handle(self, *args, **options):
+        backend = caches[options['alias']]
+        if not isinstance(backend, DeferredCullDatabaseCache):
+            raise CommandError(
+                f"Cache '{options['alias']}' is {type(backend).__name__}; "
+                "set CACHE_DEFERRED_CULL=1 to use DeferredCullDatabaseCache."
+            )
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive.')
+
+        while True:
+            stats = backend.cull(batch_size=options['batch_size'], max_batches=options['max_batches'])
+            self.stdout.write(' '.join(f'{key}={value}' for key, value in stats.items()))
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
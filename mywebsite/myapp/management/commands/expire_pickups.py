@@ -0,0 +1,33 @@
+"""
+Management command to expire uncollected pickup requests and release their copies.
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from myapp.services.pickups import expire_pickup_requests
+
+
+class Command(BaseCommand):
+    help = "Mark PREPARING/READY requests past their pickup date EXPIRED and make their reserved copies AVAILABLE."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200, help='Requests expired per transaction')
+        parser.add_argument('--max-batches', type=int, default=None, help='Upper bound on batches per run')
+        parser.add_argument(
+            '--interval',
+            type=int,
+            default=0,
+            help='Keep running as a worker, sweeping every N seconds (default: run once)',
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive.')
+
+        while True:
+            stats = expire_pickup_requests(batch_size=options['batch_size'], max_batches=options['max_batches'])
+            self.stdout.write(' '.join(f'{key}={value}' for key, value in stats.items()))
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,25 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from myapp.services.account import refresh_account_summaries
+
+
+class Command(BaseCommand):
+    help = "Recompute AccountSummary rows (active/overdue loans, unpaid fines, open requests, cart size) from source tables."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', default=[], help='Username to rebuild (repeatable); default: all users')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        users = get_user_model().objects.order_by('pk')
+        if options['user']:
+            users = users.filter(username__in=options['user'])
+        ids = list(users.values_list('pk', flat=True))
+        batch_size = max(1, options['batch_size'])
+        done = 0
+        for start in range(0, len(ids), batch_size):
+            with transaction.atomic():
+                done += len(refresh_account_summaries(ids[start:start + batch_size]))
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {done} account summaries."))
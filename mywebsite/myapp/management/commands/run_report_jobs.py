@@ -0,0 +1,34 @@
+"""
+Management command to generate queued staff reports into files under MEDIA_ROOT/reports.
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from myapp.services.report_jobs import run_pending_jobs
+
+
+class Command(BaseCommand):
+    help = "Run queued report jobs, delete expired report files and requeue jobs abandoned by a dead worker."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Rows fetched per database round trip')
+        parser.add_argument('--max-jobs', type=int, default=None, help='Stop after this many jobs per pass')
+        parser.add_argument(
+            '--interval',
+            type=int,
+            default=0,
+            help='Keep running as a worker, checking the queue every N seconds (default: run once)',
+        )
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive.')
+        while True:
+            started = time.monotonic()
+            stats = run_pending_jobs(max_jobs=options['max_jobs'], chunk_size=options['chunk_size'])
+            stats['duration_ms'] = int((time.monotonic() - started) * 1000)
+            self.stdout.write(' '.join(f'{key}={value}' for key, value in stats.items()))
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
@@ -1,28 +1,35 @@
-from django.core.management.base import BaseCommand
-from django.utils import timezone
-from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
 
-from myapp.models import Loan
+from myapp.services.reminders import iter_digests, pending_reminders, send_reminders
 
 
 class Command(BaseCommand):
-    help = "Simulate sending due soon and overdue email reminders (logs to console)."
+    help = "Email one digest per borrower for due-soon and overdue loans not reminded yet."
 
-    def handle(self, *args, **options):
-        now = timezone.now()
-        due_soon_from = now + timedelta(days=1)
-        due_soon_to = now + timedelta(days=2)
-
-        due_soon = Loan.objects.filter(returned_at__isnull=True, due_at__gte=due_soon_from, due_at__lte=due_soon_to)
-        overdue = Loan.objects.filter(returned_at__isnull=True, due_at__lt=now)
-
-        self.stdout.write(self.style.NOTICE(f"Due soon (T-2..T-1 days): {due_soon.count()}"))
-        for loan in due_soon.select_related('borrower', 'copy', 'copy__book'):
-            self.stdout.write(f"[Due Soon] user={loan.borrower.username} title={loan.copy.book.title} due={loan.due_at:%Y-%m-%d %H:%M}")
-
-        self.stdout.write(self.style.NOTICE(f"Overdue: {overdue.count()}"))
-        for loan in overdue.select_related('borrower', 'copy', 'copy__book'):
-            self.stdout.write(f"[Overdue] user={loan.borrower.username} title={loan.copy.book.title} due={loan.due_at:%Y-%m-%d %H:%M}")
-
-        self.stdout.write(self.style.SUCCESS("Reminder run complete (simulated)."))
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500, help='Loans fetched per database round-trip')
+        parser.add_argument('--batch-size', type=int, default=50, help='Digests sent per connection batch')
+        parser.add_argument('--workers', type=int, default=4, help='Concurrent sending threads')
+        parser.add_argument('--backend', default=None, help='Email backend path (default: settings.EMAIL_BACKEND)')
+        parser.add_argument('--dry-run', action='store_true', help='List pending digests without sending or recording them')
 
+    def handle(self, *args, **options):
+        for name in ('chunk_size', 'batch_size', 'workers'):
+            if options[name] < 1:
+                raise CommandError(f"--{name.replace('_', '-')} must be positive.")
+
+        if options['dry_run']:
+            for digest in iter_digests(pending_reminders(), options['chunk_size']):
+                kinds = ','.join(sorted({loan.reminder_kind for loan in digest.loans}))
+                self.stdout.write(f"user={digest.borrower.username} email={digest.borrower.email or '-'} loans={len(digest.loans)} kinds={kinds}")
+            return
+
+        stats = send_reminders(
+            chunk_size=options['chunk_size'],
+            batch_size=options['batch_size'],
+            workers=options['workers'],
+            backend=options['backend'],
+        )
+        self.stdout.write(' '.join(f'{key}={value}' for key, value in stats.items()))
+        style = self.style.WARNING if stats['failed'] else self.style.SUCCESS
+        self.stdout.write(style(f"Sent {stats['sent']} digest(s) covering {stats['loans']} loan(s)."))
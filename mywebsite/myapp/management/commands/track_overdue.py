@@ -0,0 +1,28 @@
+"""
+Management command to stamp newly overdue loans for incremental downstream jobs.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from myapp.services.overdue import track_overdue
+
+
+class Command(BaseCommand):
+    help = "Record when open loans cross their due date (Loan.overdue_at) so jobs can process only new overdues."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval',
+            type=int,
+            default=0,
+            help='Keep running as a worker, sweeping every N seconds (default: run once)',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            stats = track_overdue()
+            self.stdout.write(' '.join(f'{key}={value}' for key, value in stats.items()))
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,33 @@
+"""
+Management command to fold new circulation events into the daily rollup tables.
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from myapp.services.rollups import update_rollups
+
+
+class Command(BaseCommand):
+    help = "Fold circulation events recorded since the last run into the daily, per-book and per-category rollups."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help='Events folded per transaction')
+        parser.add_argument(
+            '--interval',
+            type=int,
+            default=0,
+            help='Keep running as a worker, folding new events every N seconds (default: run once)',
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive.')
+        while True:
+            started = time.monotonic()
+            stats = update_rollups(batch_size=options['batch_size'])
+            stats['duration_ms'] = int((time.monotonic() - started) * 1000)
+            self.stdout.write(' '.join(f'{key}={value}' for key, value in stats.items()))
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
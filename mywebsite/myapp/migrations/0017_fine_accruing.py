@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-19 17:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0016_accountsummary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fine',
+            name='accruing',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddConstraint(
+            model_name='fine',
+            constraint=models.UniqueConstraint(condition=models.Q(('accruing', True)), fields=('loan',), name='unique_accruing_fine_per_loan'),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-19 17:45
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0017_fine_accruing'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Watermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=64, unique=True)),
+                ('position', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RemoveIndex(
+            model_name='loan',
+            name='myapp_loan_returne_223ea3_idx',
+        ),
+        migrations.AddField(
+            model_name='loan',
+            name='overdue_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='fine',
+            index=models.Index(condition=models.Q(('paid_at', None)), fields=['loan'], name='fine_unpaid_loan_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fine',
+            index=models.Index(condition=models.Q(('paid_at', None)), fields=['-created_at'], name='fine_unpaid_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(condition=models.Q(('returned_at', None)), fields=['due_at'], name='loan_open_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(condition=models.Q(('returned_at', None)), fields=['borrower', 'due_at'], name='loan_open_borrower_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(condition=models.Q(('overdue_at', None), ('returned_at', None)), fields=['due_at'], name='loan_pending_overdue_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(condition=models.Q(('returned_at', None)), fields=['overdue_at'], name='loan_open_overdue_at_idx'),
+        ),
+    ]
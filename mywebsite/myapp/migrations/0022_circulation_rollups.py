@@ -0,0 +1,62 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:04
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0021_circulationevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('loans', models.PositiveIntegerField(default=0)),
+                ('returns', models.PositiveIntegerField(default=0)),
+                ('renewals', models.PositiveIntegerField(default=0)),
+                ('fines_assessed', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('fines_paid', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('day', models.DateField(unique=True)),
+            ],
+            options={
+                'ordering': ['-day'],
+            },
+        ),
+        migrations.CreateModel(
+            name='BookStat',
+            fields=[
+                ('loans', models.PositiveIntegerField(default=0)),
+                ('returns', models.PositiveIntegerField(default=0)),
+                ('renewals', models.PositiveIntegerField(default=0)),
+                ('fines_assessed', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('fines_paid', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('book', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stat', serialize=False, to='myapp.book')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-loans'], name='myapp_books_loans_a98ef9_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyBookStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('loans', models.PositiveIntegerField(default=0)),
+                ('returns', models.PositiveIntegerField(default=0)),
+                ('renewals', models.PositiveIntegerField(default=0)),
+                ('fines_assessed', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('fines_paid', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('day', models.DateField()),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='myapp.book')),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='myapp.category')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['book', 'day'], name='myapp_daily_book_id_be9f7a_idx'), models.Index(fields=['category', 'day'], name='myapp_daily_categor_9631c3_idx')],
+                'constraints': [models.UniqueConstraint(fields=('day', 'book'), name='unique_daily_book_stat')],
+            },
+        ),
+    ]
@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.db import migrations
+
+# Staff look borrowers up case-insensitively by username or email. Plain
+# column indexes cannot serve LOWER(column) comparisons, so the user table
+# gets expression indexes (SQLite and PostgreSQL both support them). The
+# user model is not ours to add Meta.indexes to, hence SQL here, run against
+# whatever table and columns AUTH_USER_MODEL resolves to.
+INDEXES = [
+    ("myapp_user_username_lower_idx", "username"),
+    ("myapp_user_email_lower_idx", "email"),
+]
+
+
+def create_indexes(apps, schema_editor):
+    user = apps.get_model(settings.AUTH_USER_MODEL)
+    quote = schema_editor.quote_name
+    for name, field in INDEXES:
+        schema_editor.execute(
+            f"CREATE INDEX {quote(name)} ON {quote(user._meta.db_table)} "
+            f"((LOWER({quote(user._meta.get_field(field).column)})))"
+        )
+
+
+def drop_indexes(apps, schema_editor):
+    user = apps.get_model(settings.AUTH_USER_MODEL)
+    quote = schema_editor.quote_name
+    # MySQL only drops an index named together with its table
+    on_table = f" ON {quote(user._meta.db_table)}" if schema_editor.connection.vendor == "mysql" else ""
+    for name, _ in INDEXES:
+        schema_editor.execute(f"DROP INDEX {quote(name)}{on_table}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0024_fine_ledger_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:02
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_recorded_at(apps, schema_editor):
+    # Existing events were settled on occurred_at; keep them where they were
+    CirculationEvent = apps.get_model('myapp', 'CirculationEvent')
+    CirculationEvent.objects.update(recorded_at=F('occurred_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0026_reportjob_claim'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='circulationevent',
+            name='recorded_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(backfill_recorded_at, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,7 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.conf import settings
+from django.utils import timezone
 
 
 class Product(models.Model):
@@ -156,6 +157,9 @@ class Loan(models.Model):
     returned_at = models.DateTimeField(null=True, blank=True, db_index=True)
     renew_count = models.PositiveIntegerField(default=0)
     note = models.TextField(blank=True)
+    # Set by the overdue tracker when it first sees the loan past due_at;
+    # cleared again if the loan is renewed back into the future.
+    overdue_at = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         ordering = ["-checked_out_at"]
@@ -166,9 +170,18 @@ class Loan(models.Model):
                 condition=models.Q(returned_at=None),
             )
         ]
+        # Partial indexes cover open loans only, so overdue scans stay
+        # proportional to what is on loan rather than to loan history.
+        # Backends without partial index support skip them.
         indexes = [
             models.Index(fields=['borrower', '-checked_out_at']),
-            models.Index(fields=['returned_at', 'due_at']),
+            models.Index(fields=['due_at'], name='loan_open_due_idx', condition=models.Q(returned_at=None)),
+            models.Index(fields=['borrower', 'due_at'], name='loan_open_borrower_due_idx', condition=models.Q(returned_at=None)),
+            models.Index(
+                fields=['due_at'], name='loan_pending_overdue_idx',
+                condition=models.Q(returned_at=None, overdue_at=None),
+            ),
+            models.Index(fields=['overdue_at'], name='loan_open_overdue_at_idx', condition=models.Q(returned_at=None)),
         ]
 
     def __str__(self):
@@ -187,15 +200,247 @@ class Fine(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     paid_at = models.DateTimeField(null=True, blank=True)
     payment_reference = models.CharField(max_length=120, blank=True)
+    # Running overdue fine for an open loan; the accrual job keeps its amount
+    # current and it is frozen (accruing=False) on return or payment.
+    accruing = models.BooleanField(default=False)
 
     class Meta:
         ordering = ["-created_at"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["loan"],
+                name="unique_accruing_fine_per_loan",
+                condition=models.Q(accruing=True),
+            )
+        ]
+        indexes = [
+            models.Index(fields=["loan"], name="fine_unpaid_loan_idx", condition=models.Q(paid_at=None)),
+            models.Index(fields=["-created_at"], name="fine_unpaid_created_idx", condition=models.Q(paid_at=None)),
+            # The staff ledger pages newest first by (created_at, id)
+            models.Index(fields=["-created_at", "-id"], name="fine_ledger_idx"),
+        ]
 
     def __str__(self):
         status = "paid" if self.paid_at else "unpaid"
         return f"Fine {self.amount} ({status}) for loan {self.loan_id}"
 
 
+class ReminderLog(models.Model):
+    """Ledger of reminders already sent, one row per loan, kind and due date."""
+    KIND_DUE_SOON = "due_soon"
+    KIND_OVERDUE = "overdue"
+    KIND_CHOICES = [
+        (KIND_DUE_SOON, "Due soon"),
+        (KIND_OVERDUE, "Overdue"),
+    ]
+
+    loan = models.ForeignKey(Loan, on_delete=models.CASCADE, related_name="reminders")
+    kind = models.CharField(max_length=16, choices=KIND_CHOICES)
+    # A renewal moves due_at, which makes the loan eligible for a fresh reminder.
+    due_at = models.DateTimeField()
+    sent_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["loan", "kind", "due_at"], name="unique_reminder_per_due_date"),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} reminder for loan {self.loan_id}"
+
+
+class Watermark(models.Model):
+    """Named high-water mark for incremental jobs (e.g. reminders over newly overdue loans)."""
+    name = models.CharField(max_length=64, unique=True)
+    position = models.DateTimeField(null=True, blank=True)
+    # Id of the last CirculationEvent consumed by an event reader of this name
+    last_event_id = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} @ {self.position or self.last_event_id}"
+
+
+def _event_ref(model):
+    # History outlives the rows it mentions: no FK constraint, no index
+    return models.ForeignKey(
+        model, on_delete=models.DO_NOTHING, db_constraint=False, db_index=False,
+        null=True, blank=True, related_name="+",
+    )
+
+
+class CirculationEvent(models.Model):
+    """Append-only circulation history, one narrow row per state change.
+
+    Rows are written in the same transaction as the change they describe
+    (see services/events.py) and are never updated or deleted; readers
+    consume them in id order behind a named Watermark.
+    """
+    CHECKOUT = "checkout"
+    RETURN = "return"
+    RENEW = "renew"
+    RESERVE = "reserve"
+    RELEASE = "release"
+    STATUS = "status"
+    FINE = "fine"
+    PAYMENT = "payment"
+
+    KIND_CHOICES = [
+        (CHECKOUT, "Checkout"),
+        (RETURN, "Return"),
+        (RENEW, "Renewal"),
+        (RESERVE, "Copy reserved"),
+        (RELEASE, "Copy released"),
+        (STATUS, "Status change"),
+        (FINE, "Fine assessed"),
+        (PAYMENT, "Fine paid"),
+    ]
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    occurred_at = models.DateTimeField(default=timezone.now)
+    # Stamped by services.events.record(); readers settle on this, not on occurred_at
+    recorded_at = models.DateTimeField(default=timezone.now)
+    user = _event_ref(settings.AUTH_USER_MODEL)
+    book = _event_ref("Book")
+    copy = _event_ref("BookCopy")
+    loan = _event_ref("Loan")
+    request = _event_ref("PickupRequest")
+    # New copy/request status for STATUS events
+    status = models.CharField(max_length=20, blank=True)
+    # Change in the amount owed for FINE events (negative when a fine shrinks), amount paid for PAYMENT
+    amount = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk} at {self.occurred_at:%Y-%m-%d %H:%M}"
+
+
+class CirculationCounts(models.Model):
+    """Counters shared by the circulation rollups (see services/rollups.py)."""
+    loans = models.PositiveIntegerField(default=0)
+    returns = models.PositiveIntegerField(default=0)
+    renewals = models.PositiveIntegerField(default=0)
+    fines_assessed = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal("0.00"))
+    fines_paid = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal("0.00"))
+
+    class Meta:
+        abstract = True
+
+
+class DailyStat(CirculationCounts):
+    """Library-wide circulation totals for one day."""
+    day = models.DateField(unique=True)
+
+    class Meta:
+        ordering = ["-day"]
+
+    def __str__(self):
+        return f"Circulation on {self.day}"
+
+
+class DailyBookStat(CirculationCounts):
+    """Circulation of one title on one day; ``category`` is copied from the book when the row is created."""
+    day = models.DateField()
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name="daily_stats")
+    category = models.ForeignKey("Category", null=True, blank=True, on_delete=models.SET_NULL, related_name="+")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["day", "book"], name="unique_daily_book_stat"),
+        ]
+        indexes = [
+            models.Index(fields=["book", "day"]),
+            models.Index(fields=["category", "day"]),
+        ]
+
+    def __str__(self):
+        return f"Circulation of {self.book_id} on {self.day}"
+
+
+class BookStat(CirculationCounts):
+    """All-time circulation of one title, so top-N lists read one narrow table."""
+    book = models.OneToOneField(Book, on_delete=models.CASCADE, primary_key=True, related_name="stat")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["-loans"]),
+        ]
+
+    def __str__(self):
+        return f"Circulation totals for {self.book_id}"
+
+
+class ReportJob(models.Model):
+    """A staff-requested report, generated by the report worker into a CSV file.
+
+    Identical requests (same ``key``) share one queued or running job, and a
+    recently finished one is handed out again instead of regenerating it
+    (see services/report_jobs.py).
+    """
+    KIND_OVERDUES = "overdues"
+    KIND_TOP_BORROWED = "top_borrowed"
+    KIND_FINES_LEDGER = "fines_ledger"
+    KIND_LOAN_HISTORY = "loan_history"
+
+    KIND_CHOICES = [
+        (KIND_OVERDUES, "Overdue loans"),
+        (KIND_TOP_BORROWED, "Top borrowed titles"),
+        (KIND_FINES_LEDGER, "Fines ledger"),
+        (KIND_LOAN_HISTORY, "Full loan history"),
+    ]
+
+    STATUS_QUEUED = "QUEUED"
+    STATUS_RUNNING = "RUNNING"
+    STATUS_DONE = "DONE"
+    STATUS_FAILED = "FAILED"
+    STATUS_EXPIRED = "EXPIRED"
+
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, "Queued"),
+        (STATUS_RUNNING, "Running"),
+        (STATUS_DONE, "Ready"),
+        (STATUS_FAILED, "Failed"),
+        (STATUS_EXPIRED, "Expired"),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    params = models.JSONField(default=dict, blank=True)
+    key = models.CharField(max_length=64)  # hash of kind and params
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    requested_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name="report_jobs")
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    # Token of the worker run that claimed the job; a requeued job gets a new one
+    claim = models.CharField(max_length=32, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    expires_at = models.DateTimeField(null=True, blank=True)
+    # File name inside the report storage (MEDIA_ROOT/reports), set once generated
+    artifact = models.CharField(max_length=255, blank=True)
+    rows = models.PositiveIntegerField(default=0)
+    size = models.PositiveBigIntegerField(default=0)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["key"],
+                name="unique_active_report_job",
+                condition=models.Q(status__in=["QUEUED", "RUNNING"]),
+            )
+        ]
+        indexes = [
+            models.Index(fields=["status", "created_at"]),
+            models.Index(fields=["key", "-created_at"]),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} report #{self.pk} ({self.status})"
+
+    @property
+    def is_pending(self):
+        return self.status in (self.STATUS_QUEUED, self.STATUS_RUNNING)
+
+
 class Policy(models.Model):
     # Single-row table to allow admin to tweak policies without code changes
     student_loan_limit = models.PositiveIntegerField(default=5)
@@ -293,3 +538,83 @@ class PickupRequestItem(models.Model):
         if self.assigned_copy_id:
             return f"{base} -> {self.assigned_copy.barcode}"
         return base
+
+
+class HoldQueue(models.Model):
+    """Per-title sequence counters for the hold waitlist.
+
+    Waiting holds of a book carry contiguous ``seq`` values (leaving the
+    queue renumbers the holds behind), so a hold's position is
+    ``seq - head_seq`` without counting rows. Lock this row to change the queue.
+    """
+    book = models.OneToOneField(Book, on_delete=models.CASCADE, primary_key=True, related_name="hold_queue")
+    last_seq = models.PositiveBigIntegerField(default=0)  # seq of the newest waiting hold
+    head_seq = models.PositiveBigIntegerField(default=0)  # seq of the last hold offered a copy
+
+    def __str__(self):
+        return f"Hold queue for {self.book_id} ({self.last_seq - self.head_seq} waiting)"
+
+
+class Hold(models.Model):
+    STATUS_WAITING = "WAITING"
+    STATUS_OFFERED = "OFFERED"
+    STATUS_CANCELED = "CANCELED"
+
+    STATUS_CHOICES = [
+        (STATUS_WAITING, "Waiting"),
+        (STATUS_OFFERED, "Offered"),
+        (STATUS_CANCELED, "Canceled"),
+    ]
+
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name="holds")
+    patron = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="holds")
+    seq = models.PositiveBigIntegerField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_WAITING)
+    created_at = models.DateTimeField(auto_now_add=True)
+    offered_at = models.DateTimeField(null=True, blank=True)
+    # Pickup request created for the patron when a copy was offered
+    request = models.ForeignKey("PickupRequest", on_delete=models.SET_NULL, null=True, blank=True, related_name="holds")
+
+    class Meta:
+        ordering = ["book", "seq"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["book", "patron"],
+                name="unique_waiting_hold_per_patron",
+                condition=models.Q(status="WAITING"),
+            )
+        ]
+        indexes = [
+            models.Index(fields=["book", "seq"], name="hold_waiting_seq_idx", condition=models.Q(status="WAITING")),
+            models.Index(fields=["patron", "-created_at"]),
+        ]
+
+    def __str__(self):
+        return f"Hold #{self.seq} on {self.book_id} by {self.patron} ({self.status})"
+
+    @property
+    def position(self):
+        """1-based place in the waitlist; needs ``select_related('book__hold_queue')``."""
+        if self.status != self.STATUS_WAITING:
+            return None
+        return self.seq - self.book.hold_queue.head_seq
+
+
+class AccountSummary(models.Model):
+    """Per-patron counters kept in step by circulation, fine and cart operations.
+
+    Refreshed inside the same transaction as the change (see
+    services/account.py); `manage.py rebuild_account_summaries` repairs drift
+    and refreshes overdue counts, which change with time alone.
+    """
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True, related_name="account_summary")
+    active_loans = models.PositiveIntegerField(default=0)
+    overdue_loans = models.PositiveIntegerField(default=0)
+    next_due_at = models.DateTimeField(null=True, blank=True)
+    unpaid_fines = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal("0.00"))
+    pending_requests = models.PositiveIntegerField(default=0)
+    cart_items = models.PositiveIntegerField(default=0)
+    refreshed_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Account summary for {self.user_id}"
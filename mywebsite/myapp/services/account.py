@@ -0,0 +1,104 @@
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.db.models import Count, DecimalField, IntegerField, Min, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from ..models import AccountSummary, CartItem, Fine, Loan, PickupRequest
+
+OPEN_REQUEST_STATUSES = (
+    PickupRequest.STATUS_PENDING,
+    PickupRequest.STATUS_PREPARING,
+    PickupRequest.STATUS_READY,
+)
+
+
+def _scalar(qs, group_field, expr, output_field, default):
+    """Correlated subquery returning one aggregate per user (or ``default``)."""
+    sub = qs.filter(**{group_field: OuterRef("pk")}).order_by().values(group_field).annotate(v=expr).values("v")
+    return Coalesce(Subquery(sub, output_field=output_field), Value(default), output_field=output_field)
+
+
+def _summary_rows(user_ids, now):
+    open_loans = Loan.objects.filter(returned_at__isnull=True)
+    money = DecimalField(max_digits=10, decimal_places=2)
+    return (
+        get_user_model().objects.filter(pk__in=user_ids)
+        .annotate(
+            s_active=_scalar(open_loans, "borrower", Count("id"), IntegerField(), 0),
+            s_overdue=_scalar(open_loans.filter(due_at__lt=now), "borrower", Count("id"), IntegerField(), 0),
+            s_next_due=Subquery(
+                open_loans.filter(borrower=OuterRef("pk")).order_by().values("borrower").annotate(v=Min("due_at")).values("v")
+            ),
+            s_unpaid=_scalar(Fine.objects.filter(paid_at__isnull=True), "loan__borrower", Sum("amount"), money, Decimal("0.00")),
+            s_requests=_scalar(
+                PickupRequest.objects.filter(status__in=OPEN_REQUEST_STATUSES), "requester", Count("id"), IntegerField(), 0
+            ),
+            s_cart=_scalar(CartItem.objects.all(), "cart__owner", Count("id"), IntegerField(), 0),
+        )
+        .values_list("pk", "s_active", "s_overdue", "s_next_due", "s_unpaid", "s_requests", "s_cart")
+    )
+
+
+def refresh_account_summaries(user_ids) -> list:
+    """
+    Recompute the summary rows for ``user_ids`` from source tables.
+
+    One aggregate SELECT plus one bulk upsert, so call it inside the
+    transaction that changed the loans/fines/requests/cart being summarized.
+    """
+    user_ids = {uid for uid in user_ids if uid is not None}
+    if not user_ids:
+        return []
+    now = timezone.now()
+    rows = [
+        AccountSummary(
+            user_id=uid,
+            active_loans=active,
+            overdue_loans=overdue,
+            next_due_at=next_due,
+            unpaid_fines=unpaid,
+            pending_requests=requests,
+            cart_items=cart,
+            refreshed_at=now,
+        )
+        for uid, active, overdue, next_due, unpaid, requests, cart in _summary_rows(user_ids, now)
+    ]
+    AccountSummary.objects.bulk_create(
+        rows,
+        update_conflicts=True,
+        unique_fields=["user"],
+        update_fields=[
+            "active_loans", "overdue_loans", "next_due_at", "unpaid_fines",
+            "pending_requests", "cart_items", "refreshed_at",
+        ],
+    )
+    return rows
+
+
+def refresh_account_summary(user) -> AccountSummary:
+    rows = refresh_account_summaries([getattr(user, "pk", user)])
+    return rows[0] if rows else None
+
+
+def get_account_summary(user) -> AccountSummary:
+    """
+    Return the patron's summary in one query, never writing.
+
+    Rows are created with the user (create_account_summary) or by
+    ``manage.py rebuild_account_summaries``; until then an unsaved zero
+    summary stands in.
+    """
+    if get_user_model().account_summary.is_cached(user):
+        try:
+            return user.account_summary
+        except AccountSummary.DoesNotExist:
+            return AccountSummary(user_id=user.pk)
+    return AccountSummary.objects.filter(user_id=user.pk).first() or AccountSummary(user_id=user.pk)
+
+
+def create_account_summary(sender, instance, created, raw=False, **kwargs):
+    """post_save receiver for the user model: a new patron starts with an all-zero summary row."""
+    if created and not raw:
+        AccountSummary.objects.bulk_create([AccountSummary(user_id=instance.pk)], ignore_conflicts=True)
@@ -0,0 +1,193 @@
+from datetime import datetime, time, timedelta
+from itertools import islice
+
+from django.core.cache import cache
+from django.db.models import Avg, Count, F, Q
+from django.db.models.functions import TruncWeek
+from django.utils import timezone
+
+from ..models import BookCopy, Category, Loan
+
+try:
+    import numpy as np
+except ImportError:  # optional dependency; analytics report themselves unavailable without it
+    np = None
+
+ANALYTICS_WEEKS = 26
+ANALYTICS_CHUNK_ROWS = 20000
+ANALYTICS_CACHE_KEY = "circulation-analytics:{day}"
+
+DAY = 86400.0
+WEEK = 7 * DAY
+# Upper bucket edges in days (a value falls in the first bucket whose edge it does not exceed)
+LATENESS_EDGES = [0, 1, 3, 7, 14, 30]
+LATENESS_LABELS = ["On time", "1 day", "2-3 days", "4-7 days", "1-2 weeks", "2-4 weeks", "Over 30 days"]
+DURATION_EDGES = [7, 14, 21, 28, 42, 56]
+DURATION_LABELS = ["Up to 1 week", "1-2 weeks", "2-3 weeks", "3-4 weeks", "4-6 weeks", "6-8 weeks", "Over 8 weeks"]
+
+
+def available():
+    return np is not None
+
+
+def window_start(today=None):
+    """Midnight on the Monday ANALYTICS_WEEKS - 1 weeks before this week's Monday."""
+    today = today or timezone.localdate()
+    monday = today - timedelta(days=today.weekday(), weeks=ANALYTICS_WEEKS - 1)
+    return datetime.combine(monday, time.min, tzinfo=timezone.get_current_timezone())
+
+
+def _timestamps(values):
+    return np.array([v.timestamp() if v is not None else np.nan for v in values], dtype=np.float64)
+
+
+def _ids(values):
+    return np.array([v if v is not None else -1 for v in values], dtype=np.int64)
+
+
+def load_loan_columns(start, end, chunk_size=ANALYTICS_CHUNK_ROWS):
+    """
+    Load the loans active in [start, end) as NumPy columns.
+
+    Only five columns are selected and rows are streamed with iterator(),
+    converted ``chunk_size`` rows at a time, so Python objects for at most
+    one chunk exist at once. Timestamps are epoch seconds with NaN for "not
+    returned"; missing ids are -1.
+    """
+    rows = (
+        Loan.objects.filter(checked_out_at__lt=end)
+        .filter(Q(returned_at__isnull=True) | Q(returned_at__gte=start))
+        .order_by()
+        .values_list("checked_out_at", "due_at", "returned_at", "copy__book_id", "copy__book__category_id")
+        .iterator(chunk_size=chunk_size)
+    )
+    parts = []
+    while chunk := list(islice(rows, chunk_size)):
+        out, due, ret, book, category = zip(*chunk)
+        parts.append((_timestamps(out), _timestamps(due), _timestamps(ret), _ids(book), _ids(category)))
+    names = ("out", "due", "ret", "book", "category")
+    if not parts:
+        return {name: np.empty(0, dtype=np.int64 if name in ("book", "category") else np.float64) for name in names}
+    return {name: np.concatenate([part[i] for part in parts]) for i, name in enumerate(names)}
+
+
+def _percentiles(values):
+    if not values.size:
+        return {"p50": None, "p90": None, "p99": None}
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return {"p50": round(float(p50), 2), "p90": round(float(p90), 2), "p99": round(float(p99), 2)}
+
+
+def _histogram(values, edges, labels):
+    counts = np.bincount(np.digitize(values, edges, right=True), minlength=len(labels))
+    return [{"label": label, "count": int(count)} for label, count in zip(labels, counts)]
+
+
+def _weekly(stamps, start_ts):
+    stamps = stamps[stamps >= start_ts]
+    weeks = ((stamps - start_ts) // WEEK).astype(np.int64)
+    return np.bincount(weeks, minlength=ANALYTICS_WEEKS)[:ANALYTICS_WEEKS]
+
+
+def compute_analytics(now=None, chunk_size=ANALYTICS_CHUNK_ROWS) -> dict:
+    """
+    Weekly loans and returns, loan duration and lateness distributions and
+    per-category utilization over the last ANALYTICS_WEEKS weeks.
+
+    Everything after the column load is vectorized: per-week counts are a
+    ``bincount`` over week offsets, distributions come from ``digitize``,
+    percentiles from ``percentile`` and category loan-days from a weighted
+    ``bincount`` over the clipped loan intervals.
+    """
+    now = now or timezone.now()
+    start = window_start(timezone.localdate(now))
+    start_ts, now_ts = start.timestamp(), now.timestamp()
+    cols = load_loan_columns(start, now, chunk_size)
+    out, due, ret, book, category = cols["out"], cols["due"], cols["ret"], cols["book"], cols["category"]
+
+    returned = ~np.isnan(ret)
+    returned_ts = ret[returned]
+    in_window = returned_ts >= start_ts
+    duration = (returned_ts - out[returned])[in_window] / DAY
+    lateness = (returned_ts - due[returned])[in_window] / DAY
+    late = lateness[lateness > 0]
+
+    # Loan-days inside the window: each loan clipped to [start, min(returned, now)]
+    ends = np.where(returned, np.minimum(np.nan_to_num(ret, nan=now_ts), now_ts), now_ts)
+    loan_days = np.clip(ends - np.maximum(out, start_ts), 0, None) / DAY
+    category_ids, inverse = np.unique(category, return_inverse=True)
+    days_by_category = np.bincount(inverse, weights=loan_days, minlength=category_ids.size)
+
+    wanted = [int(pk) for pk in category_ids if pk >= 0]
+    copies = dict(
+        BookCopy.objects.filter(book__category_id__in=wanted)
+        .values_list("book__category_id").annotate(n=Count("id")).order_by()
+    )
+    names = dict(Category.objects.filter(pk__in=wanted).values_list("pk", "name"))
+    window_days = (now_ts - start_ts) / DAY
+    utilization = []
+    for pk, days in zip(category_ids.tolist(), days_by_category.tolist()):
+        n = copies.get(pk, 0)
+        utilization.append({
+            "category": names.get(pk, "Uncategorized"),
+            "copies": n,
+            "loan_days": round(days, 1),
+            "utilization": round(days / (n * window_days), 4) if n and window_days else None,
+        })
+    utilization.sort(key=lambda row: row["loan_days"], reverse=True)
+
+    return {
+        "generated_at": now.isoformat(),
+        "weeks": [(start.date() + timedelta(weeks=i)).isoformat() for i in range(ANALYTICS_WEEKS)],
+        "loans_per_week": _weekly(out, start_ts).tolist(),
+        "returns_per_week": _weekly(returned_ts, start_ts).tolist(),
+        "titles_borrowed": int(np.unique(book[out >= start_ts]).size),
+        "duration_days": {**_percentiles(duration), "histogram": _histogram(duration, DURATION_EDGES, DURATION_LABELS)},
+        "lateness_days": {
+            **_percentiles(late),
+            "late_rate": round(float(late.size / lateness.size), 4) if lateness.size else None,
+            "histogram": _histogram(lateness, LATENESS_EDGES, LATENESS_LABELS),
+        },
+        "utilization": utilization,
+    }
+
+
+def cached_analytics(now=None) -> dict:
+    """compute_analytics() computed at most once per day (per cache)."""
+    now = now or timezone.now()
+    key = ANALYTICS_CACHE_KEY.format(day=timezone.localdate(now).isoformat())
+    data = cache.get(key)
+    if data is None:
+        data = compute_analytics(now)
+        cache.set(key, data, int(DAY))
+    return data
+
+
+def orm_summary(now=None) -> dict:
+    """
+    The ORM-aggregation counterpart of compute_analytics() for benchmarking:
+    weekly loans and returns, mean duration and lateness, and per-category loan
+    counts as GROUP BY queries. Percentiles and histograms have no portable
+    SQL equivalent and are left out.
+    """
+    now = now or timezone.now()
+    start = window_start(timezone.localdate(now))
+    loans = Loan.objects.order_by()
+    returned = loans.filter(returned_at__gte=start, returned_at__lt=now)
+    return {
+        "loans_per_week": dict(
+            loans.filter(checked_out_at__gte=start, checked_out_at__lt=now)
+            .annotate(week=TruncWeek("checked_out_at")).values_list("week").annotate(n=Count("id"))
+        ),
+        "returns_per_week": dict(
+            returned.annotate(week=TruncWeek("returned_at")).values_list("week").annotate(n=Count("id"))
+        ),
+        "means": returned.aggregate(
+            duration=Avg(F("returned_at") - F("checked_out_at")),
+            lateness=Avg(F("returned_at") - F("due_at")),
+        ),
+        "loans_per_category": dict(
+            loans.filter(Q(returned_at__isnull=True) | Q(returned_at__gte=start), checked_out_at__lt=now)
+            .values_list("copy__book__category_id").annotate(n=Count("id"))
+        ),
+    }
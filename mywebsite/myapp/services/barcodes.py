@@ -0,0 +1,58 @@
+from django.db.models import OuterRef, Subquery
+
+from ..models import BookCopy, Loan, PickupRequestItem
+from .account import OPEN_REQUEST_STATUSES
+
+
+def _scan_queryset():
+    active_loans = Loan.objects.filter(copy=OuterRef("pk"), returned_at__isnull=True)
+    open_items = PickupRequestItem.objects.filter(
+        assigned_copy=OuterRef("pk"), request__status__in=OPEN_REQUEST_STATUSES
+    ).order_by("-request__requested_at")
+    return BookCopy.objects.select_related("book").annotate(
+        loan_id=Subquery(active_loans.values("id")[:1]),
+        loan_due_at=Subquery(active_loans.values("due_at")[:1]),
+        loan_borrower=Subquery(active_loans.values("borrower__username")[:1]),
+        request_id=Subquery(open_items.values("request_id")[:1]),
+        request_item_id=Subquery(open_items.values("id")[:1]),
+        request_status=Subquery(open_items.values("request__status")[:1]),
+        request_requester=Subquery(open_items.values("request__requester__username")[:1]),
+    )
+
+
+def resolve_barcode(barcode, queryset=None):
+    """
+    Return the BookCopy for ``barcode`` (or None) in one query.
+
+    The lookup is on the unique barcode index; ``queryset`` lets callers add
+    select_for_update() or annotations.
+    """
+    barcode = (barcode or "").strip()
+    if not barcode:
+        return None
+    qs = queryset if queryset is not None else BookCopy.objects.select_related("book")
+    return qs.filter(barcode=barcode).first()
+
+
+def scan(barcode):
+    """Copy, book, active loan and open request assignment for ``barcode`` as a dict."""
+    copy = resolve_barcode(barcode, _scan_queryset())
+    if copy is None:
+        return {"found": False, "barcode": (barcode or "").strip()}
+    return {
+        "found": True,
+        "barcode": copy.barcode,
+        "copy": {"id": copy.id, "status": copy.status, "location": copy.location},
+        "book": {"id": copy.book_id, "title": copy.book.title, "isbn13": copy.book.isbn13},
+        "loan": {
+            "id": copy.loan_id,
+            "borrower": copy.loan_borrower,
+            "due_at": copy.loan_due_at.isoformat(),
+        } if copy.loan_id else None,
+        "request": {
+            "id": copy.request_id,
+            "item_id": copy.request_item_id,
+            "status": copy.request_status,
+            "requester": copy.request_requester,
+        } if copy.request_id else None,
+    }
@@ -0,0 +1,103 @@
+from django.contrib.auth import get_user_model
+from django.db.models import Count, Exists, IntegerField, Min, OuterRef, Q, Subquery
+from django.db.models.functions import Lower
+from django.utils import timezone
+
+from ..models import Loan
+from .pagination import keyset_page
+
+BORROWER_PAGE_SIZE = 25
+LOAN_PAGE_SIZE = 50
+AUTOCOMPLETE_LIMIT = 10
+
+
+def _lowered():
+    """Users annotated with the LOWER() expressions the 0025 migration indexes."""
+    return get_user_model().objects.annotate(username_lower=Lower("username"), email_lower=Lower("email"))
+
+
+def _prefix(column, prefix):
+    """
+    ``column`` starts with ``prefix`` as a range, ``prefix <= column < successor``.
+
+    A range is an index seek on every backend, where LIKE 'x%' only uses an
+    index under particular collations; the startswith test keeps the match
+    exact whatever the collation orders between the bounds.
+    """
+    successor = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return Q(**{f"{column}__gte": prefix, f"{column}__lt": successor, f"{column}__startswith": prefix})
+
+
+def find_borrower(q):
+    """The user whose username, or else email, equals ``q`` ignoring case (two index lookups)."""
+    q = (q or "").strip().lower()
+    if not q:
+        return None
+    users = _lowered().order_by("pk")
+    return users.filter(username_lower=q).first() or users.filter(email_lower=q).first()
+
+
+def search_borrowers(prefix, limit=AUTOCOMPLETE_LIMIT):
+    """Users whose username or email starts with ``prefix`` (ignoring case), by username."""
+    prefix = (prefix or "").strip().lower()
+    if not prefix:
+        return get_user_model().objects.none()
+    return (
+        _lowered().filter(_prefix("username_lower", prefix) | _prefix("email_lower", prefix))
+        .order_by("username")[:limit]
+    )
+
+
+def _open_loans():
+    return Loan.objects.filter(borrower=OuterRef("pk"), returned_at__isnull=True).order_by()
+
+
+def _count(loans):
+    return Subquery(loans.values("borrower").annotate(n=Count("pk")).values("n"), output_field=IntegerField())
+
+
+def borrower_summaries(now=None, prefix="", cursor="", size=BORROWER_PAGE_SIZE):
+    """
+    One keyset page (by username) of borrowers with open loans, each with its
+    open loan count, overdue count and earliest due date.
+
+    Users are walked in username order and the figures are correlated
+    subqueries over the open-loan partial index on (borrower, due_at), so a
+    page touches only its own borrowers' loans however many are open.
+    """
+    now = now or timezone.now()
+    open_loans = _open_loans()
+    users = _lowered() if prefix else get_user_model().objects.all()
+    if prefix:
+        prefix = prefix.strip().lower()
+        users = users.filter(_prefix("username_lower", prefix) | _prefix("email_lower", prefix))
+    users = (
+        users.filter(Exists(open_loans))
+        .annotate(
+            open_count=_count(open_loans),
+            overdue_count=_count(open_loans.filter(due_at__lt=now)),
+            earliest_due=Subquery(open_loans.order_by("due_at").values("due_at")[:1]),
+        )
+        .values("pk", "username", "email", "open_count", "overdue_count", "earliest_due")
+    )
+    return keyset_page(users, ("username",), cursor, size)
+
+
+def borrower_loans(borrower, cursor="", size=LOAN_PAGE_SIZE):
+    """One keyset page of ``borrower``'s open loans, soonest due first."""
+    loans = (
+        Loan.objects.filter(borrower=borrower, returned_at__isnull=True)
+        .select_related("copy__book")
+        .only("checked_out_at", "due_at", "borrower_id", "copy__barcode", "copy__book__title")
+    )
+    return keyset_page(loans, ("due_at", "pk"), cursor, size)
+
+
+def borrower_summary(borrower, now=None) -> dict:
+    """Open loan count, overdue count and earliest due date for one borrower, in one aggregate."""
+    now = now or timezone.now()
+    return Loan.objects.filter(borrower=borrower, returned_at__isnull=True).order_by().aggregate(
+        open_count=Count("pk"),
+        overdue_count=Count("pk", filter=Q(due_at__lt=now)),
+        earliest_due=Min("due_at"),
+    )
@@ -0,0 +1,195 @@
+from dataclasses import dataclass
+
+from django.db import transaction
+from django.db.models import Case, DateTimeField, F, Value, When
+
+from ..models import BookCopy, CirculationEvent, Fine, HoldQueue, Loan, PickupRequest
+from .account import refresh_account_summaries, refresh_account_summary
+from .events import loan_event, record, status_event
+from .fines import settle_overdue_fines
+from .holds import offer_copies
+from .policy import calculate_due_at, can_renew, compute_renew_due_at
+
+CHECKOUT_STATUSES = (BookCopy.STATUS_RESERVED, BookCopy.STATUS_AVAILABLE)
+
+
+class CirculationError(Exception):
+    """A circulation action cannot be applied; the message is shown to staff."""
+
+
+def checkout_request(pr, items, now):
+    """
+    Turn a locked pickup request into loans with set-based writes.
+
+    ``items`` are the request's PickupRequestItems with ``assigned_copy``
+    selected. Copies are flipped to ON_LOAN with one conditional UPDATE whose
+    rowcount guards against concurrent status changes, loans are created with
+    one bulk INSERT and the request is closed with one UPDATE. A
+    CirculationError leaves nothing written.
+    """
+    for it in items:
+        if it.assigned_copy.status not in CHECKOUT_STATUSES:
+            raise CirculationError(f'Copy {it.assigned_copy.barcode} not reservable for checkout.')
+
+    copy_ids = [it.assigned_copy_id for it in items]
+    with transaction.atomic():
+        flipped = (
+            BookCopy.objects.filter(id__in=copy_ids, status__in=CHECKOUT_STATUSES)
+            .update(status=BookCopy.STATUS_ON_LOAN)
+        )
+        if flipped != len(set(copy_ids)):
+            raise CirculationError('One or more copies changed status during checkout; please retry.')
+
+        due_at = calculate_due_at(now, pr.requester)
+        loans = Loan.objects.bulk_create([
+            Loan(borrower_id=pr.requester_id, copy_id=copy_id, due_at=due_at)
+            for copy_id in copy_ids
+        ])
+
+        pr.status = PickupRequest.STATUS_PICKED_UP
+        pr.picked_up_at = now
+        pr.save(update_fields=['status', 'picked_up_at'])
+        book_ids = {it.assigned_copy_id: it.book_id for it in items}
+        record([
+            *(
+                CirculationEvent(
+                    kind=CirculationEvent.CHECKOUT, occurred_at=now, user_id=pr.requester_id,
+                    book_id=book_ids[loan.copy_id], copy_id=loan.copy_id, loan_id=loan.pk, request_id=pr.pk,
+                )
+                for loan in loans
+            ),
+            status_event(pr.status, now, user_id=pr.requester_id, request_id=pr.pk),
+        ])
+        refresh_account_summary(pr.requester)
+    return loans
+
+
+def return_loans(loans, now):
+    """
+    Close ``loans`` (active Loan objects with ``copy`` selected) in bulk.
+
+    Loans are closed with one conditional UPDATE, their copies are made
+    AVAILABLE with one UPDATE and overdue fines are settled in bulk (running
+    fines frozen at their final amount, missing ones inserted). Returned
+    copies are then offered to waiting holds. Returns {loan_id: Fine or None}
+    for the loans actually closed.
+    """
+    loans = [loan for loan in loans if loan.returned_at is None]
+    if not loans:
+        return {}
+    loan_ids = [loan.id for loan in loans]
+    with transaction.atomic():
+        closed = Loan.objects.filter(id__in=loan_ids, returned_at__isnull=True).update(returned_at=now)
+        if closed != len(loan_ids):
+            raise CirculationError('One or more loans were returned concurrently; please rescan.')
+        (
+            BookCopy.objects.filter(id__in=[loan.copy_id for loan in loans])
+            .exclude(status=BookCopy.STATUS_AVAILABLE)
+            .update(status=BookCopy.STATUS_AVAILABLE)
+        )
+        for loan in loans:
+            loan.returned_at = now
+            loan.copy.status = BookCopy.STATUS_AVAILABLE
+        record(loan_event(CirculationEvent.RETURN, loan, now) for loan in loans)
+        fines = settle_overdue_fines(loans, now)
+        offer_copies([(loan.copy_id, loan.copy.book_id) for loan in loans], now)
+        refresh_account_summaries({loan.borrower_id for loan in loans})
+    return fines
+
+
+@dataclass
+class CheckinResult:
+    barcode: str
+    status: str  # 'returned', 'not_on_loan' or 'not_found'
+    loan: Loan = None
+    fine: Fine = None
+
+
+def checkin_barcodes(barcodes, now):
+    """
+    Return every scanned barcode that has an active loan, in one transaction.
+
+    Barcodes are resolved to active loans with one locked query; unknown
+    barcodes cost one extra lookup to tell "not on loan" from "not found".
+    Returns one CheckinResult per distinct barcode, in scan order.
+    """
+    barcodes = list(dict.fromkeys(b.strip() for b in barcodes if b and b.strip()))
+    if not barcodes:
+        return []
+    with transaction.atomic():
+        loans = {
+            loan.copy.barcode: loan
+            for loan in Loan.objects.select_for_update(of=('self',))
+            .filter(returned_at__isnull=True, copy__barcode__in=barcodes)
+            .select_related('copy', 'copy__book', 'borrower')
+        }
+        fines = return_loans(loans.values(), now)
+    unresolved = [b for b in barcodes if b not in loans]
+    known = set(BookCopy.objects.filter(barcode__in=unresolved).values_list('barcode', flat=True)) if unresolved else set()
+
+    results = []
+    for barcode in barcodes:
+        loan = loans.get(barcode)
+        if loan is not None:
+            results.append(CheckinResult(barcode, 'returned', loan=loan, fine=fines.get(loan.id)))
+        else:
+            results.append(CheckinResult(barcode, 'not_on_loan' if barcode in known else 'not_found'))
+    return results
+
+
+@dataclass
+class RenewalOutcome:
+    loan: Loan
+    renewed: bool
+    reason: str = ""
+    due_at: object = None
+
+
+def renew_loans(loans, now) -> list:
+    """
+    Renew every eligible loan in ``loans`` (a Loan queryset) with one UPDATE.
+
+    The loans are locked and read once, titles with patrons waiting on the
+    hold queue are looked up in one query, and new due dates (policy period
+    from the later of now or the current due date) are written with a single
+    CASE UPDATE. Returns one RenewalOutcome per loan, renewed or not.
+    """
+    with transaction.atomic():
+        loans = list(
+            loans.select_for_update(of=("self",))
+            .select_related("borrower", "borrower__profile", "copy", "copy__book")
+            .order_by("due_at", "pk")
+        )
+        on_hold = set(
+            HoldQueue.objects.filter(book_id__in={loan.copy.book_id for loan in loans}, last_seq__gt=F("head_seq"))
+            .values_list("book_id", flat=True)
+        ) if loans else set()
+
+        outcomes = []
+        for loan in loans:
+            if loan.returned_at is not None:
+                outcomes.append(RenewalOutcome(loan, False, "already returned"))
+            elif not can_renew(loan):
+                outcomes.append(RenewalOutcome(loan, False, "renewal limit reached"))
+            elif loan.copy.book_id in on_hold:
+                outcomes.append(RenewalOutcome(loan, False, "another patron is waiting for this title"))
+            else:
+                outcomes.append(RenewalOutcome(loan, True, due_at=compute_renew_due_at(now, loan)))
+
+        renewed = [o for o in outcomes if o.renewed]
+        if renewed:
+            Loan.objects.filter(pk__in=[o.loan.pk for o in renewed]).update(
+                due_at=Case(
+                    *[When(pk=o.loan.pk, then=Value(o.due_at)) for o in renewed],
+                    output_field=DateTimeField(),
+                ),
+                renew_count=F("renew_count") + 1,
+                overdue_at=None,
+            )
+            for o in renewed:
+                o.loan.due_at = o.due_at
+                o.loan.renew_count += 1
+                o.loan.overdue_at = None
+            record(loan_event(CirculationEvent.RENEW, o.loan, now) for o in renewed)
+            refresh_account_summaries({o.loan.borrower_id for o in renewed})
+    return outcomes
@@ -0,0 +1,77 @@
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from ..models import CirculationEvent, Watermark
+
+# Ids are assigned at INSERT but become visible at COMMIT, so a slow
+# transaction can commit an event below ids a reader has already passed.
+# Readers stop at the first event recorded less than this long ago and pick
+# it up next run. The age is taken from recorded_at, which record() stamps;
+# occurred_at is the caller's business time and may lie well in the past.
+SETTLE_AFTER = timedelta(seconds=30)
+
+
+def record(events) -> int:
+    """Append ``events`` (unsaved CirculationEvents) with one INSERT; call inside the change's transaction."""
+    events = list(events)
+    if events:
+        now = timezone.now()
+        for event in events:
+            event.recorded_at = now
+        CirculationEvent.objects.bulk_create(events)
+    return len(events)
+
+
+def loan_event(kind, loan, at, **fields):
+    """Event for ``loan``; needs ``loan.copy`` selected for the book id."""
+    return CirculationEvent(
+        kind=kind, occurred_at=at, user_id=loan.borrower_id,
+        book_id=loan.copy.book_id, copy_id=loan.copy_id, loan_id=loan.pk, **fields,
+    )
+
+
+def copy_events(kind, copies, at, **fields):
+    """One event per (copy_id, book_id) pair."""
+    return [
+        CirculationEvent(kind=kind, occurred_at=at, copy_id=copy_id, book_id=book_id, **fields)
+        for copy_id, book_id in copies
+    ]
+
+
+def status_event(status, at, **fields):
+    return CirculationEvent(kind=CirculationEvent.STATUS, occurred_at=at, status=status, **fields)
+
+
+def consume(name, handler, batch_size=1000, max_batches=None, now=None) -> dict:
+    """
+    Feed events after watermark ``name`` to ``handler(events)`` in id order.
+
+    Each batch runs in one transaction with the watermark row locked and the
+    watermark only moves past the batch if the handler returns, so a handler
+    that writes to the database sees every event exactly once and readers
+    sharing a name take turns. Events recorded within SETTLE_AFTER are left
+    for the next run. Returns counts for monitoring.
+    """
+    horizon = (now or timezone.now()) - SETTLE_AFTER
+    stats = {"events": 0, "batches": 0}
+    while max_batches is None or stats["batches"] < max_batches:
+        with transaction.atomic():
+            Watermark.objects.get_or_create(name=name)
+            mark = Watermark.objects.select_for_update().get(name=name)
+            events = list(CirculationEvent.objects.filter(pk__gt=mark.last_event_id).order_by("pk")[:batch_size])
+            fetched = len(events)
+            settled = next((i for i, e in enumerate(events) if e.recorded_at >= horizon), len(events))
+            events = events[:settled]
+            if not events:
+                break
+            handler(events)
+            mark.last_event_id = events[-1].pk
+            mark.save(update_fields=["last_event_id", "updated_at"])
+        stats["batches"] += 1
+        stats["events"] += len(events)
+        if len(events) < fetched or fetched < batch_size:
+            break
+    stats["last_event_id"] = Watermark.objects.filter(name=name).values_list("last_event_id", flat=True).first() or 0
+    return stats
@@ -0,0 +1,126 @@
+import csv
+import io
+import zlib
+
+from django.db.models import Sum
+from django.utils import timezone
+
+from ..models import DailyBookStat, Fine, Loan
+from .overdue import open_overdue_loans
+
+# Rows are buffered up to this many characters before a chunk is yielded, so
+# the consumer sees a few large writes instead of one per row.
+CHUNK_CHARS = 64 * 1024
+
+
+def csv_chunks(header, rows, chunk_chars=CHUNK_CHARS):
+    """
+    Yield CSV text for ``header`` and ``rows`` in chunks of about ``chunk_chars``.
+
+    ``rows`` is any iterable of sequences (typically ``values_list(...)
+    .iterator(chunk_size=...)``); it is consumed lazily, so memory stays
+    bounded by one chunk whatever the row count.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= chunk_chars:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def encode_chunks(chunks, encoding="utf-8"):
+    for chunk in chunks:
+        yield chunk.encode(encoding)
+
+
+def gzip_chunks(chunks, level=6):
+    """Compress a stream of bytes chunks into one gzip member, chunk by chunk."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+# Report row sources: each returns (header, rows) with rows streamed from a
+# values_list() iterator so only the written columns are fetched.
+
+def _iso(value):
+    return value.isoformat() if value else ""
+
+
+def overdue_rows(now=None, chunk_size=2000):
+    loans = (
+        open_overdue_loans(now or timezone.now())
+        .order_by("due_at", "pk")
+        .values_list("copy__book__title", "copy__barcode", "borrower__username", "due_at")
+        .iterator(chunk_size=chunk_size)
+    )
+    rows = ((title, barcode, username, _iso(due_at)) for title, barcode, username, due_at in loans)
+    return ["Book", "Barcode", "Borrower", "Due At"], rows
+
+
+def top_borrowed_rows(date_from=None, date_to=None, chunk_size=2000):
+    """All titles borrowed between ``date_from`` and ``date_to`` (inclusive dates), most loans first."""
+    stats = DailyBookStat.objects.all()
+    if date_from:
+        stats = stats.filter(day__gte=date_from)
+    if date_to:
+        stats = stats.filter(day__lte=date_to)
+    rows = (
+        stats.values_list("book__title", "book__isbn13")
+        .annotate(total=Sum("loans"))
+        .filter(total__gt=0)
+        .order_by("-total", "book__title")
+        .iterator(chunk_size=chunk_size)
+    )
+    return ["Title", "ISBN", "Loans"], rows
+
+
+def fines_ledger_rows(date_from=None, date_to=None, chunk_size=2000):
+    fines = Fine.objects.all()
+    if date_from:
+        fines = fines.filter(created_at__date__gte=date_from)
+    if date_to:
+        fines = fines.filter(created_at__date__lte=date_to)
+    fines = (
+        fines.order_by("created_at", "pk")
+        .values_list(
+            "pk", "created_at", "loan__borrower__username", "loan__copy__book__title",
+            "loan__copy__barcode", "amount", "reason", "paid_at",
+        )
+        .iterator(chunk_size=chunk_size)
+    )
+    rows = (
+        (pk, _iso(created_at), username, title, barcode, amount, reason, _iso(paid_at))
+        for pk, created_at, username, title, barcode, amount, reason, paid_at in fines
+    )
+    return ["Fine", "Created At", "Borrower", "Book", "Barcode", "Amount", "Reason", "Paid At"], rows
+
+
+def loan_history_rows(date_from=None, date_to=None, chunk_size=2000):
+    loans = Loan.objects.all()
+    if date_from:
+        loans = loans.filter(checked_out_at__date__gte=date_from)
+    if date_to:
+        loans = loans.filter(checked_out_at__date__lte=date_to)
+    loans = (
+        loans.order_by("checked_out_at", "pk")
+        .values_list(
+            "pk", "checked_out_at", "due_at", "returned_at", "renew_count",
+            "borrower__username", "copy__book__title", "copy__barcode",
+        )
+        .iterator(chunk_size=chunk_size)
+    )
+    rows = (
+        (pk, _iso(out), _iso(due), _iso(returned), renewals, username, title, barcode)
+        for pk, out, due, returned, renewals, username, title, barcode in loans
+    )
+    return ["Loan", "Checked Out At", "Due At", "Returned At", "Renewals", "Borrower", "Book", "Barcode"], rows
@@ -0,0 +1,237 @@
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, Max, Q, Sum
+from django.utils import timezone
+
+from ..models import CirculationEvent, Fine, Loan
+from .account import refresh_account_summaries
+from .events import loan_event, record
+from .pagination import keyset_page
+from .policy import fine_rate_per_day
+
+OVERDUE_REASON_PREFIX = "Overdue"
+
+
+def overdue_reason(days_over):
+    return f"{OVERDUE_REASON_PREFIX} {days_over} day(s)"
+
+
+def overdue_fine(due_at, returned_at, rate=None):
+    """Return (days_over, amount) for a loan returned (or assessed) at ``returned_at``."""
+    if not due_at or returned_at <= due_at:
+        return 0, Decimal("0.00")
+    days_over = max((returned_at.date() - due_at.date()).days, 0)
+    if rate is None:
+        rate = fine_rate_per_day()
+    return days_over, days_over * rate
+
+
+def _overdue_fines(loan_ids):
+    """
+    One query over the overdue fines of ``loan_ids``.
+
+    Returns ({loan_id: running Fine}, {loan_id: amount already charged}); the
+    charged total covers frozen overdue fines, e.g. a running fine the patron
+    paid while the loan was still out.
+    """
+    running, charged = {}, defaultdict(Decimal)
+    fines = Fine.objects.filter(loan_id__in=loan_ids).filter(
+        Q(accruing=True) | Q(reason__startswith=OVERDUE_REASON_PREFIX)
+    )
+    for fine in fines:
+        if fine.accruing:
+            running[fine.loan_id] = fine
+        else:
+            charged[fine.loan_id] += fine.amount
+    return running, charged
+
+
+def settle_overdue_fines(loans, now):
+    """
+    Freeze the overdue fines of ``loans`` being returned at ``now``.
+
+    The running fine (if any) is updated to the final amount, otherwise a new
+    fine is inserted; either way with one bulk write. Returns
+    {loan_id: Fine or None}. Call inside the return transaction with the
+    loans' ``copy`` selected.
+    """
+    rate = fine_rate_per_day()
+    running, charged = _overdue_fines([loan.id for loan in loans])
+    result, to_create, to_update, to_delete, events = {}, [], [], [], []
+    for loan in loans:
+        days_over, amount = overdue_fine(loan.due_at, now, rate)
+        amount -= charged.get(loan.id, 0)
+        fine = running.get(loan.id)
+        previous = fine.amount if fine is not None else 0
+        if amount <= 0:
+            if fine is not None:
+                to_delete.append(fine.id)
+                events.append(loan_event(CirculationEvent.FINE, loan, now, amount=-previous))
+            result[loan.id] = None
+            continue
+        if fine is None:
+            fine = Fine(loan=loan)
+            to_create.append(fine)
+        else:
+            to_update.append(fine)
+        fine.amount, fine.reason, fine.accruing = amount, overdue_reason(days_over), False
+        if amount != previous:
+            events.append(loan_event(CirculationEvent.FINE, loan, now, amount=amount - previous))
+        result[loan.id] = fine
+    if to_delete:
+        Fine.objects.filter(id__in=to_delete).delete()
+    Fine.objects.bulk_update(to_update, ["amount", "reason", "accruing"])
+    Fine.objects.bulk_create(to_create)
+    record(events)
+    return result
+
+
+def accrue_fines(now=None, batch_size=2000) -> dict:
+    """
+    Bring one running Fine per open overdue loan up to date.
+
+    Open loans past their due date are walked in primary-key batches; each
+    batch costs one loan SELECT, one fine SELECT and bulk writes for the rows
+    whose amount changed, so runtime grows linearly with overdue loans and
+    memory stays bounded by ``batch_size``. The rate comes from the current
+    Policy, so a full run after a Policy change reprices every running fine.
+    Running fines of loans that are no longer overdue (renewed, returned
+    elsewhere) are removed first.
+    """
+    now = now or timezone.now()
+    rate = fine_rate_per_day()
+    # A loan accrues a day once its due date is before today; same rule as overdue_fine().
+    cutoff = datetime.combine(now.date(), time.min, tzinfo=now.tzinfo)
+    stats = {"rate": rate, "loans": 0, "created": 0, "updated": 0, "cleared": 0, "batches": 0}
+
+    stale = Fine.objects.filter(accruing=True).filter(Q(loan__returned_at__isnull=False) | Q(loan__due_at__gte=cutoff))
+    with transaction.atomic():
+        cleared = list(stale.values_list(
+            "id", "amount", "loan_id", "loan__borrower_id", "loan__copy_id", "loan__copy__book_id",
+        ))
+        stats["cleared"], _ = Fine.objects.filter(id__in=[row[0] for row in cleared]).delete()
+        record(
+            CirculationEvent(
+                kind=CirculationEvent.FINE, occurred_at=now, amount=-amount,
+                loan_id=loan_id, user_id=borrower_id, copy_id=copy_id, book_id=book_id,
+            )
+            for _, amount, loan_id, borrower_id, copy_id, book_id in cleared
+        )
+        refresh_account_summaries({row[3] for row in cleared})
+
+    overdue = Loan.objects.filter(returned_at__isnull=True, due_at__lt=cutoff).order_by("pk")
+    last_id = 0
+    while True:
+        rows = list(
+            overdue.filter(pk__gt=last_id)
+            .values_list("pk", "borrower_id", "due_at", "copy_id", "copy__book_id")[:batch_size]
+        )
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        stats["batches"] += 1
+        stats["loans"] += len(rows)
+
+        running, charged = _overdue_fines([row[0] for row in rows])
+        to_create, to_update, events, touched = [], [], [], set()
+        for pk, borrower_id, due_at, copy_id, book_id in rows:
+            days_over, amount = overdue_fine(due_at, now, rate)
+            amount -= charged.get(pk, 0)
+            if amount <= 0:
+                continue
+            fine, reason = running.get(pk), overdue_reason(days_over)
+            previous = fine.amount if fine is not None else 0
+            if fine is None:
+                to_create.append(Fine(loan_id=pk, amount=amount, reason=reason, accruing=True))
+            elif fine.amount != amount or fine.reason != reason:
+                fine.amount, fine.reason = amount, reason
+                to_update.append(fine)
+            else:
+                continue
+            touched.add(borrower_id)
+            if amount != previous:
+                events.append(CirculationEvent(
+                    kind=CirculationEvent.FINE, occurred_at=now, amount=amount - previous,
+                    loan_id=pk, user_id=borrower_id, copy_id=copy_id, book_id=book_id,
+                ))
+
+        if not touched:
+            continue
+        with transaction.atomic():
+            Fine.objects.bulk_update(to_update, ["amount", "reason"])
+            # A concurrent return may have frozen the loan meanwhile; the next run reconciles.
+            Fine.objects.bulk_create(to_create, ignore_conflicts=True)
+            record(events)
+            refresh_account_summaries(touched)
+        stats["created"] += len(to_create)
+        stats["updated"] += len(to_update)
+    return stats
+
+
+# Staff fines ledger
+
+LEDGER_PAGE_SIZE = 50
+LEDGER_ORDERING = ("-created_at", "-pk")
+LEDGER_BORROWER_ORDERING = ("loan__borrower__username",)
+
+
+def ledger_fines(borrower_id=None, date_from=None, date_to=None, status=""):
+    """
+    Fines matching the ledger filters: a borrower, an inclusive range of local
+    dates and ``status`` "paid" or "unpaid" (anything else means both).
+    """
+    fines = Fine.objects.all()
+    if borrower_id is not None:
+        fines = fines.filter(loan__borrower_id=borrower_id)
+    tz = timezone.get_current_timezone()
+    # Compare against datetimes, not created_at__date, so the created_at index is usable
+    if date_from:
+        fines = fines.filter(created_at__gte=datetime.combine(date_from, time.min, tzinfo=tz))
+    if date_to:
+        fines = fines.filter(created_at__lt=datetime.combine(date_to + timedelta(days=1), time.min, tzinfo=tz))
+    if status == "paid":
+        fines = fines.filter(paid_at__isnull=False)
+    elif status == "unpaid":
+        fines = fines.filter(paid_at__isnull=True)
+    return fines
+
+
+def ledger_totals(fines) -> dict:
+    """Count and amount of ``fines`` overall, paid and unpaid, in one conditional aggregate."""
+    paid, unpaid = Q(paid_at__isnull=False), Q(paid_at__isnull=True)
+    zero = Decimal("0.00")
+    return fines.order_by().aggregate(
+        count=Count("pk"),
+        total=Sum("amount", default=zero),
+        paid_count=Count("pk", filter=paid),
+        paid=Sum("amount", filter=paid, default=zero),
+        unpaid_count=Count("pk", filter=unpaid),
+        unpaid=Sum("amount", filter=unpaid, default=zero),
+    )
+
+
+def ledger_page(fines, cursor="", size=LEDGER_PAGE_SIZE):
+    """One keyset page of ``fines``, newest first, with only the displayed columns loaded."""
+    fines = fines.select_related("loan__borrower", "loan__copy__book").only(
+        "amount", "reason", "created_at", "paid_at",
+        "loan__borrower__username", "loan__copy__barcode", "loan__copy__book__title",
+    )
+    return keyset_page(fines, LEDGER_ORDERING, cursor, size)
+
+
+def ledger_borrower_page(fines, cursor="", size=LEDGER_PAGE_SIZE):
+    """One keyset page of per-borrower fine totals for ``fines``, by username."""
+    paid, unpaid = Q(paid_at__isnull=False), Q(paid_at__isnull=True)
+    zero = Decimal("0.00")
+    groups = fines.values("loan__borrower__username").annotate(
+        count=Count("pk"),
+        total=Sum("amount", default=zero),
+        paid=Sum("amount", filter=paid, default=zero),
+        unpaid_count=Count("pk", filter=unpaid),
+        unpaid=Sum("amount", filter=unpaid, default=zero),
+        latest=Max("created_at"),
+    )
+    return keyset_page(groups, LEDGER_BORROWER_ORDERING, cursor, size)
@@ -0,0 +1,140 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from ..models import BookCopy, CirculationEvent, Hold, HoldQueue, PickupRequest, PickupRequestItem
+from .account import refresh_account_summaries
+from .events import record, status_event
+from .policy import HOLD_PICKUP_DAYS
+
+
+class HoldError(Exception):
+    """A hold action cannot be applied; the message is shown to the patron."""
+
+
+def _locked_queue(book_id):
+    try:
+        with transaction.atomic():
+            HoldQueue.objects.get_or_create(book_id=book_id)
+    except IntegrityError:
+        pass  # created concurrently
+    return HoldQueue.objects.select_for_update().get(pk=book_id)
+
+
+def join_hold(user, book) -> Hold:
+    """Append ``user`` to the waitlist for ``book`` (idempotent while waiting)."""
+    if BookCopy.objects.filter(book=book, status=BookCopy.STATUS_AVAILABLE).exists():
+        raise HoldError("A copy is available now; add it to your cart instead.")
+    with transaction.atomic():
+        queue = _locked_queue(book.pk)
+        existing = Hold.objects.filter(book=book, patron=user, status=Hold.STATUS_WAITING).first()
+        if existing is not None:
+            return existing
+        queue.last_seq += 1
+        queue.save(update_fields=["last_seq"])
+        return Hold.objects.create(book=book, patron=user, seq=queue.last_seq)
+
+
+def leave_hold(hold) -> bool:
+    """
+    Cancel a waiting hold and close the gap behind it.
+
+    The holds behind move up with one UPDATE, which keeps waiting sequence
+    numbers contiguous so positions stay ``seq - head_seq``. The hold's seq
+    is re-read under the queue lock, since a concurrent leave ahead of it
+    may have moved it up since ``hold`` was loaded.
+    """
+    with transaction.atomic():
+        queue = _locked_queue(hold.book_id)
+        waiting = Hold.objects.filter(pk=hold.pk, status=Hold.STATUS_WAITING)
+        seq = waiting.values_list("seq", flat=True).first()
+        if seq is None:
+            return False
+        waiting.update(status=Hold.STATUS_CANCELED)
+        Hold.objects.filter(book_id=hold.book_id, status=Hold.STATUS_WAITING, seq__gt=seq).update(seq=F("seq") - 1)
+        queue.last_seq -= 1
+        queue.save(update_fields=["last_seq"])
+    hold.status, hold.seq = Hold.STATUS_CANCELED, seq
+    return True
+
+
+def offer_copies(copies, now=None) -> list:
+    """
+    Offer newly AVAILABLE copies to the heads of their titles' waitlists.
+
+    ``copies`` is an iterable of (copy_id, book_id). Only titles with waiting
+    holds cost anything beyond the single queue lookup: their queues are
+    locked, each copy is reserved with a conditional UPDATE and handed to the
+    next patron as a READY pickup request. Call inside the transaction that
+    made the copies available. Returns the offered holds.
+    """
+    by_book = defaultdict(list)
+    for copy_id, book_id in copies:
+        by_book[book_id].append(copy_id)
+    if not by_book:
+        return []
+    queues = list(
+        HoldQueue.objects.select_for_update()
+        .filter(book_id__in=by_book, last_seq__gt=F("head_seq"))
+        .order_by("pk")
+    )
+    if not queues:
+        return []
+
+    now = now or timezone.now()
+    offers = []  # (hold, copy_id)
+    for queue in queues:
+        copy_ids = by_book[queue.book_id]
+        holds = list(
+            Hold.objects.filter(book_id=queue.book_id, status=Hold.STATUS_WAITING)
+            .order_by("seq")[:len(copy_ids)]
+        )
+        for hold in holds:
+            while copy_ids:
+                copy_id = copy_ids.pop(0)
+                reserved = (
+                    BookCopy.objects.filter(pk=copy_id, status=BookCopy.STATUS_AVAILABLE)
+                    .update(status=BookCopy.STATUS_RESERVED)
+                )
+                if reserved:
+                    offers.append((hold, copy_id))
+                    queue.head_seq = hold.seq
+                    break
+    if not offers:
+        return []
+
+    pickup_by = (now + timedelta(days=HOLD_PICKUP_DAYS)).date()
+    requests = PickupRequest.objects.bulk_create([
+        PickupRequest(
+            requester_id=hold.patron_id,
+            status=PickupRequest.STATUS_READY,
+            pickup_by=pickup_by,
+            ready_at=now,
+        )
+        for hold, _ in offers
+    ])
+    PickupRequestItem.objects.bulk_create([
+        PickupRequestItem(request=pr, book_id=hold.book_id, assigned_copy_id=copy_id, note="Hold offer")
+        for pr, (hold, copy_id) in zip(requests, offers)
+    ])
+    for pr, (hold, _) in zip(requests, offers):
+        hold.status, hold.offered_at, hold.request = Hold.STATUS_OFFERED, now, pr
+    record([
+        event
+        for pr, (hold, copy_id) in zip(requests, offers)
+        for event in (
+            status_event(pr.status, now, user_id=hold.patron_id, request_id=pr.pk),
+            CirculationEvent(
+                kind=CirculationEvent.RESERVE, occurred_at=now, user_id=hold.patron_id,
+                book_id=hold.book_id, copy_id=copy_id, request_id=pr.pk,
+            ),
+        )
+    ])
+    held = [hold for hold, _ in offers]
+    Hold.objects.bulk_update(held, ["status", "offered_at", "request"])
+    HoldQueue.objects.bulk_update(queues, ["head_seq"])
+    refresh_account_summaries({hold.patron_id for hold in held})
+    return held
@@ -0,0 +1,167 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import (
+    Count, DateField, DecimalField, ExpressionWrapper, F, Func, IntegerField, Max, Min, Sum, Value,
+)
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from ..models import Loan, ReminderLog, Watermark
+from .pagination import keyset_page
+from .policy import fine_rate_per_day
+
+
+def open_overdue_loans(now=None):
+    """Open loans past due; served by the partial index on open loans."""
+    return Loan.objects.filter(returned_at__isnull=True, due_at__lt=now or timezone.now())
+
+
+def track_overdue(now=None) -> dict:
+    """
+    Stamp ``overdue_at`` on loans that crossed their due date since the last run.
+
+    Both statements only touch the small set of open loans whose state
+    changed (new overdues, or overdue loans renewed into the future), each
+    through its own partial index, so the sweep can run every few minutes.
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        marked = (
+            Loan.objects.filter(returned_at__isnull=True, overdue_at__isnull=True, due_at__lt=now)
+            .update(overdue_at=now)
+        )
+        cleared = (
+            Loan.objects.filter(returned_at__isnull=True, overdue_at__isnull=False, due_at__gte=now)
+            .update(overdue_at=None)
+        )
+    return {"marked": marked, "cleared": cleared, "tracked_at": now}
+
+
+def get_watermark(name):
+    return Watermark.objects.filter(name=name).values_list("position", flat=True).first()
+
+
+def set_watermark(name, position):
+    Watermark.objects.update_or_create(name=name, defaults={"position": position})
+
+
+def newly_overdue(name, until=None):
+    """
+    Return (loans, until) for open loans marked overdue after watermark ``name``.
+
+    Process the queryset, then ``set_watermark(name, until)`` so the next
+    run starts where this one ended. ``until`` defaults to the newest stamp
+    already committed rather than the clock, so a tracker run still in
+    flight cannot slip in below the watermark.
+    """
+    if until is None:
+        until = Loan.objects.filter(returned_at__isnull=True).aggregate(m=Max("overdue_at"))["m"]
+        if until is None:
+            return Loan.objects.none(), get_watermark(name)
+    since = get_watermark(name)
+    loans = Loan.objects.filter(returned_at__isnull=True, overdue_at__isnull=False, overdue_at__lte=until)
+    if since is not None:
+        loans = loans.filter(overdue_at__gt=since)
+    return loans.order_by("overdue_at", "pk"), until
+
+
+class DaysSince(Func):
+    """
+    Whole calendar days from the local date of datetime ``expression`` to
+    ``today``, the same count overdue_fine() charges for.
+
+    Date arithmetic differs per backend, so each gets its own SQL.
+    """
+    arg_joiner = " - "
+    template = "(%(expressions)s)"  # PostgreSQL: date - date is an integer
+    output_field = IntegerField()
+
+    def __init__(self, expression, today, **extra):
+        super().__init__(Value(today, output_field=DateField()), TruncDate(expression), **extra)
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return self.as_sql(
+            compiler, connection, template="CAST(julianday(%(expressions)s) AS INTEGER)",
+            arg_joiner=") - julianday(", **extra_context,
+        )
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, function="DATEDIFF", template="%(function)s(%(expressions)s)",
+                           arg_joiner=", ", **extra_context)
+
+
+# Overdue worklist
+
+OVERDUE_PAGE_SIZE = 25
+# Severity orderings for the borrower worklist; each ends in borrower_id so it is a valid keyset
+WORKLIST_SORTS = {
+    "days": ("-max_days", "borrower_id"),
+    "fine": ("-est_fine", "borrower_id"),
+    "loans": ("-loans", "borrower_id"),
+}
+
+
+def overdue_worklist_loans(now=None, rate=None):
+    """Open overdue loans annotated with ``days_overdue`` and ``est_fine`` (days x the Policy rate) in SQL."""
+    now = now or timezone.now()
+    rate = fine_rate_per_day() if rate is None else rate
+    return open_overdue_loans(now).annotate(
+        days_overdue=DaysSince("due_at", timezone.localdate(now)),
+        est_fine=ExpressionWrapper(F("days_overdue") * Value(rate), output_field=DecimalField(max_digits=10, decimal_places=2)),
+    )
+
+
+def overdue_borrowers(now=None, rate=None):
+    """Per-borrower overdue counts, worst lateness, estimated fines and oldest due date, as one GROUP BY."""
+    rate = fine_rate_per_day() if rate is None else rate
+    return (
+        overdue_worklist_loans(now, rate)
+        .values("borrower_id", "borrower__username", "borrower__email")
+        .annotate(
+            loans=Count("pk"),
+            max_days=Max("days_overdue"),
+            est_fine=ExpressionWrapper(
+                Sum("days_overdue") * Value(rate), output_field=DecimalField(max_digits=12, decimal_places=2),
+            ),
+            oldest_due=Min("due_at"),
+        )
+    )
+
+
+def overdue_totals(now=None, rate=None) -> dict:
+    """Overdue loans, borrowers and estimated fines across the whole worklist in one aggregate."""
+    rate = fine_rate_per_day() if rate is None else rate
+    totals = overdue_worklist_loans(now, rate).aggregate(
+        loans=Count("pk"), borrowers=Count("borrower_id", distinct=True), days=Sum("days_overdue", default=0),
+    )
+    totals["est_fine"] = totals.pop("days") * rate
+    return totals
+
+
+def overdue_worklist_page(now=None, sort="days", cursor="", size=OVERDUE_PAGE_SIZE):
+    """
+    One keyset page of overdue borrowers, most severe first by ``sort``, each
+    with its overdue loans (``row["items"]``, worst first) and the last
+    overdue reminder sent to them. Costs three queries whatever the page.
+    """
+    now = now or timezone.now()
+    rate = fine_rate_per_day()
+    page = keyset_page(overdue_borrowers(now, rate), WORKLIST_SORTS.get(sort, WORKLIST_SORTS["days"]), cursor, size)
+    ids = [row["borrower_id"] for row in page.items]
+    items = defaultdict(list)
+    loans = (
+        overdue_worklist_loans(now, rate).filter(borrower_id__in=ids)
+        .select_related("copy__book").only("due_at", "borrower_id", "copy__barcode", "copy__book__title")
+        .order_by("due_at", "pk")
+    )
+    for loan in loans:
+        items[loan.borrower_id].append(loan)
+    reminded = dict(
+        ReminderLog.objects.filter(loan__borrower_id__in=ids, kind=ReminderLog.KIND_OVERDUE)
+        .values_list("loan__borrower_id").annotate(last=Max("sent_at")).order_by()
+    ) if ids else {}
+    for row in page.items:
+        row["items"] = items[row["borrower_id"]]
+        row["last_reminded"] = reminded.get(row["borrower_id"])
+    return page
@@ -0,0 +1,84 @@
+import base64
+import binascii
+import json
+from dataclasses import dataclass
+
+from django.db.models import Q
+
+
+@dataclass
+class KeysetPage:
+    items: list
+    next_cursor: str = ""
+    has_next: bool = False
+    is_first: bool = True
+
+
+def encode_cursor(values) -> str:
+    return base64.urlsafe_b64encode(json.dumps(list(values), default=str).encode()).decode().rstrip("=")
+
+
+def decode_cursor(raw):
+    """The values packed by encode_cursor(), or None for a missing or mangled cursor (the first page)."""
+    if not raw:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(raw + "=" * (-len(raw) % 4)))
+    except (binascii.Error, ValueError):
+        return None
+    return values if isinstance(values, list) else None
+
+
+def _after(ordering, values):
+    """
+    Rows strictly after ``values`` in ``ordering``: (a > x) OR (a = x AND b > y) ...
+
+    With a matching index this is a range seek, so a page costs the same at
+    any depth, unlike OFFSET which reads and discards every earlier row.
+    """
+    condition, equal = Q(), Q()
+    for name, value in zip(ordering, values):
+        column = name.lstrip("-")
+        op = "lt" if name.startswith("-") else "gt"
+        condition |= equal & Q(**{f"{column}__{op}": value})
+        equal &= Q(**{column: value})
+    return condition
+
+
+def _key(item, ordering):
+    values = []
+    for name in ordering:
+        column = name.lstrip("-")
+        if isinstance(item, dict):
+            values.append(item[column])
+            continue
+        value = item
+        for part in column.split("__"):
+            value = getattr(value, part)
+        values.append(value)
+    return values
+
+
+def keyset_page(queryset, ordering, cursor="", size=50) -> KeysetPage:
+    """
+    One page of ``queryset`` ordered by ``ordering`` (column names, ``-`` for
+    descending, ending in a unique column) starting after ``cursor``.
+
+    Fetches ``size + 1`` rows to learn whether another page follows;
+    ``next_cursor`` encodes the last row's ordering values.
+    """
+    values = decode_cursor(cursor)
+    if values is not None and len(values) != len(ordering):
+        values = None
+    queryset = queryset.order_by(*ordering)
+    if values is not None:
+        queryset = queryset.filter(_after(ordering, values))
+    items = list(queryset[: size + 1])
+    has_next = len(items) > size
+    items = items[:size]
+    return KeysetPage(
+        items=items,
+        next_cursor=encode_cursor(_key(items[-1], ordering)) if has_next else "",
+        has_next=has_next,
+        is_first=values is None,
+    )
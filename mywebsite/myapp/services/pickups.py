@@ -0,0 +1,308 @@
+import time
+from dataclasses import dataclass
+
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from ..models import BookCopy, CartItem, CirculationEvent, PickupRequest, PickupRequestItem
+from .account import refresh_account_summaries
+from .events import record, status_event
+from .holds import offer_copies
+
+EXPIRABLE_STATUSES = (PickupRequest.STATUS_PREPARING, PickupRequest.STATUS_READY)
+ALLOCATABLE_STATUSES = (PickupRequest.STATUS_PENDING, PickupRequest.STATUS_PREPARING)
+OPEN_STATUSES = (*ALLOCATABLE_STATUSES, PickupRequest.STATUS_READY)
+
+
+def release_copies(request_ids) -> int:
+    """
+    Flip the RESERVED copies assigned to ``request_ids`` back to AVAILABLE with
+    one UPDATE, then offer them to waiting holds.
+    """
+    rows = list(
+        PickupRequestItem.objects.filter(request_id__in=request_ids, assigned_copy__status=BookCopy.STATUS_RESERVED)
+        .values_list("assigned_copy_id", "assigned_copy__book_id", "request_id")
+    )
+    if not rows:
+        return 0
+    released = (
+        BookCopy.objects.filter(pk__in=[pk for pk, _, _ in rows], status=BookCopy.STATUS_RESERVED)
+        .update(status=BookCopy.STATUS_AVAILABLE)
+    )
+    now = timezone.now()
+    record(
+        CirculationEvent(kind=CirculationEvent.RELEASE, occurred_at=now, copy_id=copy_id, book_id=book_id, request_id=request_id)
+        for copy_id, book_id, request_id in rows
+    )
+    offer_copies([(copy_id, book_id) for copy_id, book_id, _ in rows], now)
+    return released
+
+
+def expire_pickup_requests(today=None, batch_size=200, max_batches=None) -> dict:
+    """
+    Expire PREPARING/READY requests whose ``pickup_by`` date has passed.
+
+    Each batch locks its requests with SKIP LOCKED, so rows the desk is
+    working on are left for the next run instead of blocking either side,
+    then releases their reserved copies and closes the requests with one
+    UPDATE each. Returns counts for monitoring.
+    """
+    today = today or timezone.localdate()
+    started = time.monotonic()
+    stats = {"expired": 0, "released": 0, "batches": 0}
+    due = (
+        PickupRequest.objects.select_for_update(skip_locked=True)
+        .filter(status__in=EXPIRABLE_STATUSES, pickup_by__lt=today)
+        .order_by("pickup_by", "pk")
+    )
+    while max_batches is None or stats["batches"] < max_batches:
+        with transaction.atomic():
+            rows = list(due.values_list("pk", "requester_id")[:batch_size])
+            if not rows:
+                break
+            ids = [pk for pk, _ in rows]
+            stats["released"] += release_copies(ids)
+            stats["expired"] += (
+                PickupRequest.objects.filter(pk__in=ids, status__in=EXPIRABLE_STATUSES)
+                .update(status=PickupRequest.STATUS_EXPIRED)
+            )
+            now = timezone.now()
+            record(
+                status_event(PickupRequest.STATUS_EXPIRED, now, request_id=pk, user_id=requester_id)
+                for pk, requester_id in rows
+            )
+            refresh_account_summaries({requester_id for _, requester_id in rows})
+        stats["batches"] += 1
+    stats["duration_ms"] = int((time.monotonic() - started) * 1000)
+    return stats
+
+
+def reserve_copies(copy_ids) -> set:
+    """
+    Reserve whichever of ``copy_ids`` are AVAILABLE without row locks; returns the ids won.
+
+    One read finds the AVAILABLE copies and one conditional UPDATE flips
+    them to RESERVED. If the rowcount shows another transaction took some
+    in between, a re-read keeps the RESERVED ones no open request holds:
+    every reserving path assigns its copy to a request item in the same
+    transaction, so the rest are the ones this UPDATE won.
+    """
+    copy_ids = set(copy_ids)
+    if not copy_ids:
+        return set()
+    available = set(
+        BookCopy.objects.filter(pk__in=copy_ids, status=BookCopy.STATUS_AVAILABLE).values_list("pk", flat=True)
+    )
+    if not available:
+        return set()
+    flipped = (
+        BookCopy.objects.filter(pk__in=available, status=BookCopy.STATUS_AVAILABLE)
+        .update(status=BookCopy.STATUS_RESERVED)
+    )
+    if flipped == len(available):
+        return available
+    held = PickupRequestItem.objects.filter(assigned_copy__in=available, request__status__in=OPEN_STATUSES)
+    return set(
+        BookCopy.objects.filter(pk__in=available, status=BookCopy.STATUS_RESERVED)
+        .exclude(pk__in=held.values("assigned_copy"))
+        .values_list("pk", flat=True)
+    )
+
+
+# Copies lost to a concurrent allocator are replaced from the remaining
+# candidates for at most this many rounds per batch.
+ALLOCATION_ROUNDS = 3
+
+
+def _pick(pool, location):
+    """Take the first candidate at ``location`` (case-insensitive), else the first candidate."""
+    if location:
+        wanted = location.strip().lower()
+        for i, (copy_id, copy_location) in enumerate(pool):
+            if (copy_location or "").strip().lower() == wanted:
+                return pool.pop(i)[0]
+    return pool.pop(0)[0] if pool else None
+
+
+def _allocate_batch(requests, now):
+    order = {pk: i for i, (pk, _, _) in enumerate(requests)}
+    locations = {pk: location for pk, _, location in requests}
+    items = sorted(
+        PickupRequestItem.objects.filter(request_id__in=order, assigned_copy__isnull=True),
+        key=lambda it: (order[it.request_id], it.pk),
+    )
+    if not items:
+        return 0, 0
+
+    pools = {}
+    for copy_id, book_id, location in (
+        BookCopy.objects.filter(book_id__in={it.book_id for it in items}, status=BookCopy.STATUS_AVAILABLE)
+        .order_by("pk").values_list("pk", "book_id", "location")
+    ):
+        pools.setdefault(book_id, []).append((copy_id, location))
+
+    pending, assigned = items, []
+    for _ in range(ALLOCATION_ROUNDS):
+        picks = {}
+        for it in pending:
+            copy_id = _pick(pools.get(it.book_id, []), locations[it.request_id])
+            if copy_id is not None:
+                picks[it] = copy_id
+        if not picks:
+            break
+        won = reserve_copies(picks.values())
+        pending = []
+        for it, copy_id in picks.items():
+            if copy_id in won:
+                it.assigned_copy_id = copy_id
+                assigned.append(it)
+            else:
+                pending.append(it)
+        if not pending:
+            break
+
+    PickupRequestItem.objects.bulk_update(assigned, ["assigned_copy"])
+    prepared = {it.request_id for it in assigned}
+    (
+        PickupRequest.objects.filter(pk__in=prepared, status=PickupRequest.STATUS_PENDING)
+        .update(status=PickupRequest.STATUS_PREPARING, prepared_at=now)
+    )
+    record([
+        *(
+            CirculationEvent(
+                kind=CirculationEvent.RESERVE, occurred_at=now,
+                copy_id=it.assigned_copy_id, book_id=it.book_id, request_id=it.request_id,
+            )
+            for it in assigned
+        ),
+        *(status_event(PickupRequest.STATUS_PREPARING, now, request_id=pk) for pk in sorted(prepared)),
+    ])
+    return len(items), len(assigned)
+
+
+def allocate_pending_requests(batch_size=100, now=None) -> dict:
+    """
+    Assign AVAILABLE copies to unassigned items of open requests, oldest first.
+
+    Open means PENDING, or PREPARING with items still unassigned: the first
+    copy assigned moves a request to PREPARING, and its other items are
+    picked up again here once stock comes in.
+
+    Requests are taken in ``requested_at`` order in batches locked with SKIP
+    LOCKED, so concurrent allocators work on disjoint requests. Each batch
+    loads candidate copies for all its books in one query, prefers copies
+    shelved at the request's pickup location, and reserves them with a
+    conditional UPDATE; copies lost to a concurrent reservation are
+    replaced from the remaining candidates. Items left without a copy stay
+    unassigned for the next run.
+    """
+    now = now or timezone.now()
+    started = time.monotonic()
+    stats = {"requests": 0, "items": 0, "assigned": 0, "batches": 0}
+    unassigned = PickupRequestItem.objects.filter(request=OuterRef("pk"), assigned_copy__isnull=True)
+    queue = (
+        PickupRequest.objects.select_for_update(skip_locked=True)
+        .filter(Exists(unassigned), status__in=ALLOCATABLE_STATUSES)
+        .order_by("requested_at", "pk")
+    )
+    last = None
+    while True:
+        with transaction.atomic():
+            batch = queue
+            if last is not None:
+                batch = batch.filter(Q(requested_at__gt=last[0]) | Q(requested_at=last[0], pk__gt=last[1]))
+            requests = list(batch.values_list("pk", "requested_at", "pickup_location")[:batch_size])
+            if not requests:
+                break
+            items, assigned = _allocate_batch(requests, now)
+        last = (requests[-1][1], requests[-1][0])
+        stats["batches"] += 1
+        stats["requests"] += len(requests)
+        stats["items"] += items
+        stats["assigned"] += assigned
+    stats["unfilled"] = stats["items"] - stats["assigned"]
+    stats["duration_ms"] = int((time.monotonic() - started) * 1000)
+    return stats
+
+
+def try_reserve(copy_id, book_id=None) -> bool:
+    """Reserve one specific copy with a conditional UPDATE; False if it was not AVAILABLE."""
+    copies = BookCopy.objects.filter(pk=copy_id, status=BookCopy.STATUS_AVAILABLE)
+    if book_id is not None:
+        copies = copies.filter(book_id=book_id)
+    return copies.update(status=BookCopy.STATUS_RESERVED) == 1
+
+
+@dataclass
+class Unreserved:
+    """A preselected copy that could not be reserved when the request was placed."""
+    book: object
+    copy_id: int
+    fallback_barcode: str = ""
+
+
+def place_request(user, cart_items, selections, pickup_by, pickup_location=""):
+    """
+    Turn ``cart_items`` into one PENDING pickup request with bulk writes.
+
+    ``selections`` maps cart item id -> preselected copy id. All selected
+    copies are validated with one lookup and reserved with one conditional
+    bulk UPDATE; copies lost to other patrons are replaced, where possible,
+    by another available copy of the same title in one more round. Items are
+    inserted with one bulk INSERT and the cart is emptied with one DELETE,
+    so the query count does not grow with the cart. Returns
+    (request, [Unreserved, ...]).
+    """
+    wanted = {it.book_id: selections[it.id] for it in cart_items if selections.get(it.id)}
+    valid = dict(
+        BookCopy.objects.filter(pk__in=wanted.values(), book_id__in=wanted).values_list("pk", "book_id")
+    ) if wanted else {}
+    # A selection naming another title's copy is treated like a taken copy
+    won = reserve_copies(copy_id for book_id, copy_id in wanted.items() if valid.get(copy_id) == book_id)
+    assigned = {book_id: copy_id for book_id, copy_id in wanted.items() if valid.get(copy_id) == book_id and copy_id in won}
+    lost = [book_id for book_id in wanted if book_id not in assigned]
+
+    fallbacks = {}
+    if lost:
+        candidates = {}
+        for copy_id, book_id, barcode in (
+            BookCopy.objects.filter(book_id__in=lost, status=BookCopy.STATUS_AVAILABLE)
+            .order_by("pk").values_list("pk", "book_id", "barcode")
+        ):
+            candidates.setdefault(book_id, (copy_id, barcode))
+        won = reserve_copies(copy_id for copy_id, _ in candidates.values())
+        for book_id, (copy_id, barcode) in candidates.items():
+            if copy_id in won:
+                assigned[book_id] = copy_id
+                fallbacks[book_id] = barcode
+
+    pr = PickupRequest.objects.create(
+        requester=user,
+        pickup_location=pickup_location,
+        pickup_by=pickup_by,
+        status=PickupRequest.STATUS_PENDING,
+    )
+    PickupRequestItem.objects.bulk_create([
+        PickupRequestItem(request=pr, book_id=it.book_id, assigned_copy_id=assigned.get(it.book_id))
+        for it in cart_items
+    ])
+    record([
+        status_event(pr.status, pr.requested_at, user_id=user.pk, request_id=pr.pk),
+        *(
+            CirculationEvent(
+                kind=CirculationEvent.RESERVE, occurred_at=pr.requested_at, user_id=user.pk,
+                copy_id=copy_id, book_id=book_id, request_id=pr.pk,
+            )
+            for book_id, copy_id in assigned.items()
+        ),
+    ])
+    CartItem.objects.filter(pk__in=[it.pk for it in cart_items]).delete()
+    refresh_account_summaries([user.pk])
+
+    books = {it.book_id: it.book for it in cart_items}
+    unreserved = [
+        Unreserved(books[book_id], wanted[book_id], fallbacks.get(book_id, ""))
+        for book_id in lost
+    ]
+    return pr, unreserved
@@ -1,47 +1,117 @@
+import logging
+import time
+from dataclasses import dataclass
 from datetime import timedelta
+from decimal import Decimal
 
-try:
-    # Import lazily to avoid issues during migrations
-    from ..models import Policy
-except Exception:  # pragma: no cover
-    Policy = None
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DatabaseError
 
+from ..models import Policy, Profile
 
-# Default policy values (used if Policy table not available)
-LOAN_PERIODS = {
-    "student": 7,
-    "member": 7,
-    "lecturer": 14,
-    "default": 14,
-}
+logger = logging.getLogger(__name__)
 
 MAX_RENEWALS = 2
-FINE_RATE_PER_DAY = 5  # THB/day
 HOLD_PICKUP_DAYS = 3
-LIMITS = {
-    "student": 5,
-    "member": 5,
-    "lecturer": 10,
-    "default": 5,
-}
+
+# Shared version stamp bumped on every Policy save; workers compare it against
+# their snapshot at most once per POLICY_RECHECK_SECONDS.
+POLICY_VERSION_KEY = "policy_version"
+POLICY_RECHECK_SECONDS = 30
+
+STUDENT_ROLES = ("student", "member")
+
+
+@dataclass(frozen=True)
+class PolicySnapshot:
+    student_loan_limit: int
+    lecturer_loan_limit: int
+    student_loan_days: int
+    lecturer_loan_days: int
+    fine_rate_per_day: Decimal
+    version: str = ""
+
+    @classmethod
+    def from_policy(cls, policy, version=""):
+        return cls(
+            student_loan_limit=int(policy.student_loan_limit),
+            lecturer_loan_limit=int(policy.lecturer_loan_limit),
+            student_loan_days=int(policy.student_loan_days),
+            lecturer_loan_days=int(policy.lecturer_loan_days),
+            fine_rate_per_day=Decimal(policy.fine_rate_per_day),
+            version=version,
+        )
+
+    def loan_days(self, role: str) -> int:
+        return self.student_loan_days if role in STUDENT_ROLES else self.lecturer_loan_days
+
+    def loan_limit(self, role: str) -> int:
+        return self.student_loan_limit if role in STUDENT_ROLES else self.lecturer_loan_limit
+
+
+_snapshot = None
+_checked_at = 0.0
+
+
+def _load_snapshot(version) -> PolicySnapshot:
+    try:
+        row = Policy.objects.first()
+    except DatabaseError:
+        # Table missing (e.g. before migrate): fall back to model defaults
+        logger.warning("Policy table unavailable; using default policy values.", exc_info=True)
+        row = None
+    return PolicySnapshot.from_policy(row or Policy(), version=version or "")
+
+
+def current_policy() -> PolicySnapshot:
+    """Return the process-cached policy, reloading only when its version stamp moved."""
+    global _snapshot, _checked_at
+    now = time.monotonic()
+    if _snapshot is not None and now - _checked_at < POLICY_RECHECK_SECONDS:
+        return _snapshot
+    version = cache.get(POLICY_VERSION_KEY) or ""
+    if _snapshot is None or _snapshot.version != version:
+        _snapshot = _load_snapshot(version)
+    _checked_at = now
+    return _snapshot
+
+
+def invalidate_policy(sender=None, instance=None, **kwargs) -> None:
+    """post_save/post_delete receiver for Policy: publish a new version stamp."""
+    global _snapshot
+    # Fresh every time: a delete leaves the instance's updated_at at the last save's stamp
+    cache.set(POLICY_VERSION_KEY, str(time.time_ns()), None)
+    _snapshot = None
+
+
+def user_role(user) -> str:
+    """
+    Resolve the policy role for ``user``.
+
+    Staff count as lecturers. Otherwise the Profile.usertype is used, taken
+    from ``select_related('profile')`` when the caller loaded it and memoized
+    on the user instance so repeated checks in one request cost nothing.
+    """
+    if getattr(user, "is_staff", False) or getattr(user, "is_superuser", False):
+        return "lecturer"
+    role = getattr(user, "_policy_role", None)
+    if role is not None:
+        return role
+    if get_user_model().profile.is_cached(user):
+        try:
+            usertype = user.profile.usertype
+        except Profile.DoesNotExist:
+            usertype = None
+    else:
+        usertype = Profile.objects.filter(user_id=user.pk).values_list("usertype", flat=True).first()
+    role = (usertype or "student").lower()
+    user._policy_role = role
+    return role
 
 
 def loan_period_days(user) -> int:
-    # Prefer dynamic settings if Policy exists
-    if Policy is not None:
-        try:
-            cfg = Policy.current()
-            if getattr(user, "is_staff", False) or getattr(user, "is_superuser", False):
-                return int(cfg.lecturer_loan_days)
-            role = (getattr(getattr(user, "profile", None), "usertype", "student") or "student").lower()
-            return int(cfg.student_loan_days) if role in ("student", "member") else int(cfg.lecturer_loan_days)
-        except Exception:
-            pass
-    # Fallback constants
-    if getattr(user, "is_staff", False) or getattr(user, "is_superuser", False):
-        return LOAN_PERIODS.get("lecturer", 28)
-    role = (getattr(getattr(user, "profile", None), "usertype", "default") or "default").lower()
-    return LOAN_PERIODS.get(role, LOAN_PERIODS["default"])
+    return current_policy().loan_days(user_role(user))
 
 
 def calculate_due_at(now, user):
@@ -60,21 +130,12 @@ def compute_renew_due_at(now, loan):
 
 
 def active_loan_limit(user) -> int:
-    if Policy is not None:
-        try:
-            cfg = Policy.current()
-            if getattr(user, "is_staff", False) or getattr(user, "is_superuser", False):
-                return int(cfg.lecturer_loan_limit)
-            role = (getattr(getattr(user, "profile", None), "usertype", "student") or "student").lower()
-            return int(cfg.student_loan_limit) if role in ("student", "member") else int(cfg.lecturer_loan_limit)
-        except Exception:
-            pass
-    if getattr(user, "is_staff", False) or getattr(user, "is_superuser", False):
-        return LIMITS.get("lecturer", 10)
-    role = (getattr(getattr(user, "profile", None), "usertype", "default") or "default").lower()
-    return LIMITS.get(role, LIMITS["default"])
+    return current_policy().loan_limit(user_role(user))
+
+
+def fine_rate_per_day() -> Decimal:
+    return current_policy().fine_rate_per_day
 
 
 def can_borrow(user, current_active_count: int) -> bool:
     return current_active_count < active_loan_limit(user)
-
@@ -0,0 +1,109 @@
+import json
+
+from django.db.models import Max
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from ..models import CirculationEvent, PickupRequest
+from .events import SETTLE_AFTER
+
+# Requests shown on the staff queue, in the order it lists them.
+QUEUE_STATUSES = (PickupRequest.STATUS_PENDING, PickupRequest.STATUS_PREPARING, PickupRequest.STATUS_READY)
+QUEUE_ORDERING = ("status", "requested_at")  # the rows' data-sort key follows the same order
+FEED_BATCH = 500
+
+
+def queue_requests():
+    return (
+        PickupRequest.objects.filter(status__in=QUEUE_STATUSES)
+        .prefetch_related("items", "items__book", "items__assigned_copy")
+        .select_related("requester")
+    )
+
+
+def latest_event_id() -> int:
+    return CirculationEvent.objects.aggregate(m=Max("pk"))["m"] or 0
+
+
+def sse(event, data, event_id=None) -> str:
+    """One server-sent event frame."""
+    lines = [f"id: {event_id}"] if event_id is not None else []
+    lines += [f"event: {event}", f"data: {json.dumps(data)}"]
+    return "\n".join(lines) + "\n\n"
+
+
+class QueueFeed:
+    """
+    Follows the circulation event ledger from event id ``after`` and turns
+    events about pickup requests into queue row updates.
+
+    Each poll reads only the ledger tail (a primary-key range from the
+    cursor), never the queue itself, and then loads just the requests that
+    changed. Ids become visible at commit, not in id order, so events are
+    re-read until they were recorded SETTLE_AFTER ago: ``cursor`` only passes
+    settled events and ``seen`` remembers the newer ones already sent.
+
+    A reconnecting client gets a new feed, so ``position`` also carries the
+    highest event id already sent and ``resume`` skips events up to it. An
+    event committed out of order below that id after it was sent is not
+    replayed to that client; the next page load shows it.
+    """
+
+    def __init__(self, after=0, sent_through=0):
+        self.cursor = after
+        self.sent_through = sent_through
+        self.seen = set()
+
+    @classmethod
+    def resume(cls, position):
+        """Feed continuing from a ``position`` sent as a frame id; raises ValueError if it is malformed."""
+        cursor, _, sent_through = str(position).partition(":")
+        return cls(int(cursor), int(sent_through or 0))
+
+    @property
+    def position(self) -> str:
+        """``"<cursor>"``, or ``"<cursor>:<highest id sent>"`` while unsettled events have been sent."""
+        sent = max(self.sent_through, max(self.seen, default=0))
+        return f"{self.cursor}:{sent}" if sent > self.cursor else str(self.cursor)
+
+    def poll(self, now=None) -> list:
+        """Ids of the requests changed since the last poll, in the order of their first new event."""
+        horizon = (now or timezone.now()) - SETTLE_AFTER
+        rows = (
+            CirculationEvent.objects.filter(pk__gt=self.cursor)
+            .order_by("pk")
+            # Unsettled events already sent are read again, so leave room for them
+            .values_list("pk", "request_id", "recorded_at")[: FEED_BATCH + len(self.seen)]
+        )
+        changed = []
+        for pk, request_id, recorded_at in rows:
+            if pk not in self.seen:
+                self.seen.add(pk)
+                if pk > self.sent_through and request_id is not None and request_id not in changed:
+                    changed.append(request_id)
+            if recorded_at < horizon:
+                self.cursor = pk
+        self.seen = {pk for pk in self.seen if pk > self.cursor}
+        return changed
+
+    def messages(self, now=None) -> list:
+        """SSE frames for the changes since the last poll: an ``upsert`` with the row's HTML, or a ``remove``."""
+        before = self.position
+        changed = self.poll(now)
+        active = {pr.pk: pr for pr in queue_requests().filter(pk__in=changed)} if changed else {}
+        frames = []
+        for pk in changed:
+            pr = active.get(pk)
+            if pr is None:
+                frames.append(("remove", {"id": pk}))
+            else:
+                frames.append(("upsert", {"id": pk, "html": render_to_string("myapp/staff/_request_row.html", {"r": pr})}))
+        # A reconnecting client sends the last frame id back as Last-Event-ID and
+        # resumes from that position. An id-only frame moves it past events
+        # that changed no row.
+        if not frames and self.position != before:
+            return [f"id: {self.position}\n\n"]
+        return [
+            sse(event, data, self.position if i == len(frames) - 1 else None)
+            for i, (event, data) in enumerate(frames)
+        ]
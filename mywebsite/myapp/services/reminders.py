@@ -0,0 +1,187 @@
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from datetime import timedelta
+from itertools import groupby
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import Case, CharField, Exists, OuterRef, Q, Value, When
+from django.utils import timezone
+
+from ..models import Loan, ReminderLog
+
+logger = logging.getLogger(__name__)
+
+# Loans due between T+1 and T+2 days get a "due soon" reminder.
+DUE_SOON_FROM = timedelta(days=1)
+DUE_SOON_TO = timedelta(days=2)
+
+
+@dataclass
+class Digest:
+    """All pending reminders for one borrower, sent as a single message."""
+    borrower: object
+    loans: list
+
+    def message(self):
+        lines = [f"Hello {self.borrower.get_full_name() or self.borrower.username},", ""]
+        for kind, title in ReminderLog.KIND_CHOICES:
+            loans = [loan for loan in self.loans if loan.reminder_kind == kind]
+            if loans:
+                lines.append(f"{title}:")
+                lines += [f"  - {loan.copy.book.title} (due {loan.due_at:%Y-%m-%d %H:%M})" for loan in loans]
+                lines.append("")
+        lines.append("Please return or renew these items from My Loans.")
+        overdue = any(loan.reminder_kind == ReminderLog.KIND_OVERDUE for loan in self.loans)
+        subject = "Library: overdue items" if overdue else "Library: items due soon"
+        return EmailMessage(subject, "\n".join(lines), settings.DEFAULT_FROM_EMAIL, [self.borrower.email])
+
+
+@dataclass
+class ReminderRun:
+    loans: int = 0
+    digests: int = 0
+    sent: int = 0
+    failed: int = 0
+    no_email: int = 0
+    skipped: int = 0
+    started: float = field(default_factory=time.monotonic)
+
+    def as_dict(self):
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        return {
+            "loans": self.loans,
+            "digests": self.digests,
+            "sent": self.sent,
+            "failed": self.failed,
+            "no_email": self.no_email,
+            "skipped": self.skipped,
+            "duration_ms": int(elapsed * 1000),
+            "per_second": round(self.sent / elapsed, 1),
+        }
+
+
+def pending_reminders(now=None, borrower_ids=None, kinds=None):
+    """
+    Open loans that are overdue or due soon and have no ledger entry yet.
+
+    Ordered by borrower so callers can stream it and group per borrower;
+    ``borrower_ids`` limits it to those borrowers and ``kinds`` (ReminderLog
+    kinds) to those reminders.
+    """
+    now = now or timezone.now()
+    windows = {
+        ReminderLog.KIND_OVERDUE: Q(due_at__lt=now),
+        ReminderLog.KIND_DUE_SOON: Q(due_at__gte=now + DUE_SOON_FROM, due_at__lte=now + DUE_SOON_TO),
+    }
+    due = Q()
+    for reminder_kind in kinds or windows:
+        due |= windows[reminder_kind]
+    kind = Case(
+        When(due_at__lt=now, then=Value(ReminderLog.KIND_OVERDUE)),
+        default=Value(ReminderLog.KIND_DUE_SOON),
+        output_field=CharField(),
+    )
+    already_sent = ReminderLog.objects.filter(loan=OuterRef("pk"), kind=OuterRef("reminder_kind"), due_at=OuterRef("due_at"))
+    loans = Loan.objects.filter(returned_at__isnull=True)
+    if borrower_ids is not None:
+        loans = loans.filter(borrower_id__in=borrower_ids)
+    return (
+        loans
+        .filter(due)
+        .annotate(reminder_kind=kind)
+        .exclude(Exists(already_sent))
+        .select_related("borrower", "copy__book")
+        .order_by("borrower_id", "due_at", "pk")
+    )
+
+
+def iter_digests(loans, chunk_size=500):
+    """Stream ``loans`` with iterator() and yield one Digest per borrower."""
+    rows = loans.iterator(chunk_size=chunk_size)
+    for _, group in groupby(rows, key=lambda loan: loan.borrower_id):
+        group = list(group)
+        yield Digest(group[0].borrower, group)
+
+
+_local = threading.local()
+
+
+def _send_batch(digests, backend):
+    """Worker: send a batch over this thread's reused connection."""
+    conn = getattr(_local, "connection", None)
+    if conn is None:
+        conn = _local.connection = get_connection(backend, fail_silently=False)
+        _local.connections.append(conn)
+    try:
+        conn.open()
+        conn.send_messages([digest.message() for digest in digests])
+    except Exception:
+        logger.exception("Reminder batch of %d digests failed", len(digests))
+        conn.close()
+        return digests, False
+    return digests, True
+
+
+def send_reminders(now=None, chunk_size=500, batch_size=50, workers=4, backend=None, borrower_ids=None, kinds=None) -> dict:
+    """
+    Send one digest per borrower for loans not yet in the reminder ledger
+    (only to ``borrower_ids`` and of ``kinds`` when given; ``skipped``
+    counts the given borrowers who had nothing pending).
+
+    Loans are streamed in chunks, digests are sent in batches by at most
+    ``workers`` threads that each keep one open backend connection, and at
+    most ``workers * 2`` batches are in flight so memory stays bounded. Ledger
+    rows are written only for batches the backend accepted, so failed
+    deliveries are retried on the next run. Returns throughput stats.
+    """
+    run = ReminderRun()
+    connections = []
+
+    def record(future):
+        digests, ok = future.result()
+        if not ok:
+            run.failed += len(digests)
+            return
+        run.sent += len(digests)
+        ReminderLog.objects.bulk_create(
+            [
+                ReminderLog(loan=loan, kind=loan.reminder_kind, due_at=loan.due_at)
+                for digest in digests for loan in digest.loans
+            ],
+            ignore_conflicts=True,
+        )
+
+    def initializer(shared):
+        _local.connections = shared
+        _local.connection = None
+
+    with ThreadPoolExecutor(max_workers=workers, initializer=initializer, initargs=(connections,)) as pool:
+        in_flight, batch, seen = set(), [], set()
+        for digest in iter_digests(pending_reminders(now, borrower_ids, kinds), chunk_size):
+            seen.add(digest.borrower.pk)
+            run.loans += len(digest.loans)
+            if not digest.borrower.email:
+                run.no_email += 1
+                continue
+            run.digests += 1
+            batch.append(digest)
+            if len(batch) >= batch_size:
+                in_flight.add(pool.submit(_send_batch, batch, backend))
+                batch = []
+            if len(in_flight) >= workers * 2:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    record(future)
+        if batch:
+            in_flight.add(pool.submit(_send_batch, batch, backend))
+        for future in wait(in_flight).done:
+            record(future)
+    for conn in connections:
+        conn.close()
+    if borrower_ids is not None:
+        run.skipped = len(set(borrower_ids) - seen)
+    return run.as_dict()
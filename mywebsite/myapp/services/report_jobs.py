@@ -0,0 +1,208 @@
+import hashlib
+import json
+import logging
+import os
+import uuid
+from datetime import date, timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from ..models import ReportJob
+from .exports import csv_chunks, fines_ledger_rows, loan_history_rows, overdue_rows, top_borrowed_rows
+
+logger = logging.getLogger(__name__)
+
+# A finished report is handed out again for identical requests made within
+# REUSE_FOR, and its file is deleted KEEP_FOR after it was generated.
+REUSE_FOR = timedelta(minutes=15)
+KEEP_FOR = timedelta(days=1)
+# RUNNING jobs not finished after this long belong to a dead worker and are requeued.
+STALE_AFTER = timedelta(hours=1)
+
+# Kinds that take a date range; the rest ignore date params.
+DATED_KINDS = (ReportJob.KIND_TOP_BORROWED, ReportJob.KIND_FINES_LEDGER, ReportJob.KIND_LOAN_HISTORY)
+
+
+class ReportError(Exception):
+    """A report request is invalid; the message is shown to staff."""
+
+
+def report_storage():
+    """Reports hold patron data, so they live outside the public media URL and are served by the download view."""
+    return FileSystemStorage(location=Path(settings.MEDIA_ROOT) / "reports", base_url=None)
+
+
+def clean_params(kind, date_from="", date_to=""):
+    """Validate a report request; returns the params dict stored on the job."""
+    if kind not in dict(ReportJob.KIND_CHOICES):
+        raise ReportError("Unknown report.")
+    if kind not in DATED_KINDS:
+        return {}
+    params = {}
+    for name, raw in (("date_from", date_from), ("date_to", date_to)):
+        raw = (raw or "").strip()
+        if raw:
+            try:
+                params[name] = date.fromisoformat(raw).isoformat()
+            except ValueError:
+                raise ReportError("Dates must be YYYY-MM-DD.")
+    if params.get("date_from") and params.get("date_to") and params["date_from"] > params["date_to"]:
+        raise ReportError("The start date is after the end date.")
+    return params
+
+
+def _key(kind, params):
+    return hashlib.sha256(json.dumps([kind, params], sort_keys=True).encode()).hexdigest()
+
+
+def request_report(kind, params, user=None, now=None):
+    """
+    Enqueue a report, or return the identical one already queued, running or just generated.
+
+    Returns (job, created). A partial unique constraint on the key of
+    active jobs makes concurrent identical requests share one job.
+    """
+    now = now or timezone.now()
+    key = _key(kind, params)
+    existing = (
+        ReportJob.objects.filter(key=key)
+        .filter(
+            Q(status__in=(ReportJob.STATUS_QUEUED, ReportJob.STATUS_RUNNING))
+            | Q(status=ReportJob.STATUS_DONE, finished_at__gte=now - REUSE_FOR)
+        )
+        .order_by("-created_at")
+        .first()
+    )
+    if existing is not None:
+        return existing, False
+    try:
+        with transaction.atomic():
+            return ReportJob.objects.create(kind=kind, params=params, key=key, requested_by=user), True
+    except IntegrityError:
+        return ReportJob.objects.get(key=key, status__in=(ReportJob.STATUS_QUEUED, ReportJob.STATUS_RUNNING)), False
+
+
+def claim_job(now=None):
+    """Take the oldest queued job (SKIP LOCKED, so workers never block each other) and mark it running."""
+    with transaction.atomic():
+        job = (
+            ReportJob.objects.select_for_update(skip_locked=True)
+            .filter(status=ReportJob.STATUS_QUEUED)
+            .order_by("created_at", "pk")
+            .first()
+        )
+        if job is None:
+            return None
+        job.status, job.started_at, job.claim = ReportJob.STATUS_RUNNING, now or timezone.now(), uuid.uuid4().hex
+        job.save(update_fields=["status", "started_at", "claim"])
+    return job
+
+
+def _rows(job, chunk_size):
+    params = job.params or {}
+    if job.kind == ReportJob.KIND_OVERDUES:
+        return overdue_rows(chunk_size=chunk_size)
+    sources = {
+        ReportJob.KIND_TOP_BORROWED: top_borrowed_rows,
+        ReportJob.KIND_FINES_LEDGER: fines_ledger_rows,
+        ReportJob.KIND_LOAN_HISTORY: loan_history_rows,
+    }
+    return sources[job.kind](params.get("date_from"), params.get("date_to"), chunk_size=chunk_size)
+
+
+def _claimed(job):
+    """Lock ``job``'s row; True while it is still RUNNING under this run's claim."""
+    return ReportJob.objects.select_for_update().filter(
+        pk=job.pk, status=ReportJob.STATUS_RUNNING, claim=job.claim
+    ).exists()
+
+
+def run_job(job, chunk_size=2000):
+    """
+    Generate ``job``'s CSV into the report storage.
+
+    Rows are streamed from the database in ``chunk_size`` batches and written
+    in ~64 KB chunks to a ``.part`` file of this claim's own, renamed into
+    place when complete, so a download never sees a half-written report. If
+    the job was requeued as stale meanwhile, the rename and the result are
+    left to the run that claimed it since.
+    """
+    storage = report_storage()
+    name = f"{job.pk}-{job.kind}.csv"
+    path = storage.path(name)
+    partial = f"{path}.{job.claim}.part"
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    written = 0
+
+    def count(rows):
+        nonlocal written
+        for row in rows:
+            written += 1
+            yield row
+
+    error = None
+    try:
+        header, rows = _rows(job, chunk_size)
+        with open(partial, "w", newline="", encoding="utf-8") as fh:
+            for chunk in csv_chunks(header, count(rows)):
+                fh.write(chunk)
+    except Exception as exc:
+        logger.exception("Report job %s failed", job.pk)
+        error = str(exc)[:1000]
+    with transaction.atomic():
+        if not _claimed(job):
+            logger.warning("Report job %s was claimed again while running; discarding this run", job.pk)
+            if os.path.exists(partial):
+                os.remove(partial)
+            job.refresh_from_db()
+            return job
+        if error is None:
+            os.replace(partial, path)
+            job.status, job.artifact, job.rows, job.size = ReportJob.STATUS_DONE, name, written, os.path.getsize(path)
+        else:
+            if os.path.exists(partial):
+                os.remove(partial)
+            job.status, job.error = ReportJob.STATUS_FAILED, error
+        job.finished_at = timezone.now()
+        job.expires_at = job.finished_at + KEEP_FOR
+        job.save(update_fields=["status", "error", "artifact", "rows", "size", "finished_at", "expires_at"])
+    return job
+
+
+def cleanup_reports(now=None) -> dict:
+    """Delete expired report files and requeue jobs whose worker died mid-run."""
+    now = now or timezone.now()
+    storage = report_storage()
+    expired = list(
+        ReportJob.objects.filter(status__in=(ReportJob.STATUS_DONE, ReportJob.STATUS_FAILED), expires_at__lt=now)
+        .values_list("pk", "artifact")
+    )
+    for _, artifact in expired:
+        if artifact and storage.exists(artifact):
+            storage.delete(artifact)
+    if expired:
+        ReportJob.objects.filter(pk__in=[pk for pk, _ in expired]).update(status=ReportJob.STATUS_EXPIRED, artifact="")
+    requeued = (
+        ReportJob.objects.filter(status=ReportJob.STATUS_RUNNING, started_at__lt=now - STALE_AFTER)
+        .update(status=ReportJob.STATUS_QUEUED, started_at=None, claim="")
+    )
+    return {"expired": len(expired), "requeued": requeued}
+
+
+def run_pending_jobs(max_jobs=None, chunk_size=2000) -> dict:
+    """Clean up, then run queued jobs oldest first until the queue is empty (or ``max_jobs`` ran)."""
+    stats = {**cleanup_reports(), "done": 0, "failed": 0, "superseded": 0}
+    outcomes = {ReportJob.STATUS_DONE: "done", ReportJob.STATUS_FAILED: "failed"}
+    while max_jobs is None or stats["done"] + stats["failed"] + stats["superseded"] < max_jobs:
+        job = claim_job()
+        if job is None:
+            break
+        claim = job.claim
+        job = run_job(job, chunk_size=chunk_size)
+        stats[outcomes[job.status] if job.claim == claim else "superseded"] += 1
+    return stats
@@ -0,0 +1,191 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, Max, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from ..models import Book, BookStat, CirculationEvent, DailyBookStat, DailyStat, Fine, Loan, Watermark
+from .events import consume
+
+ROLLUP_WATERMARK = "circulation-rollups"
+COUNTER_FIELDS = ["loans", "returns", "renewals", "fines_assessed", "fines_paid"]
+_COUNTED = {
+    CirculationEvent.CHECKOUT: "loans",
+    CirculationEvent.RETURN: "returns",
+    CirculationEvent.RENEW: "renewals",
+}
+
+
+def _delta(event):
+    field = _COUNTED.get(event.kind)
+    if field:
+        return field, 1
+    if event.kind == CirculationEvent.FINE:
+        return "fines_assessed", event.amount or Decimal("0.00")
+    if event.kind == CirculationEvent.PAYMENT:
+        return "fines_paid", event.amount or Decimal("0.00")
+    return None, None
+
+
+def _zero():
+    return defaultdict(int)
+
+
+def _merge(model, keys, deltas, defaults=None):
+    """
+    Add ``deltas`` ({key tuple: {field: delta}}) into ``model`` rows keyed by ``keys``.
+
+    One SELECT finds the existing rows; they are incremented with one bulk
+    UPDATE and the missing ones inserted with one bulk INSERT. Callers hold
+    the rollup watermark lock, so no other writer races the read.
+    """
+    if not deltas:
+        return
+    lookup = {f"{key}__in": {k[i] for k in deltas} for i, key in enumerate(keys)}
+    existing = {tuple(getattr(row, key) for key in keys): row for row in model.objects.filter(**lookup)}
+    to_update, to_create = [], []
+    for key, changes in deltas.items():
+        row = existing.get(key)
+        if row is None:
+            row = model(**dict(zip(keys, key)), **(defaults(key) if defaults else {}))
+            to_create.append(row)
+        else:
+            to_update.append(row)
+        for field, value in changes.items():
+            setattr(row, field, getattr(row, field) + value)
+    model.objects.bulk_update(to_update, COUNTER_FIELDS)
+    model.objects.bulk_create(to_create)
+
+
+def apply_events(events):
+    """Fold a batch of CirculationEvents into the daily, per-book-daily and per-book rollups."""
+    days, book_days, books = defaultdict(_zero), defaultdict(_zero), defaultdict(_zero)
+    for event in events:
+        field, value = _delta(event)
+        if field is None:
+            continue
+        day = timezone.localdate(event.occurred_at)
+        days[(day,)][field] += value
+        if event.book_id:
+            book_days[(day, event.book_id)][field] += value
+            books[(event.book_id,)][field] += value
+    categories = dict(
+        Book.objects.filter(pk__in={book_id for _, book_id in book_days}).values_list("pk", "category_id")
+    ) if book_days else {}
+    # Events can outlive their book; drop rows that would point at nothing
+    book_days = {key: value for key, value in book_days.items() if key[1] in categories}
+    books = {key: value for key, value in books.items() if key[0] in categories}
+
+    _merge(DailyStat, ["day"], days)
+    _merge(DailyBookStat, ["day", "book_id"], book_days, defaults=lambda key: {"category_id": categories[key[1]]})
+    _merge(BookStat, ["book_id"], books)
+
+
+def update_rollups(batch_size=5000, max_batches=None, now=None) -> dict:
+    """Fold circulation events recorded since the last run into the rollup tables."""
+    return consume(ROLLUP_WATERMARK, apply_events, batch_size=batch_size, max_batches=max_batches, now=now)
+
+
+def backfill_rollups(batch_size=2000) -> dict:
+    """
+    Rebuild the rollups from the Loan and Fine tables.
+
+    For data that predates the event ledger. Loans count on their checkout
+    and return dates, fines are assessed on their creation date at their
+    current amount and paid on ``paid_at``; renewal dates were never stored,
+    so renewals start at zero. The rollup watermark is moved to the newest
+    event so ``update_rollups`` continues from here without double counting;
+    run it while the desk is quiet.
+    """
+    days, book_days = defaultdict(_zero), defaultdict(_zero)
+
+    def add(rows, field):
+        for day, book_id, value in rows:
+            if day is None or book_id is None:
+                continue
+            days[day][field] += value
+            book_days[(day, book_id)][field] += value
+
+    with transaction.atomic():
+        Watermark.objects.get_or_create(name=ROLLUP_WATERMARK)
+        mark = Watermark.objects.select_for_update().get(name=ROLLUP_WATERMARK)
+        last_event_id = CirculationEvent.objects.aggregate(m=Max("pk"))["m"] or 0
+
+        add(
+            Loan.objects.annotate(day=TruncDate("checked_out_at"))
+            .values_list("day", "copy__book_id").annotate(n=Count("id")).order_by(),
+            "loans",
+        )
+        add(
+            Loan.objects.filter(returned_at__isnull=False).annotate(day=TruncDate("returned_at"))
+            .values_list("day", "copy__book_id").annotate(n=Count("id")).order_by(),
+            "returns",
+        )
+        add(
+            Fine.objects.annotate(day=TruncDate("created_at"))
+            .values_list("day", "loan__copy__book_id").annotate(total=Sum("amount")).order_by(),
+            "fines_assessed",
+        )
+        add(
+            Fine.objects.filter(paid_at__isnull=False).annotate(day=TruncDate("paid_at"))
+            .values_list("day", "loan__copy__book_id").annotate(total=Sum("amount")).order_by(),
+            "fines_paid",
+        )
+
+        books = defaultdict(_zero)
+        for (_, book_id), counts in book_days.items():
+            for field, value in counts.items():
+                books[book_id][field] += value
+        categories = dict(Book.objects.filter(pk__in=books).values_list("pk", "category_id"))
+
+        DailyStat.objects.all().delete()
+        DailyBookStat.objects.all().delete()
+        BookStat.objects.all().delete()
+        DailyStat.objects.bulk_create(
+            [DailyStat(day=day, **counts) for day, counts in days.items()], batch_size=batch_size,
+        )
+        DailyBookStat.objects.bulk_create(
+            [
+                DailyBookStat(day=day, book_id=book_id, category_id=categories[book_id], **counts)
+                for (day, book_id), counts in book_days.items() if book_id in categories
+            ],
+            batch_size=batch_size,
+        )
+        BookStat.objects.bulk_create(
+            [BookStat(book_id=book_id, **counts) for book_id, counts in books.items() if book_id in categories],
+            batch_size=batch_size,
+        )
+        mark.last_event_id = last_event_id
+        mark.save(update_fields=["last_event_id", "updated_at"])
+    return {"days": len(days), "book_days": len(book_days), "books": len(books), "last_event_id": last_event_id}
+
+
+def fine_totals() -> dict:
+    """All-time assessed, paid and outstanding fines from the daily rollup."""
+    totals = DailyStat.objects.aggregate(assessed=Sum("fines_assessed"), paid=Sum("fines_paid"))
+    assessed = totals["assessed"] or Decimal("0.00")
+    paid = totals["paid"] or Decimal("0.00")
+    return {"total": assessed, "paid": paid, "unpaid": assessed - paid}
+
+
+def top_borrowed(limit=10):
+    """Most borrowed titles of all time, from the per-book rollup."""
+    return BookStat.objects.filter(loans__gt=0).select_related("book").order_by("-loans", "book_id")[:limit]
+
+
+def rollups_as_of():
+    """When the rollups last took in events (None before the first run)."""
+    return Watermark.objects.filter(name=ROLLUP_WATERMARK).values_list("updated_at", flat=True).first()
+
+
+def top_categories(since, limit=10):
+    """Categories by loans since ``since`` (a date), from the per-book daily rollup."""
+    return (
+        DailyBookStat.objects.filter(day__gte=since, category__isnull=False)
+        .values("category__name")
+        .annotate(loans=Sum("loans"))
+        .filter(loans__gt=0)
+        .order_by("-loans", "category__name")[:limit]
+    )
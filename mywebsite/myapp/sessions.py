@@ -0,0 +1,98 @@
+"""
+Session engine: cached_db with a per-process L1 and write-back only on change.
+
+Enable with ``SESSION_ENGINE = 'myapp.sessions'``.
+
+- Reads are served from a small in-memory LRU for ``SESSION_L1_SECONDS``
+  (0 disables it) before falling back to the cache table and the DB. Entries
+  are local to the worker, so keep the TTL short on multi-worker deployments:
+  a logout on one worker is only seen by the others once their L1 expires.
+- ``save()`` is skipped when the serialized session is identical to what was
+  loaded, so views that reassign the same value do not cost a DB write plus a
+  cache write.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.sessions.backends.cached_db import SessionStore as CachedDBStore
+
+_l1 = OrderedDict()
+_l1_lock = threading.Lock()
+
+
+def _l1_seconds():
+    return getattr(settings, 'SESSION_L1_SECONDS', 0)
+
+
+def _l1_get(key):
+    with _l1_lock:
+        entry = _l1.get(key)
+        if entry is None:
+            return None
+        expires, raw = entry
+        if expires < time.monotonic():
+            del _l1[key]
+            return None
+        _l1.move_to_end(key)
+        return raw
+
+
+def _l1_set(key, raw):
+    seconds = _l1_seconds()
+    if seconds <= 0:
+        return
+    with _l1_lock:
+        _l1[key] = (time.monotonic() + seconds, raw)
+        _l1.move_to_end(key)
+        while len(_l1) > getattr(settings, 'SESSION_L1_MAX_ENTRIES', 1000):
+            _l1.popitem(last=False)
+
+
+def _l1_delete(key):
+    with _l1_lock:
+        _l1.pop(key, None)
+
+
+class SessionStore(CachedDBStore):
+    def __init__(self, session_key=None):
+        super().__init__(session_key)
+        self._loaded_raw = None
+
+    def _dumps(self, data):
+        return self.serializer().dumps(data)
+
+    def load(self):
+        session_key = self.session_key
+        if session_key and _l1_seconds() > 0:
+            raw = _l1_get(self.cache_key_prefix + session_key)
+            if raw is not None:
+                self._loaded_raw = raw
+                return self.serializer().loads(raw)
+        data = super().load()
+        # An unknown or expired key is reset to None by the DB lookup.
+        if self.session_key:
+            self._loaded_raw = self._dumps(data)
+            _l1_set(self.cache_key_prefix + self.session_key, self._loaded_raw)
+        return data
+
+    def save(self, must_create=False):
+        raw = self._dumps(self._get_session(no_load=must_create))
+        unchanged = (
+            not must_create
+            and self.session_key is not None
+            and raw == self._loaded_raw
+            and not settings.SESSION_SAVE_EVERY_REQUEST
+        )
+        if unchanged:
+            return
+        super().save(must_create)
+        self._loaded_raw = raw
+        _l1_set(self.cache_key, raw)
+
+    def delete(self, session_key=None):
+        key = session_key or self.session_key
+        if key:
+            _l1_delete(self.cache_key_prefix + key)
+        super().delete(session_key)
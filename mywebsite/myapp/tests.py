@@ -1,12 +1,51 @@
-from django.test import TestCase, Client
+import gzip
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import skipUnless
+
+from asgiref.sync import sync_to_async
+from django.test import TestCase, TransactionTestCase, Client
 from django.contrib.auth.models import User
+from django.core import mail
 from django.core.cache import cache
-from django.db import connection
-from django.test.utils import override_settings
+from django.core.management import call_command
+from django.db import OperationalError, connection, connections, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
 from django.urls import reverse
-import time
+from django.utils import timezone
 
-from .models import Book, Author, Category, Tag, BookCopy
+from .models import (
+    AccountSummary, Author, Book, BookCopy, BookStat, Cart, CartItem, Category, CirculationEvent, DailyStat,
+    Fine, Hold, HoldQueue, Loan, PickupRequest, PickupRequestItem, Policy, Profile, ReminderLog, ReportJob, Tag,
+)
+from .services import policy
+from .services.account import get_account_summary, refresh_account_summary
+from .services.analytics import available as analytics_available, compute_analytics, orm_summary
+from .services.barcodes import resolve_barcode, scan
+from .services.borrowers import _lowered, borrower_loans, borrower_summaries, find_borrower
+from .services.circulation import checkin_barcodes, checkout_request, renew_loans, return_loans
+from .services.events import consume, copy_events, record, status_event
+from .services.exports import csv_chunks, encode_chunks
+from .services.fines import accrue_fines, ledger_fines, ledger_page, ledger_totals, overdue_fine
+from .services.holds import HoldError, join_hold, leave_hold
+from .services.overdue import (
+    newly_overdue, overdue_totals, overdue_worklist_loans, overdue_worklist_page, set_watermark, track_overdue,
+)
+from .services.pickups import allocate_pending_requests, place_request
+from .services.policy import active_loan_limit, loan_period_days
+from .services.queue_feed import QueueFeed, latest_event_id
+from .services.reminders import send_reminders
+from .services.report_jobs import claim_job, cleanup_reports, report_storage, run_job, run_pending_jobs
+from .services.rollups import backfill_rollups, fine_totals, update_rollups
+from .sessions import SessionStore
 
 
 class PerformanceTests(TestCase):
@@ -318,3 +357,1281 @@ class CatalogFunctionalTests(TestCase):
         self.assertEqual(response.status_code, 200)
         books = list(response.context['books'])
         self.assertEqual(len(books), 1)
+
+
+class DeferredCullCacheTests(TestCase):
+    """The database cache must not cull inside set(); cull_cache does it in batches."""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_set_never_culls_past_max_entries(self):
+        limit = cache.cull_max_entries
+        cache.set_many({f'k{i}': i for i in range(limit + 5)}, 60)
+        self.assertEqual(cache.table_size(), limit + 5)
+
+    def test_cull_removes_expired_then_excess(self):
+        limit = cache.cull_max_entries
+        cache.set_many({f'old{i}': i for i in range(7)}, -1)
+        cache.set_many({f'k{i}': i for i in range(limit + 3)}, 60)
+
+        stats = cache.cull(batch_size=4)
+
+        self.assertEqual(stats['expired_deleted'], 7)
+        self.assertEqual(stats['culled'], 3)
+        self.assertEqual(stats['size_after'], limit)
+
+    def test_cull_respects_max_batches(self):
+        cache.set_many({f'old{i}': i for i in range(10)}, -1)
+        stats = cache.cull(batch_size=2, max_batches=2)
+        self.assertEqual(stats['expired_deleted'], 4)
+        self.assertEqual(cache.table_size(), 6)
+
+
+class SessionEngineTests(TestCase):
+    """Compare queries per request between cached_db and myapp.sessions."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='reader', password='testpass123')
+        cls.book = Book.objects.create(isbn13='9780000000500', title='Session Book')
+        cls.copy = BookCopy.objects.create(book=cls.book, barcode='SESS-1')
+
+    def _queries_per_request(self, engine, **extra):
+        with override_settings(SESSION_ENGINE=engine, **extra):
+            client = Client()
+            client.force_login(self.user)
+            client.get(reverse('cart-add', args=[self.book.id]), {'copy': self.copy.id})
+            client.get(reverse('cart-view'))
+            with CaptureQueriesContext(connection) as ctx:
+                client.get(reverse('cart-view'))
+            return len(ctx)
+
+    def test_fewer_queries_than_cached_db(self):
+        baseline = self._queries_per_request('django.contrib.sessions.backends.cached_db')
+        lightweight = self._queries_per_request('myapp.sessions', SESSION_L1_SECONDS=60)
+        self.assertLess(lightweight, baseline)
+
+    def test_unchanged_session_is_not_written(self):
+        store = SessionStore()
+        store['cart'] = '1:2'
+        store.save()
+        reloaded = SessionStore(store.session_key)
+        reloaded['cart'] = '1:2'
+        with self.assertNumQueries(0):
+            reloaded.save()
+
+    def test_preselection_is_stored_compactly(self):
+        self.client.force_login(self.user)
+        self.client.get(reverse('cart-add', args=[self.book.id]), {'copy': self.copy.id})
+        item_id = self.book.cartitem_set.get().id
+        self.assertEqual(self.client.session['preselected_copies'], f'{item_id}:{self.copy.id}')
+
+
+class PolicySnapshotTests(TestCase):
+    """Circulation rules come from a process-cached Policy snapshot."""
+
+    def setUp(self):
+        cache.clear()
+        policy.invalidate_policy()
+        self.policy = policy
+
+    def test_snapshot_is_cached_and_never_inserts(self):
+        self.policy.current_policy()
+        with self.assertNumQueries(0):
+            self.policy.current_policy()
+        self.assertFalse(Policy.objects.exists())
+
+    def test_policy_save_refreshes_snapshot(self):
+        Policy.objects.create(student_loan_days=21)
+        self.assertEqual(self.policy.current_policy().student_loan_days, 21)
+
+    def test_policy_delete_reaches_other_workers(self):
+        row = Policy.objects.create(student_loan_days=21)
+        other_worker = self.policy.current_policy()
+        self.assertEqual(other_worker.student_loan_days, 21)
+        row.delete()
+        # Another worker still holds the old snapshot; its recheck must see a new stamp
+        self.policy._snapshot, self.policy._checked_at = other_worker, 0.0
+        self.assertNotEqual(self.policy.current_policy().student_loan_days, 21)
+
+    def test_role_resolution_uses_selected_profile(self):
+        user = User.objects.create_user(username='lecturer1', password='x')
+        Profile.objects.create(user=user, usertype='Lecturer')
+        user = User.objects.select_related('profile').get(pk=user.pk)
+        self.policy.current_policy()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.policy.active_loan_limit(user), 10)
+            self.assertEqual(self.policy.loan_period_days(user), 28)
+
+
+class AccountSummaryTests(TestCase):
+    """AccountSummary rows follow loans, fines, requests and cart changes."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='patron', password='testpass123')
+        cls.book = Book.objects.create(isbn13='9780000000600', title='Summary Book')
+        copies = [BookCopy.objects.create(book=cls.book, barcode=f'SUM-{i}') for i in range(3)]
+        now = timezone.now()
+        overdue = Loan.objects.create(borrower=cls.user, copy=copies[0], due_at=now - timedelta(days=2))
+        Loan.objects.create(borrower=cls.user, copy=copies[1], due_at=now + timedelta(days=5))
+        Loan.objects.create(borrower=cls.user, copy=copies[2], due_at=now - timedelta(days=9), returned_at=now)
+        Fine.objects.create(loan=overdue, amount=Decimal('12.50'))
+        Fine.objects.create(loan=overdue, amount=Decimal('3.00'), paid_at=now)
+
+    def test_refresh_counts_from_source_tables(self):
+        refresh_account_summary(self.user)
+        with self.assertNumQueries(1):
+            summary = get_account_summary(self.user)
+        self.assertEqual(summary.active_loans, 2)
+        self.assertEqual(summary.overdue_loans, 1)
+        self.assertEqual(summary.unpaid_fines, Decimal('12.50'))
+        self.assertEqual(summary.cart_items, 0)
+
+    def test_new_user_gets_a_row_and_reads_never_write(self):
+        newcomer = User.objects.create_user(username='newcomer', password='testpass123')
+        self.assertEqual(AccountSummary.objects.get(user=newcomer).active_loans, 0)
+
+        AccountSummary.objects.filter(user=self.user).delete()
+        self.client.force_login(self.user)
+        self.client.get(reverse('my-loans'))
+        self.assertFalse(AccountSummary.objects.filter(user=self.user).exists())
+        self.assertEqual(get_account_summary(self.user).active_loans, 0)
+
+    def test_cart_add_updates_summary(self):
+        self.client.force_login(self.user)
+        self.client.get(reverse('cart-add', args=[self.book.id]))
+        self.assertEqual(AccountSummary.objects.get(user=self.user).cart_items, 1)
+
+    def test_rebuild_command(self):
+        call_command('rebuild_account_summaries', stdout=StringIO())
+        self.assertEqual(AccountSummary.objects.get(user=self.user).active_loans, 2)
+
+
+class CirculationTestMixin:
+    """Helpers to build patrons, staff, titles and pickup requests for circulation tests."""
+
+    @classmethod
+    def make_staff(cls, username='desk'):
+        return User.objects.create_user(username=username, password='testpass123', is_staff=True)
+
+    @classmethod
+    def make_copies(cls, n, prefix='CIRC', status=BookCopy.STATUS_AVAILABLE):
+        """Create ``n`` titles with one copy each (barcodes ``<prefix>-<i>``)."""
+        copies = []
+        for i in range(n):
+            book = Book.objects.create(isbn13=f'{prefix}-{i}'[:13], title=f'{prefix} Title {i}')
+            copies.append(BookCopy.objects.create(book=book, barcode=f'{prefix}-{i}', status=status))
+        return copies
+
+    @classmethod
+    def make_request(cls, requester, copies, status='READY'):
+        pr = PickupRequest.objects.create(requester=requester, status=status, pickup_by=timezone.now().date())
+        PickupRequestItem.objects.bulk_create([
+            PickupRequestItem(request=pr, book_id=copy.book_id, assigned_copy=copy) for copy in copies
+        ])
+        return pr
+
+
+class ConfirmPickupTests(CirculationTestMixin, TestCase):
+    """confirm_pickup creates loans with set-based writes and unchanged semantics."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = cls.make_staff()
+        cls.patron = User.objects.create_user(username='borrower', password='testpass123')
+
+    def setUp(self):
+        self.client.force_login(self.staff)
+
+    def _pickup(self, pr):
+        return self.client.post(reverse('staff-request-confirm-pickup', args=[pr.id]))
+
+    def test_pickup_creates_loans_and_flips_copies(self):
+        copies = self.make_copies(3, prefix='PK', status=BookCopy.STATUS_RESERVED)
+        pr = self.make_request(self.patron, copies)
+        self._pickup(pr)
+
+        pr.refresh_from_db()
+        self.assertEqual(pr.status, PickupRequest.STATUS_PICKED_UP)
+        loans = list(Loan.objects.filter(borrower=self.patron))
+        self.assertEqual(len(loans), 3)
+        self.assertEqual({l.copy_id for l in loans}, {c.id for c in copies})
+        self.assertEqual(len({l.due_at for l in loans}), 1)
+        expected_days = loan_period_days(self.patron)
+        self.assertEqual((loans[0].due_at - pr.picked_up_at).days, expected_days)
+        self.assertFalse(BookCopy.objects.filter(id__in=[c.id for c in copies]).exclude(status=BookCopy.STATUS_ON_LOAN).exists())
+
+    def test_unreservable_copy_aborts_without_writes(self):
+        copies = self.make_copies(2, prefix='BAD', status=BookCopy.STATUS_RESERVED)
+        BookCopy.objects.filter(pk=copies[1].pk).update(status=BookCopy.STATUS_LOST)
+        pr = self.make_request(self.patron, copies)
+        self._pickup(pr)
+
+        pr.refresh_from_db()
+        self.assertEqual(pr.status, PickupRequest.STATUS_READY)
+        self.assertFalse(Loan.objects.exists())
+        self.assertEqual(BookCopy.objects.get(pk=copies[0].pk).status, BookCopy.STATUS_RESERVED)
+
+    def test_limit_warning_counts_live_loans(self):
+        limit = active_loan_limit(self.patron)
+        self.assertEqual(get_account_summary(self.patron).active_loans, 0)
+        on_loan = self.make_copies(limit, prefix='HELD', status=BookCopy.STATUS_ON_LOAN)
+        # Written around the summary, as an admin edit would be, so the summary still says 0
+        Loan.objects.bulk_create([Loan(borrower=self.patron, copy=copy, due_at=timezone.now()) for copy in on_loan])
+        pr = self.make_request(self.patron, self.make_copies(1, prefix='OVER', status=BookCopy.STATUS_RESERVED))
+        response = self.client.post(reverse('staff-request-confirm-pickup', args=[pr.id]), follow=True)
+        self.assertContains(response, f'currently has {limit}')
+
+    def test_query_count_independent_of_item_count(self):
+        # Warm the policy snapshot and the patron's account summary
+        self._pickup(self.make_request(self.patron, self.make_copies(1, prefix='WARM')))
+        counts = {}
+        for n in (1, 10, 50):
+            with self.subTest(items=n):
+                copies = self.make_copies(n, prefix=f'B{n}', status=BookCopy.STATUS_RESERVED)
+                pr = self.make_request(self.patron, copies)
+                with CaptureQueriesContext(connection) as ctx:
+                    self._pickup(pr)
+                counts[n] = len(ctx)
+        self.assertEqual(counts[1], counts[10])
+        self.assertEqual(counts[10], counts[50])
+
+
+class BatchCheckinTests(CirculationTestMixin, TestCase):
+    """Batch check-in closes many loans in one transaction with bulk writes."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = cls.make_staff()
+        cls.patron = User.objects.create_user(username='returner', password='testpass123')
+        cls.copies = cls.make_copies(4, prefix='RET', status=BookCopy.STATUS_ON_LOAN)
+        now = timezone.now()
+        for i, copy in enumerate(cls.copies[:3]):
+            Loan.objects.create(borrower=cls.patron, copy=copy, due_at=now + timedelta(days=3 - 3 * i))
+
+    def test_checkin_returns_loans_and_fines_overdue(self):
+        self.client.force_login(self.staff)
+        barcodes = '\n'.join(['RET-0', 'RET-1', 'RET-2', 'RET-3', 'NOPE', 'RET-0'])
+        response = self.client.post(reverse('staff-checkin-batch'), {'barcodes': barcodes})
+
+        results = {r.barcode: r.status for r in response.context['results']}
+        self.assertEqual(results, {
+            'RET-0': 'returned', 'RET-1': 'returned', 'RET-2': 'returned',
+            'RET-3': 'not_on_loan', 'NOPE': 'not_found',
+        })
+        self.assertFalse(Loan.objects.filter(returned_at__isnull=True).exists())
+        self.assertEqual(BookCopy.objects.filter(barcode__startswith='RET-', status=BookCopy.STATUS_AVAILABLE).count(), 3)
+        self.assertEqual(sorted(Fine.objects.values_list('reason', flat=True)), ['Overdue 3 day(s)'])
+
+    def test_query_count_independent_of_scan_size(self):
+        Loan.objects.update(due_at=timezone.now() - timedelta(days=2))
+        with CaptureQueriesContext(connection) as one:
+            checkin_barcodes(['RET-0'], timezone.now())
+        with CaptureQueriesContext(connection) as many:
+            checkin_barcodes(['RET-1', 'RET-2'], timezone.now())
+        self.assertEqual(len(one), len(many))
+
+
+class BarcodeScanTests(CirculationTestMixin, TestCase):
+    """The scan endpoint resolves a barcode in one query on the unique barcode column."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = cls.make_staff()
+        cls.patron = User.objects.create_user(username='scanner', password='testpass123')
+        cls.copies = cls.make_copies(2, prefix='SCAN', status=BookCopy.STATUS_ON_LOAN)
+        Loan.objects.create(borrower=cls.patron, copy=cls.copies[0], due_at=timezone.now() + timedelta(days=7))
+
+    def test_scan_returns_copy_loan_and_uses_one_query(self):
+        self.client.force_login(self.staff)
+        url = reverse('staff-scan-barcode')
+        self.client.get(url, {'barcode': 'SCAN-0'})
+        with CaptureQueriesContext(connection) as ctx:
+            data = scan('SCAN-0')
+        self.assertEqual(len(ctx), 1)
+        self.assertEqual(data['copy']['id'], self.copies[0].id)
+        self.assertEqual(data['loan']['borrower'], 'scanner')
+        self.assertIsNone(data['request'])
+
+        response = self.client.get(url, {'barcode': 'MISSING'})
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(response.json()['found'])
+
+    def test_renamed_barcode_resolves_to_the_new_code(self):
+        copy = self.copies[1]
+        self.assertEqual(resolve_barcode('SCAN-1').pk, copy.pk)
+        BookCopy.objects.filter(pk=copy.pk).update(barcode='SCAN-1B')  # bypasses signals
+        self.assertIsNone(resolve_barcode('SCAN-1'))
+        self.assertEqual(resolve_barcode('SCAN-1B').pk, copy.pk)
+
+
+class FineAccrualTests(CirculationTestMixin, TestCase):
+    """accrue_fines keeps one running fine per overdue loan at the Policy rate."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.patron = User.objects.create_user(username='latecomer', password='testpass123')
+        copies = cls.make_copies(3, prefix='ACC', status=BookCopy.STATUS_ON_LOAN)
+        now = timezone.now()
+        cls.late = Loan.objects.create(borrower=cls.patron, copy=copies[0], due_at=now - timedelta(days=4))
+        cls.later = Loan.objects.create(borrower=cls.patron, copy=copies[1], due_at=now - timedelta(days=2))
+        Loan.objects.create(borrower=cls.patron, copy=copies[2], due_at=now + timedelta(days=2))
+
+    def setUp(self):
+        cache.clear()
+        Policy.objects.update_or_create(pk=1, defaults={'fine_rate_per_day': Decimal('2.00')})
+
+    def test_accrual_is_idempotent_and_follows_policy_rate(self):
+        stats = accrue_fines()
+        self.assertEqual((stats['created'], stats['updated']), (2, 0))
+        self.assertEqual(Fine.objects.get(loan=self.late).amount, Decimal('8.00'))
+        self.assertEqual(accrue_fines()['created'] + accrue_fines()['updated'], 0)
+
+        policy = Policy.objects.get(pk=1)
+        policy.fine_rate_per_day = Decimal('3.00')
+        policy.save()
+        self.assertEqual(accrue_fines()['updated'], 2)
+        self.assertEqual(Fine.objects.get(loan=self.later).amount, Decimal('6.00'))
+        self.assertEqual(AccountSummary.objects.get(user=self.patron).unpaid_fines, Decimal('18.00'))
+
+    def test_return_freezes_running_fine_and_credits_payments(self):
+        accrue_fines()
+        running = Fine.objects.get(loan=self.late)
+        running.paid_at, running.accruing = timezone.now(), False
+        running.save()
+
+        self.late.refresh_from_db()
+        fines = return_loans([self.late], timezone.now())
+        self.assertIsNone(fines[self.late.id])
+        self.assertEqual(Fine.objects.filter(loan=self.late).count(), 1)
+
+        self.later.refresh_from_db()
+        fines = return_loans([self.later], timezone.now())
+        self.assertFalse(fines[self.later.id].accruing)
+        self.assertEqual(Fine.objects.filter(loan=self.later).count(), 1)
+
+    def test_return_through_loan_form_keeps_the_fine(self):
+        accrue_fines()
+        self.assertEqual(Fine.objects.get(loan=self.late).amount, Decimal('8.00'))
+        hold = join_hold(User.objects.create_user(username='waiting', password='testpass123'), self.late.copy.book)
+        staff = self.make_staff()
+        self.client.force_login(staff)
+        returned_at = timezone.localtime() - timedelta(days=1)
+        response = self.client.post(reverse('loan-update', args=[self.late.pk]), {
+            'due_at': timezone.localtime(self.late.due_at).strftime('%Y-%m-%dT%H:%M'),
+            'returned_at': returned_at.strftime('%Y-%m-%dT%H:%M'),
+            'renew_count': 0,
+            'note': '',
+        })
+        self.assertRedirects(response, reverse('catalog-list'), fetch_redirect_response=False)
+
+        fine = Fine.objects.get(loan=self.late)
+        self.assertFalse(fine.accruing)
+        self.assertEqual(fine.amount, Decimal('6.00'))  # frozen at the return date
+        self.assertEqual(accrue_fines()['cleared'], 0)
+        self.assertEqual(Fine.objects.get(loan=self.late).amount, Decimal('6.00'))
+        self.assertEqual(Hold.objects.get(pk=hold.pk).status, Hold.STATUS_OFFERED)  # the copy went to the hold queue
+        self.assertEqual(BookCopy.objects.get(pk=self.late.copy_id).status, BookCopy.STATUS_RESERVED)
+        self.assertEqual(CirculationEvent.objects.filter(kind=CirculationEvent.RETURN, loan_id=self.late.pk).count(), 1)
+
+
+class OverdueTrackerTests(CirculationTestMixin, TestCase):
+    """track_overdue stamps loans once; watermark readers see each overdue loan once."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.patron = User.objects.create_user(username='tracked', password='testpass123')
+        copies = cls.make_copies(3, prefix='TRK', status=BookCopy.STATUS_ON_LOAN)
+        now = timezone.now()
+        cls.loans = [
+            Loan.objects.create(borrower=cls.patron, copy=copy, due_at=now + timedelta(hours=offset))
+            for copy, offset in zip(copies, (-5, -1, 3))
+        ]
+
+    def test_partial_indexes_exist(self):
+        with connection.cursor() as cursor:
+            names = set(connection.introspection.get_constraints(cursor, 'myapp_loan'))
+            names |= set(connection.introspection.get_constraints(cursor, 'myapp_fine'))
+        self.assertTrue({'loan_open_due_idx', 'loan_pending_overdue_idx', 'fine_unpaid_loan_idx'} <= names)
+
+    def test_watermark_reader_sees_only_new_overdues(self):
+        now = timezone.now()
+        self.assertEqual(track_overdue(now)['marked'], 2)
+        self.assertEqual(track_overdue(now)['marked'], 0)
+
+        loans, until = newly_overdue('test-reminders')
+        self.assertEqual(set(loans.values_list('pk', flat=True)), {self.loans[0].pk, self.loans[1].pk})
+        set_watermark('test-reminders', until)
+
+        later = now + timedelta(hours=4)
+        Loan.objects.filter(pk=self.loans[0].pk).update(due_at=later + timedelta(days=7))  # renewed
+        stats = track_overdue(later)
+        self.assertEqual((stats['marked'], stats['cleared']), (1, 1))
+        loans, _ = newly_overdue('test-reminders')
+        self.assertEqual(list(loans.values_list('pk', flat=True)), [self.loans[2].pk])
+
+
+class FailingEmailBackend:
+    """Email backend stub that rejects every batch (used by ReminderPipelineTests)."""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def open(self):
+        raise ConnectionError('smtp down')
+
+    def close(self):
+        pass
+
+
+class ReminderPipelineTests(CirculationTestMixin, TestCase):
+    """send_reminders sends one digest per borrower and never repeats a reminder."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = User.objects.create_user(username='reader', email='reader@example.com', password='testpass123')
+        cls.silent = User.objects.create_user(username='silent', password='testpass123')
+        copies = cls.make_copies(4, prefix='REM', status=BookCopy.STATUS_ON_LOAN)
+        now = timezone.now()
+        for copy, user, due in [
+            (copies[0], cls.reader, now - timedelta(days=3)),
+            (copies[1], cls.reader, now + timedelta(days=1, hours=12)),
+            (copies[2], cls.reader, now + timedelta(days=10)),
+            (copies[3], cls.silent, now - timedelta(days=1)),
+        ]:
+            Loan.objects.create(borrower=user, copy=copy, due_at=due)
+
+    def test_digest_is_sent_once_and_recorded(self):
+        stats = send_reminders(batch_size=1, workers=2)
+        self.assertEqual((stats['digests'], stats['sent'], stats['no_email']), (1, 1, 1))
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['reader@example.com'])
+        self.assertIn('Overdue:', mail.outbox[0].body)
+        self.assertEqual(
+            sorted(ReminderLog.objects.values_list('kind', flat=True)),
+            [ReminderLog.KIND_DUE_SOON, ReminderLog.KIND_OVERDUE],
+        )
+
+        self.assertEqual(send_reminders()['sent'], 0)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_failed_delivery_is_retried_next_run(self):
+        with self.assertLogs('myapp.services.reminders', 'ERROR'):
+            stats = send_reminders(backend='myapp.tests.FailingEmailBackend')
+        self.assertEqual((stats['sent'], stats['failed']), (0, 1))
+        self.assertFalse(ReminderLog.objects.exists())
+        self.assertEqual(send_reminders()['sent'], 1)
+
+
+class PickupExpiryTests(CirculationTestMixin, TestCase):
+    """The expiry sweeper closes stale requests and releases their copies in bulk."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.patron = User.objects.create_user(username='forgetful', password='testpass123')
+        copies = cls.make_copies(3, prefix='EXP', status=BookCopy.STATUS_RESERVED)
+        today = timezone.localdate()
+        cls.stale = cls.make_request(cls.patron, copies[:2])
+        cls.fresh = cls.make_request(cls.patron, copies[2:])
+        PickupRequest.objects.filter(pk=cls.stale.pk).update(pickup_by=today - timedelta(days=1))
+        PickupRequest.objects.filter(pk=cls.fresh.pk).update(pickup_by=today + timedelta(days=1))
+
+    def test_sweeper_expires_and_releases(self):
+        out = StringIO()
+        call_command('expire_pickups', '--batch-size', '1', stdout=out)
+        self.assertIn('expired=1 released=2 batches=1', out.getvalue())
+        self.stale.refresh_from_db()
+        self.fresh.refresh_from_db()
+        self.assertEqual(self.stale.status, PickupRequest.STATUS_EXPIRED)
+        self.assertEqual(self.fresh.status, PickupRequest.STATUS_READY)
+        self.assertEqual(BookCopy.objects.filter(barcode__startswith='EXP-', status=BookCopy.STATUS_AVAILABLE).count(), 2)
+
+
+class AllocationEngineTests(CirculationTestMixin, TestCase):
+    """allocate_pending_requests fills pending requests FIFO, preferring the pickup location."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = cls.make_staff()
+        book = Book.objects.create(title='Popular', isbn13='9780000000371')
+        BookCopy.objects.bulk_create([
+            BookCopy(book=book, barcode='ALLOC-MAIN', location='Main'),
+            BookCopy(book=book, barcode='ALLOC-ANNEX', location='Annex'),
+        ])
+        cls.requests = []
+        for name, location in [('first', 'Annex'), ('second', 'Annex'), ('third', 'Main')]:
+            user = User.objects.create_user(username=name, password='testpass123')
+            pr = PickupRequest.objects.create(requester=user, pickup_location=location)
+            PickupRequestItem.objects.create(request=pr, book=book)
+            cls.requests.append(pr)
+
+    def test_fifo_with_location_preference(self):
+        self.client.force_login(self.staff)
+        self.client.post(reverse('staff-requests-queue'), {'action': 'allocate'})
+
+        first, second, third = [PickupRequest.objects.get(pk=pr.pk) for pr in self.requests]
+        self.assertEqual(first.items.get().assigned_copy.barcode, 'ALLOC-ANNEX')
+        self.assertEqual(second.items.get().assigned_copy.barcode, 'ALLOC-MAIN')
+        self.assertIsNone(third.items.get().assigned_copy)
+        self.assertEqual([first.status, third.status], [PickupRequest.STATUS_PREPARING, PickupRequest.STATUS_PENDING])
+        self.assertFalse(BookCopy.objects.filter(barcode__startswith='ALLOC-', status=BookCopy.STATUS_AVAILABLE).exists())
+
+    def test_partly_filled_request_is_completed_when_stock_arrives(self):
+        patron = User.objects.create_user(username='partial', password='testpass123')
+        stocked, scarce = (Book.objects.create(title=f'Partial {i}', isbn13=f'97800000015{i}') for i in range(2))
+        BookCopy.objects.create(book=stocked, barcode='PART-0')
+        pr = PickupRequest.objects.create(requester=patron)
+        PickupRequestItem.objects.bulk_create([PickupRequestItem(request=pr, book=stocked), PickupRequestItem(request=pr, book=scarce)])
+
+        allocate_pending_requests()
+        pr.refresh_from_db()
+        self.assertEqual(pr.status, PickupRequest.STATUS_PREPARING)
+        self.assertIsNone(pr.items.get(book=scarce).assigned_copy)
+
+        BookCopy.objects.create(book=scarce, barcode='PART-1')
+        stats = allocate_pending_requests()
+        self.assertEqual(pr.items.get(book=scarce).assigned_copy.barcode, 'PART-1')
+        self.assertEqual(stats['assigned'], 1)
+
+
+class OptimisticReservationTests(TransactionTestCase):
+    """Concurrent place_request() calls never hand the same copy to two requests."""
+
+    def test_threads_never_double_reserve(self):
+        book = Book.objects.create(title='Bestseller', isbn13='9780000000388')
+        copies = BookCopy.objects.bulk_create([BookCopy(book=book, barcode=f'HOT-{i}') for i in range(5)])
+        patrons = [User.objects.create_user(username=f'fan{i}', password='testpass123') for i in range(10)]
+        carts = [CartItem.objects.create(cart=Cart.objects.create(owner=user), book=book) for user in patrons]
+        errors = []
+        start = threading.Barrier(10)
+
+        def patron(i):
+            try:
+                start.wait()
+                for _ in range(50):
+                    try:
+                        with transaction.atomic():
+                            # Every two patrons preselect the same copy
+                            place_request(patrons[i], [carts[i]], {carts[i].id: copies[i // 2].pk}, None)
+                        break
+                    except OperationalError:  # sqlite: writer busy, retry
+                        time.sleep(0.01)
+            except Exception as exc:  # pragma: no cover - surfaced below
+                errors.append(exc)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=patron, args=(i,)) for i in range(10)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(errors, [])
+        won = list(PickupRequestItem.objects.exclude(assigned_copy=None).values_list('assigned_copy_id', flat=True))
+        self.assertEqual(PickupRequestItem.objects.count(), 10)
+        self.assertEqual(len(won), len(set(won)))
+        self.assertEqual(len(won), 5)
+        self.assertEqual(BookCopy.objects.filter(book=book, status=BookCopy.STATUS_RESERVED).count(), 5)
+
+
+class HoldQueueTests(CirculationTestMixin, TestCase):
+    """Hold positions come from sequence numbers; returns offer copies to the queue head."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.borrower = User.objects.create_user(username='holder', password='testpass123')
+        cls.copy = cls.make_copies(1, prefix='HOLD', status=BookCopy.STATUS_ON_LOAN)[0]
+        cls.book = cls.copy.book
+        cls.loan = Loan.objects.create(borrower=cls.borrower, copy=cls.copy, due_at=timezone.now() + timedelta(days=5))
+        cls.patrons = [User.objects.create_user(username=f'waiter{i}', password='testpass123') for i in range(4)]
+
+    def _positions(self):
+        holds = Hold.objects.filter(status=Hold.STATUS_WAITING).select_related('book__hold_queue')
+        return {hold.patron.username: hold.position for hold in holds}
+
+    def test_leave_closes_gap_and_return_offers_head(self):
+        self.client.force_login(self.patrons[0])
+        response = self.client.post(reverse('hold-join', args=[self.book.pk]), follow=True)
+        self.assertContains(response, '#1')
+        holds = [join_hold(patron, self.book) for patron in self.patrons]
+        self.assertEqual(join_hold(self.patrons[0], self.book).pk, holds[0].pk)
+        leave_hold(holds[1])
+        self.assertEqual(self._positions(), {'waiter0': 1, 'waiter2': 2, 'waiter3': 3})
+
+        loan = Loan.objects.select_related('copy').get(pk=self.loan.pk)
+        return_loans([loan], timezone.now())
+
+        offered = Hold.objects.get(pk=holds[0].pk)
+        self.assertEqual(offered.status, Hold.STATUS_OFFERED)
+        self.assertEqual(offered.request.status, PickupRequest.STATUS_READY)
+        self.assertEqual(offered.request.items.get().assigned_copy_id, self.copy.pk)
+        self.assertEqual(BookCopy.objects.get(pk=self.copy.pk).status, BookCopy.STATUS_RESERVED)
+        self.assertEqual(self._positions(), {'waiter2': 1, 'waiter3': 2})
+
+    def test_back_to_back_leaves_with_stale_instances(self):
+        holds = [join_hold(patron, self.book) for patron in self.patrons]
+        stale = list(Hold.objects.filter(pk__in=[holds[1].pk, holds[2].pk]).order_by('seq'))
+        self.assertTrue(leave_hold(stale[0]))
+        self.assertTrue(leave_hold(stale[1]))  # its seq moved up after it was loaded
+        self.assertFalse(leave_hold(stale[1]))
+        self.assertEqual(self._positions(), {'waiter0': 1, 'waiter3': 2})
+        seqs = list(Hold.objects.filter(status=Hold.STATUS_WAITING).values_list('seq', flat=True))
+        self.assertEqual(len(seqs), len(set(seqs)))
+
+    def test_join_rejected_while_copies_available(self):
+        BookCopy.objects.create(book=self.book, barcode='HOLD-SPARE')
+        with self.assertRaises(HoldError):
+            join_hold(self.patrons[0], self.book)
+
+
+class CartPlacementTests(CirculationTestMixin, TestCase):
+    """cart_place_request places a request with bulk writes regardless of cart size."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.patron = User.objects.create_user(username='collector', password='testpass123')
+        cls.copies = cls.make_copies(61, prefix='CART')
+
+    def _fill_cart(self, copies):
+        cart, _ = Cart.objects.get_or_create(owner=self.patron)
+        CartItem.objects.bulk_create([CartItem(cart=cart, book_id=copy.book_id) for copy in copies])
+        return {f'copy_{item.id}': item.book.copies.get().id for item in cart.items.select_related('book')}
+
+    def test_query_count_constant_for_1_to_50_items(self):
+        self.client.force_login(self.patron)
+        counts = []
+        start = 0
+        for size in (1, 10, 50):
+            form = self._fill_cart(self.copies[start:start + size])
+            start += size
+            with CaptureQueriesContext(connection) as ctx:
+                self.client.post(reverse('cart-place-request'), form)
+            counts.append(len(ctx))
+        self.assertEqual(len(set(counts)), 1, counts)
+        self.assertEqual(BookCopy.objects.filter(status=BookCopy.STATUS_RESERVED).count(), 61)
+
+    def test_taken_preselection_is_reported(self):
+        self.client.force_login(self.patron)
+        form = self._fill_cart(self.copies[:2])
+        BookCopy.objects.filter(pk=self.copies[0].pk).update(status=BookCopy.STATUS_ON_LOAN)
+        response = self.client.post(reverse('cart-place-request'), form, follow=True)
+        self.assertContains(response, 'could be reserved right now')
+        self.assertEqual(
+            sorted(PickupRequestItem.objects.values_list('assigned_copy_id', flat=True), key=str),
+            sorted([None, self.copies[1].pk], key=str),
+        )
+
+
+    def test_selection_of_another_title_is_reported(self):
+        self.client.force_login(self.patron)
+        form = self._fill_cart(self.copies[:1])
+        form = {key: self.copies[60].pk for key in form}
+        response = self.client.post(reverse('cart-place-request'), form, follow=True)
+        self.assertContains(response, 'reserved copy CART-0 instead')
+        self.assertEqual(PickupRequestItem.objects.get().assigned_copy_id, self.copies[0].pk)
+        self.assertEqual(BookCopy.objects.get(pk=self.copies[60].pk).status, BookCopy.STATUS_AVAILABLE)
+
+
+class BulkRenewalTests(CirculationTestMixin, TestCase):
+    """Renew all renews eligible loans with one UPDATE and reports the rest."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.patron = User.objects.create_user(username='renewer', password='testpass123')
+        cls.waiter = User.objects.create_user(username='waiting', password='testpass123')
+        copies = cls.make_copies(23, prefix='RENEW', status=BookCopy.STATUS_ON_LOAN)
+        due = timezone.now() + timedelta(days=2)
+        cls.loans = [Loan.objects.create(borrower=cls.patron, copy=copy, due_at=due) for copy in copies]
+        Loan.objects.filter(pk=cls.loans[0].pk).update(renew_count=2)
+        HoldQueue.objects.create(book_id=copies[1].book_id, last_seq=1)
+        Hold.objects.create(book_id=copies[1].book_id, patron=cls.waiter, seq=1)
+
+    def test_outcomes_and_due_dates(self):
+        self.client.force_login(self.patron)
+        response = self.client.post(reverse('my-loans'), {'action': 'renew_all'}, follow=True)
+        self.assertContains(response, 'renewal limit reached')
+        self.assertContains(response, 'another patron is waiting')
+
+        loans = {loan.pk: loan for loan in Loan.objects.filter(borrower=self.patron)}
+        self.assertEqual(loans[self.loans[0].pk].due_at, self.loans[0].due_at)
+        self.assertEqual(loans[self.loans[1].pk].renew_count, 0)
+        for original in self.loans[2:]:
+            self.assertGreater(loans[original.pk].due_at, original.due_at)
+            self.assertEqual(loans[original.pk].renew_count, 1)
+
+    def test_query_count_constant(self):
+        counts = []
+        for ids in (self.loans[2:3], self.loans[3:23]):
+            with CaptureQueriesContext(connection) as ctx:
+                outcomes = renew_loans(Loan.objects.filter(pk__in=[loan.pk for loan in ids]), timezone.now())
+            self.assertTrue(all(o.renewed for o in outcomes))
+            counts.append(len(ctx))
+        self.assertEqual(counts[0], counts[1], counts)
+
+
+class CirculationEventTests(CirculationTestMixin, TestCase):
+    """Circulation paths append events; readers consume them once behind a watermark."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.patron = User.objects.create_user(username='ledger', password='testpass123')
+        cls.copies = cls.make_copies(3, prefix='EVT', status=BookCopy.STATUS_RESERVED)
+
+    def _kinds(self):
+        return list(CirculationEvent.objects.order_by('pk').values_list('kind', flat=True))
+
+    def test_checkout_return_and_fine_are_recorded(self):
+        pr = self.make_request(self.patron, self.copies[:2])
+        now = timezone.now()
+        checkout_request(pr, list(pr.items.select_related('assigned_copy')), now)
+        self.assertEqual(self._kinds(), ['checkout', 'checkout', 'status'])
+        self.assertEqual(CirculationEvent.objects.get(kind='status').status, PickupRequest.STATUS_PICKED_UP)
+
+        Loan.objects.update(due_at=now - timedelta(days=3))
+        return_loans(list(Loan.objects.select_related('copy')), now)
+        fines = CirculationEvent.objects.filter(kind=CirculationEvent.FINE)
+        self.assertEqual(CirculationEvent.objects.filter(kind=CirculationEvent.RETURN).count(), 2)
+        self.assertEqual(fines.count(), 2)
+        self.assertEqual(sum(event.amount for event in fines), sum(Fine.objects.values_list('amount', flat=True)))
+        self.assertGreater(sum(event.amount for event in fines), 0)
+        self.assertTrue(all(fine.book_id and fine.user_id == self.patron.pk for fine in fines))
+
+    def test_consume_processes_only_new_events(self):
+        seen = []
+        record(copy_events(CirculationEvent.RELEASE, [(c.pk, c.book_id) for c in self.copies], timezone.now()))
+        later = timezone.now() + timedelta(minutes=5)
+        self.assertEqual(consume('audit', seen.extend, batch_size=2, now=later)['events'], 3)
+        self.assertEqual(consume('audit', seen.extend, now=later)['events'], 0)
+
+        record(copy_events(CirculationEvent.RESERVE, [(self.copies[0].pk, self.copies[0].book_id)], timezone.now()))
+        self.assertEqual(consume('audit', seen.extend, now=timezone.now())['events'], 0)  # not settled yet
+
+        def fail(events):
+            raise RuntimeError('handler failed')
+
+        with self.assertRaises(RuntimeError):
+            consume('audit', fail, now=later)
+        consume('audit', seen.extend, now=later)
+        self.assertEqual([event.kind for event in seen], ['release'] * 3 + ['reserve'])
+
+    def test_backdated_events_settle_from_when_they_were_recorded(self):
+        yesterday = timezone.now() - timedelta(days=1)
+        record(copy_events(CirculationEvent.RETURN, [(self.copies[0].pk, self.copies[0].book_id)], yesterday))
+        event = CirculationEvent.objects.get()
+        self.assertEqual(event.occurred_at, yesterday)
+        self.assertGreater(event.recorded_at, yesterday)
+        self.assertEqual(consume('audit', list, now=timezone.now())['events'], 0)
+        self.assertEqual(consume('audit', list, now=timezone.now() + timedelta(minutes=5))['events'], 1)
+
+
+class CirculationRollupTests(CirculationTestMixin, TestCase):
+    """The reports read daily rollups built by backfill and kept current from the event ledger."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = cls.make_staff()
+        cls.patron = User.objects.create_user(username='roller', password='testpass123')
+        cls.copies = cls.make_copies(3, prefix='ROLL', status=BookCopy.STATUS_ON_LOAN)
+        cls.loans = [
+            Loan.objects.create(borrower=cls.patron, copy=copy, due_at=timezone.now() + timedelta(days=7))
+            for copy in cls.copies
+        ]
+        Fine.objects.create(loan=cls.loans[0], amount=Decimal('2.00'), paid_at=timezone.now())
+        Fine.objects.create(loan=cls.loans[1], amount=Decimal('3.00'))
+
+    def test_backfill_then_incremental_events(self):
+        backfill_rollups()
+        self.assertEqual(DailyStat.objects.get().loans, 3)
+        self.assertEqual(fine_totals(), {'total': Decimal('5.00'), 'paid': Decimal('2.00'), 'unpaid': Decimal('3.00')})
+
+        now = timezone.now()
+        return_loans(list(Loan.objects.filter(pk=self.loans[0].pk).select_related('copy')), now)
+        renew_loans(Loan.objects.filter(pk=self.loans[1].pk), now)
+        update_rollups()  # events are inside the settle window
+        self.assertEqual(DailyStat.objects.get().returns, 0)
+        later = now + timedelta(minutes=5)
+        self.assertEqual(update_rollups(now=later)['events'], 2)
+        update_rollups(now=later)
+        stat = BookStat.objects.get(book=self.copies[0].book)
+        self.assertEqual((stat.loans, stat.returns), (1, 1))
+        self.assertEqual(BookStat.objects.get(book=self.copies[1].book).renewals, 1)
+
+    def test_dashboard_query_count_independent_of_history(self):
+        self.client.force_login(self.staff)
+        self.client.get(reverse('staff-reports'))  # warm per-process caches
+        counts = []
+        for _ in range(2):
+            backfill_rollups()
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(reverse('staff-reports'))
+            self.assertContains(response, 'ROLL Title 0')
+            counts.append(len(ctx))
+            Loan.objects.bulk_create([
+                Loan(borrower=self.patron, copy=copy, due_at=timezone.now(), returned_at=timezone.now())
+                for copy in self.copies for _ in range(20)
+            ])
+        self.assertEqual(counts[0], counts[1], counts)
+
+
+class StreamingCsvTests(CirculationTestMixin, TestCase):
+    """Staff CSV reports stream in bounded memory, optionally gzip-compressed."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = cls.make_staff()
+        patron = User.objects.create_user(username='late', password='testpass123')
+        for copy in cls.make_copies(3, prefix='CSV', status=BookCopy.STATUS_ON_LOAN):
+            Loan.objects.create(borrower=patron, copy=copy, due_at=timezone.now() - timedelta(days=2))
+
+    def test_peak_memory_bounded_for_a_million_rows(self):
+        rows = ((i, f'Title {i}', f'patron{i % 500}', '2025-01-01T00:00:00+00:00') for i in range(1_000_000))
+        tracemalloc.start()
+        try:
+            size = sum(len(chunk) for chunk in encode_chunks(csv_chunks(['Id', 'Title', 'Borrower', 'Due At'], rows)))
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        self.assertGreater(size, 40_000_000)
+        self.assertLess(peak, 2_000_000)
+
+    def test_overdues_csv_streams_plain_and_gzip(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('report-overdues-csv'))
+        self.assertTrue(response.streaming)
+        body = b''.join(response.streaming_content).decode()
+        self.assertEqual(len(body.splitlines()), 4)
+        self.assertIn('CSV Title 0,CSV-0,late,', body)
+
+        response = self.client.get(reverse('report-overdues-csv'), {'gzip': '1'})
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertIn('overdues.csv.gz', response['Content-Disposition'])
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)).decode(), body)
+
+
+class ReportJobTests(CirculationTestMixin, TestCase):
+    """Staff queue heavy reports; a worker writes them under MEDIA_ROOT and they expire."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = cls.make_staff()
+        patron = User.objects.create_user(username='historian', password='testpass123')
+        for copy in cls.make_copies(3, prefix='JOB', status=BookCopy.STATUS_ON_LOAN):
+            Loan.objects.create(borrower=patron, copy=copy, due_at=timezone.now() - timedelta(days=1))
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        override = override_settings(MEDIA_ROOT=media.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.client.force_login(self.staff)
+
+    def test_identical_requests_share_one_job(self):
+        form = {'kind': 'loan_history', 'date_from': '2020-01-01', 'date_to': ''}
+        self.client.post(reverse('report-jobs'), form)
+        self.client.post(reverse('report-jobs'), form)
+        self.client.post(reverse('report-jobs'), {**form, 'date_to': '2030-01-01'})
+        self.assertEqual(ReportJob.objects.count(), 2)
+        response = self.client.post(reverse('report-jobs'), {'kind': 'fines_ledger', 'date_from': 'soon'}, follow=True)
+        self.assertContains(response, 'Dates must be YYYY-MM-DD.')
+
+    def test_worker_generates_downloads_and_expires(self):
+        self.client.post(reverse('report-jobs'), {'kind': 'loan_history'})
+        job = ReportJob.objects.get()
+        self.assertEqual(self.client.get(reverse('report-job-status', args=[job.pk])).json()['status'], 'QUEUED')
+
+        self.assertEqual(run_pending_jobs(chunk_size=2)['done'], 1)
+        status = self.client.get(reverse('report-job-status', args=[job.pk])).json()
+        self.assertEqual((status['status'], status['rows']), ('DONE', 3))
+        response = self.client.get(status['download_url'])
+        body = b''.join(response.streaming_content).decode()
+        self.assertEqual(len(body.splitlines()), 4)
+        self.assertIn('JOB-2', body)
+
+        job.refresh_from_db()
+        self.assertEqual(cleanup_reports(now=job.expires_at + timedelta(seconds=1))['expired'], 1)
+        self.assertFalse(report_storage().exists(job.artifact))
+        self.assertEqual(ReportJob.objects.get().status, ReportJob.STATUS_EXPIRED)
+        self.assertEqual(self.client.get(reverse('report-job-download', args=[job.pk])).status_code, 404)
+
+    def test_requeued_job_keeps_the_newer_runs_result(self):
+        self.client.post(reverse('report-jobs'), {'kind': 'overdues'})
+        slow = claim_job()
+        self.assertEqual(cleanup_reports(now=timezone.now() + timedelta(hours=2))['requeued'], 1)
+        fresh = claim_job()
+        self.assertNotEqual(fresh.claim, slow.claim)
+
+        self.assertEqual(run_job(fresh).status, ReportJob.STATUS_DONE)
+        finished = ReportJob.objects.get()
+        stale = run_job(slow)  # the first worker finishes late
+        self.assertEqual(stale.claim, fresh.claim)
+        self.assertEqual(ReportJob.objects.get().finished_at, finished.finished_at)
+        self.assertEqual(os.listdir(report_storage().location), [finished.artifact])
+
+
+@skipUnless(analytics_available(), 'NumPy is not installed')
+class CirculationAnalyticsTests(CirculationTestMixin, TestCase):
+    """Vectorized trends match the ORM aggregation and are cached per day."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = cls.make_staff()
+        patron = User.objects.create_user(username='trendy', password='testpass123')
+        category = Category.objects.create(name='Trends', slug='trends')
+        copies = cls.make_copies(4, prefix='TREND', status=BookCopy.STATUS_AVAILABLE)
+        Book.objects.filter(pk__in=[copy.book_id for copy in copies]).update(category=category)
+        now = timezone.now()
+        # (weeks ago checked out, days kept, days allowed): two on time, one 5 days late, one still out
+        for copy, (weeks_ago, kept, allowed) in zip(copies, [(3, 7, 14), (3, 10, 14), (2, 12, 7), (1, None, 14)]):
+            out = now - timedelta(weeks=weeks_ago)
+            loan = Loan.objects.create(
+                borrower=patron, copy=copy, due_at=out + timedelta(days=allowed),
+                returned_at=out + timedelta(days=kept) if kept is not None else None,
+            )
+            Loan.objects.filter(pk=loan.pk).update(checked_out_at=out)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_vectorized_results_match_orm(self):
+        now = timezone.now()
+        data = compute_analytics(now, chunk_size=2)
+        orm = orm_summary(now)
+        self.assertEqual(sum(data['loans_per_week']), sum(orm['loans_per_week'].values()))
+        self.assertEqual(sum(data['returns_per_week']), sum(orm['returns_per_week'].values()))
+        self.assertEqual(data['lateness_days']['late_rate'], round(1 / 3, 4))
+        self.assertEqual([row['count'] for row in data['lateness_days']['histogram']], [2, 0, 0, 1, 0, 0, 0])
+        self.assertEqual(data['duration_days']['p50'], 10.0)
+        self.assertEqual(data['utilization'][0]['category'], 'Trends')
+        self.assertEqual(data['utilization'][0]['copies'], 4)
+
+    def test_json_endpoint_is_cached_per_day(self):
+        self.client.force_login(self.staff)
+        first = self.client.get(reverse('report-analytics')).json()
+        with CaptureQueriesContext(connection) as ctx:
+            second = self.client.get(reverse('report-analytics')).json()
+        self.assertEqual(first, second)
+        self.assertFalse(any('myapp_loan' in query['sql'] for query in ctx.captured_queries))
+
+
+class FinesLedgerTests(CirculationTestMixin, TestCase):
+    """The fines ledger pages by keyset, filters, totals in one query and groups by borrower."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = cls.make_staff()
+        cls.alice = User.objects.create_user(username='alice', password='testpass123')
+        cls.bob = User.objects.create_user(username='bob', password='testpass123')
+        copies = cls.make_copies(6, prefix='LEDGER', status=BookCopy.STATUS_AVAILABLE)
+        due = timezone.now() - timedelta(days=3)
+        loans = [
+            Loan.objects.create(borrower=cls.alice if i < 4 else cls.bob, copy=copy, due_at=due, returned_at=timezone.now())
+            for i, copy in enumerate(copies)
+        ]
+        Fine.objects.bulk_create([Fine(loan=loan, amount=Decimal('1.50'), reason='Overdue 3 day(s)') for loan in loans])
+        # bulk_create stamps each row; give every fine one created_at so page boundaries rely on the id tie-break
+        Fine.objects.update(created_at=timezone.now())
+        Fine.objects.filter(loan__in=loans[:2] + loans[4:5]).update(paid_at=timezone.now())
+
+    def test_keyset_pages_cover_every_fine_once(self):
+        seen, cursor = [], ''
+        while True:
+            page = ledger_page(ledger_fines(), cursor, size=4)
+            seen.extend(fine.pk for fine in page.items)
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+        self.assertEqual(Fine.objects.values('created_at').distinct().count(), 1)
+        self.assertEqual(seen, list(Fine.objects.order_by('-pk').values_list('pk', flat=True)))
+
+    def test_totals_in_one_query(self):
+        with self.assertNumQueries(1):
+            totals = ledger_totals(ledger_fines())
+        self.assertEqual((totals['count'], totals['paid_count'], totals['unpaid_count']), (6, 3, 3))
+        self.assertEqual((totals['total'], totals['paid'], totals['unpaid']), (Decimal('9.00'), Decimal('4.50'), Decimal('4.50')))
+
+    def test_filters_and_grouped_view(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('staff-fines'), {'borrower': 'ALICE', 'status': 'unpaid'})
+        self.assertEqual([fine.loan.borrower_id for fine in response.context['page'].items], [self.alice.pk] * 2)
+        self.assertEqual(response.context['totals']['unpaid'], Decimal('3.00'))
+
+        today = timezone.localdate().isoformat()
+        response = self.client.get(reverse('staff-fines'), {'group': 'borrower', 'date_from': today, 'date_to': today})
+        rows = {row['loan__borrower__username']: row for row in response.context['page'].items}
+        self.assertEqual((rows['alice']['count'], rows['alice']['unpaid']), (4, Decimal('3.00')))
+        self.assertEqual((rows['bob']['count'], rows['bob']['paid']), (2, Decimal('1.50')))
+
+        yesterday = (timezone.localdate() - timedelta(days=1)).isoformat()
+        response = self.client.get(reverse('staff-fines'), {'date_to': yesterday})
+        self.assertEqual(response.context['totals']['count'], 0)
+
+    def test_query_count_does_not_grow_with_depth(self):
+        self.client.force_login(self.staff)
+        self.client.get(reverse('staff-fines'))
+        deep = ledger_page(ledger_fines(), size=5).next_cursor
+        counts = []
+        for params in ({}, {'after': deep}):
+            with CaptureQueriesContext(connection) as ctx:
+                self.client.get(reverse('staff-fines'), params)
+            counts.append(len(ctx))
+        self.assertEqual(counts[0], counts[1], counts)
+
+
+class OverdueWorklistTests(CirculationTestMixin, TestCase):
+    """The overdue worklist computes lateness in SQL, groups by borrower and sends reminders to a selection."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = cls.make_staff()
+        cls.ann = User.objects.create_user(username='ann', email='ann@example.com', password='testpass123')
+        cls.ben = User.objects.create_user(username='ben', email='ben@example.com', password='testpass123')
+        cls.cat = User.objects.create_user(username='cat', email='cat@example.com', password='testpass123')
+        copies = iter(cls.make_copies(7, prefix='WORK', status=BookCopy.STATUS_ON_LOAN))
+        now = timezone.now()
+        for user, days in [(cls.ann, 10), (cls.ann, 2), (cls.ben, 30), (cls.cat, 1), (cls.cat, 1), (cls.cat, 1)]:
+            Loan.objects.create(borrower=user, copy=next(copies), due_at=now - timedelta(days=days))
+        Loan.objects.create(borrower=cls.ann, copy=next(copies), due_at=now + timedelta(days=5))
+
+    def test_lateness_matches_fine_rule(self):
+        now = timezone.now()
+        loans = list(overdue_worklist_loans(now))
+        self.assertEqual(len(loans), 6)
+        for loan in loans:
+            self.assertEqual((loan.days_overdue, loan.est_fine), overdue_fine(loan.due_at, now))
+        totals = overdue_totals(now)
+        self.assertEqual((totals['loans'], totals['borrowers']), (6, 3))
+        self.assertEqual(totals['est_fine'], sum(loan.est_fine for loan in loans))
+
+    def test_severity_sorts_and_keyset_pages(self):
+        def walk(sort):
+            order, cursor = [], ''
+            while True:
+                with self.assertNumQueries(3):
+                    page = overdue_worklist_page(sort=sort, cursor=cursor, size=1)
+                order += [row['borrower__username'] for row in page.items]
+                if not page.has_next:
+                    return order
+                cursor = page.next_cursor
+
+        overdue_worklist_page()  # load the policy snapshot outside the query counts
+        self.assertEqual(walk('days'), ['ben', 'ann', 'cat'])
+        self.assertEqual(walk('fine'), ['ben', 'ann', 'cat'])
+        self.assertEqual(walk('loans'), ['cat', 'ann', 'ben'])
+        ann = next(row for row in overdue_worklist_page(sort='loans').items if row['borrower_id'] == self.ann.pk)
+        self.assertEqual([loan.days_overdue for loan in ann['items']], [10, 2])
+
+    def test_bulk_reminder_goes_to_selection_only(self):
+        self.client.force_login(self.staff)
+        response = self.client.post(
+            reverse('staff-overdues') + '?sort=fine', {'action': 'remind', 'borrower': [self.ann.pk, self.ben.pk]},
+        )
+        self.assertRedirects(response, reverse('staff-overdues') + '?sort=fine')
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), ['ann@example.com', 'ben@example.com'])
+
+        response = self.client.post(reverse('staff-overdues'), {'action': 'remind', 'borrower': [self.ann.pk]}, follow=True)
+        self.assertContains(response, 'already reminded')
+        self.assertEqual(len(mail.outbox), 2)
+        reminded = {row['borrower_id']: row['last_reminded'] for row in response.context['page'].items}
+        self.assertIsNotNone(reminded[self.ann.pk])
+        self.assertIsNone(reminded[self.cat.pk])
+
+    def test_bulk_reminder_sends_overdue_items_only(self):
+        copy = self.make_copies(1, prefix='SOON', status=BookCopy.STATUS_ON_LOAN)[0]
+        Loan.objects.create(borrower=self.ann, copy=copy, due_at=timezone.now() + timedelta(hours=36))
+        self.client.force_login(self.staff)
+        self.client.post(reverse('staff-overdues'), {'action': 'remind', 'borrower': [self.ann.pk]})
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertNotIn('SOON', mail.outbox[0].body)
+        self.assertFalse(ReminderLog.objects.filter(kind=ReminderLog.KIND_DUE_SOON).exists())
+
+        response = self.client.post(reverse('staff-overdues'), {'action': 'remind', 'borrower': [self.ann.pk, self.cat.pk]}, follow=True)
+        self.assertContains(response, '1 borrower(s) were already reminded')
+
+
+class LoansByUserTests(CirculationTestMixin, TestCase):
+    """The desk loans view pages borrowers and loans by keyset and finds borrowers through LOWER() indexes."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = cls.make_staff()
+        cls.zed = User.objects.create_user(username='Zed', email='Zed@Example.com', password='testpass123')
+        cls.zoe = User.objects.create_user(username='zoe', email='zoe@example.com', password='testpass123')
+        cls.idle = User.objects.create_user(username='zorro', email='zorro@example.com', password='testpass123')
+        copies = cls.make_copies(8, prefix='DESK', status=BookCopy.STATUS_ON_LOAN)
+        now = timezone.now()
+        for i, copy in enumerate(copies[:6]):
+            Loan.objects.create(borrower=cls.zed, copy=copy, due_at=now + timedelta(days=i - 2, hours=1))
+        for copy in copies[6:]:
+            Loan.objects.create(borrower=cls.zoe, copy=copy, due_at=now + timedelta(days=7))
+
+    def test_lookups_use_lower_indexes(self):
+        self.assertEqual(find_borrower(' zed@example.COM '), self.zed)
+        self.assertEqual(find_borrower('ZOE'), self.zoe)
+        if connection.vendor == 'sqlite':
+            self.assertIn('myapp_user_username_lower_idx', _lowered().filter(username_lower='zed').explain())
+            self.assertIn('myapp_user_email_lower_idx', _lowered().filter(email_lower='zed@example.com').explain())
+
+    def test_borrower_summaries_and_prefix_search(self):
+        rows = {row['username']: row for row in borrower_summaries().items}
+        self.assertEqual(set(rows), {'Zed', 'zoe'})  # zorro has no open loans
+        self.assertEqual((rows['Zed']['open_count'], rows['Zed']['overdue_count']), (6, 2))
+        self.assertEqual(rows['zoe']['open_count'], 2)
+        self.assertLess(rows['Zed']['earliest_due'], timezone.now() - timedelta(days=1))
+        self.assertEqual([row['username'] for row in borrower_summaries(prefix='ZO').items], ['zoe'])
+
+        first = borrower_summaries(size=1)
+        second = borrower_summaries(cursor=first.next_cursor, size=1)
+        self.assertEqual([first.items[0]['username'], second.items[0]['username']], ['Zed', 'zoe'])
+        self.assertFalse(second.has_next)
+
+    def test_borrower_loans_page_by_due_date(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('staff-loans-by-user'), {'q': 'ZED'})
+        self.assertEqual(response.context['borrower'], self.zed)
+        self.assertEqual(response.context['summary']['open_count'], 6)
+
+        seen, cursor = [], ''
+        while True:
+            page = borrower_loans(self.zed, cursor, size=4)
+            seen += [loan.due_at for loan in page.items]
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+        self.assertEqual(len(seen), 6)
+        self.assertEqual(seen, sorted(seen))
+
+    def test_query_count_independent_of_loans(self):
+        self.client.force_login(self.staff)
+        self.client.get(reverse('staff-loans-by-user'))
+        with CaptureQueriesContext(connection) as before:
+            self.client.get(reverse('staff-loans-by-user'))
+        extra = self.make_copies(10, prefix='MORE', status=BookCopy.STATUS_ON_LOAN)
+        Loan.objects.bulk_create([Loan(borrower=self.zoe, copy=copy, due_at=timezone.now()) for copy in extra])
+        with CaptureQueriesContext(connection) as after:
+            self.client.get(reverse('staff-loans-by-user'))
+        self.assertEqual(len(before), len(after))
+
+    def test_autocomplete(self):
+        self.client.force_login(self.staff)
+        results = self.client.get(reverse('staff-borrower-autocomplete'), {'q': 'Zo'}).json()['results']
+        self.assertEqual([user['username'] for user in results], ['zoe', 'zorro'])
+        self.assertEqual(self.client.get(reverse('staff-borrower-autocomplete')).json(), {'results': []})
+
+
+class RequestQueueFeedTests(CirculationTestMixin, TestCase):
+    """The live queue feed tails the event ledger and patches rows instead of re-reading the queue."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = cls.make_staff()
+        cls.patron = User.objects.create_user(username='queuer', password='testpass123')
+        cls.copies = cls.make_copies(2, prefix='LIVE', status=BookCopy.STATUS_RESERVED)
+
+    def test_ready_then_cancel_upserts_then_removes(self):
+        pr = self.make_request(self.patron, self.copies, status='PREPARING')
+        feed = QueueFeed(latest_event_id())
+        self.assertEqual(feed.messages(), [])
+
+        self.client.force_login(self.staff)
+        self.client.post(reverse('staff-request-mark-ready', args=[pr.id]))
+        frames = feed.messages()
+        self.assertEqual(len(frames), 1)
+        self.assertIn('event: upsert', frames[0])
+        data = json.loads(frames[0].split('data: ', 1)[1])
+        self.assertEqual(data['id'], pr.id)
+        self.assertIn(f'id="request-{pr.id}"', data['html'])
+        self.assertIn('data-sort="READY ', data['html'])
+        self.assertEqual(feed.messages(), [])  # events already sent are not repeated
+
+        self.client.post(reverse('staff-request-cancel', args=[pr.id]))
+        frames = feed.messages()
+        self.assertEqual(len(frames), 1)
+        self.assertIn('event: remove', frames[0])
+
+    def test_pickup_date_change_reaches_the_feed(self):
+        pr = self.make_request(self.patron, self.copies, status='READY')
+        feed = QueueFeed(latest_event_id())
+        self.client.force_login(self.staff)
+        self.client.post(reverse('staff-request-set-pickup-by', args=[pr.id]), {'pickup_by': '2031-02-03'})
+        frames = feed.messages()
+        self.assertEqual(len(frames), 1)
+        self.assertEqual(json.loads(frames[0].split('data: ', 1)[1])['id'], pr.id)
+
+        self.client.post(reverse('staff-request-set-pickup-by', args=[pr.id]), {'pickup_by': ''})
+        self.assertEqual(len(feed.messages()), 1)
+
+    def test_cursor_waits_for_events_to_settle(self):
+        pr = self.make_request(self.patron, self.copies[:1], status='PENDING')
+        self.client.force_login(self.staff)
+        self.client.post(reverse('staff-request-cancel', args=[pr.id]))
+        feed = QueueFeed(0)
+        self.assertEqual(feed.poll(), [pr.id])
+        self.assertEqual(feed.cursor, 0)  # unsettled: a reconnect resumes before it
+        self.assertEqual(feed.poll(timezone.now() + timedelta(minutes=5)), [])
+        self.assertGreater(feed.cursor, 0)
+        self.assertEqual(feed.seen, set())
+
+    def test_backdated_event_is_not_settled_on_arrival(self):
+        pr = self.make_request(self.patron, self.copies[:1], status='PENDING')
+        record([status_event(PickupRequest.STATUS_CANCELED, timezone.now() - timedelta(days=1), request_id=pr.pk)])
+        feed = QueueFeed(0)
+        self.assertEqual(feed.poll(), [pr.id])
+        self.assertEqual(feed.cursor, 0)
+
+    def test_queue_page_carries_stream_position(self):
+        self.make_request(self.patron, self.copies, status='READY')
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('staff-requests-queue'))
+        self.assertEqual(response.context['last_event_id'], latest_event_id())
+        self.assertContains(response, reverse('staff-requests-queue-stream'))
+
+    def test_wsgi_stream_answers_one_poll(self):
+        pr = self.make_request(self.patron, self.copies, status='PREPARING')
+        self.client.force_login(self.staff)
+        self.client.post(reverse('staff-request-mark-ready', args=[pr.id]))
+
+        start = time.monotonic()
+        response = self.client.get(reverse('staff-requests-queue-stream'), {'after': 0})
+        body = b''.join(response.streaming_content).decode()
+        self.assertLess(time.monotonic() - start, 5)  # not held open: WSGI would buffer the whole stream
+        self.assertTrue(body.startswith('retry:'))
+        self.assertIn('event: upsert', body)
+        self.assertIn(f'request-{pr.id}', body)
+
+    def test_wsgi_reconnect_skips_events_already_sent(self):
+        pr = self.make_request(self.patron, self.copies, status='PREPARING')
+        self.client.force_login(self.staff)
+        self.client.post(reverse('staff-request-mark-ready', args=[pr.id]))
+        url = reverse('staff-requests-queue-stream')
+
+        body = b''.join(self.client.get(url, {'after': 0}).streaming_content).decode()
+        position = re.search(r'^id: (\S+)$', body, re.M).group(1)
+        self.assertEqual(position, f'0:{latest_event_id()}')  # unsettled, so the cursor stays put
+
+        body = b''.join(self.client.get(url, headers={'last-event-id': position}).streaming_content).decode()
+        self.assertNotIn('event: upsert', body)
+
+        self.client.post(reverse('staff-request-cancel', args=[pr.id]))
+        body = b''.join(self.client.get(url, headers={'last-event-id': position}).streaming_content).decode()
+        self.assertIn('event: remove', body)
+        self.assertNotIn('event: upsert', body)
+
+    async def test_stream_sends_frames(self):
+        pr = await sync_to_async(self.make_request)(self.patron, self.copies, status='PREPARING')
+        # aforce_login trips over the database cache behind cached_db sessions, so log in synchronously
+        await sync_to_async(self.async_client.force_login)(self.staff)
+        await sync_to_async(self.client.force_login)(self.staff)
+        await sync_to_async(self.client.post)(reverse('staff-request-mark-ready', args=[pr.id]))
+
+        response = await self.async_client.get(reverse('staff-requests-queue-stream'), {'after': 0})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        chunks = aiter(response.streaming_content)
+        self.assertTrue((await anext(chunks)).startswith(b'retry:'))
+        frame = (await anext(chunks)).decode()
+        self.assertIn('event: upsert', frame)
+        self.assertIn(f'request-{pr.id}', frame)
+        await chunks.aclose()
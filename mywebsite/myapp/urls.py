@@ -38,6 +38,9 @@ urlpatterns = [
     path('cart/remove/<int:book_id>/', cart_remove, name='cart-remove'),
     path('cart/place-request/', cart_place_request, name='cart-place-request'),
     path('requests/mine/', my_requests, name='my-requests'),
+    path('holds/', my_holds, name='my-holds'),
+    path('holds/join/<int:book_id>/', hold_join, name='hold-join'),
+    path('holds/<int:hold_id>/leave/', hold_leave, name='hold-leave'),
     # Circulation
     path('circulation/loan/create/', loan_create, name="loan-create"),
     path('circulation/loan/<int:loan_id>/edit/', loan_update, name="loan-update"),
@@ -52,9 +55,14 @@ urlpatterns = [
     path('staff/reports/overdues.csv', report_overdues_csv, name='report-overdues-csv'),
     path('staff/reports/top-borrowed.csv', report_top_borrowed_csv, name='report-top-borrowed-csv'),
     path('staff/reports/fines-summary.csv', report_fines_summary_csv, name='report-fines-summary-csv'),
+    path('staff/reports/analytics.json', circulation_analytics, name='report-analytics'),
+    path('staff/reports/jobs/', report_jobs, name='report-jobs'),
+    path('staff/reports/jobs/<int:job_id>/', report_job_status, name='report-job-status'),
+    path('staff/reports/jobs/<int:job_id>/download/', report_job_download, name='report-job-download'),
     path('staff/copy/<int:copy_id>/status/<str:status>/', copy_status_update, name='staff-copy-status'),
     # Staff: Requests workflow
     path('staff/requests/', requests_queue, name='staff-requests-queue'),
+    path('staff/requests/stream/', requests_queue_stream, name='staff-requests-queue-stream'),
     path('staff/requests/<int:request_id>/', request_detail, name='staff-request-detail'),
     path('staff/requests/<int:request_id>/set-pickup-by/', set_pickup_by, name='staff-request-set-pickup-by'),
     path('staff/requests/<int:request_id>/items/<int:item_id>/assign/', assign_item_copy, name='staff-request-assign-item'),
@@ -64,4 +72,7 @@ urlpatterns = [
     path('staff/requests/<int:request_id>/cancel/', cancel_request, name='staff-request-cancel'),
     # Staff: Loans by user
     path('staff/loans/', loans_by_user, name='staff-loans-by-user'),
+    path('staff/loans/borrowers.json', borrower_autocomplete, name='staff-borrower-autocomplete'),
+    path('staff/checkin/', checkin_batch, name='staff-checkin-batch'),
+    path('staff/scan/', scan_barcode, name='staff-scan-barcode'),
 ]
@@ -17,9 +17,11 @@ from .catalog import catalog_list, book_detail, suggest_titles
 from .circulation import loan_create, loan_update
 from .account import my_loans, my_fines
 from .cart import cart_view, cart_add, cart_remove, cart_place_request
+from .holds import my_holds, hold_join, hold_leave
 from .requests import (
     my_requests,
     requests_queue,
+    requests_queue_stream,
     request_detail,
     set_pickup_by,
     assign_item_copy,
@@ -39,7 +41,11 @@ from .staff import (
     report_top_borrowed_csv,
     report_fines_summary_csv,
     loans_by_user,
+    borrower_autocomplete,
+    checkin_batch,
+    scan_barcode,
 )
+from .reports import report_jobs, report_job_status, report_job_download, circulation_analytics
 
 __all__ = [
     # home
@@ -58,9 +64,14 @@ __all__ = [
     "my_loans", "my_fines",
     # cart + requests
     "cart_view", "cart_add", "cart_remove", "cart_place_request",
-    "my_requests", "requests_queue", "request_detail", "assign_item_copy", "unassign_item_copy", "mark_request_ready", "confirm_pickup", "cancel_request",
+    # holds
+    "my_holds", "hold_join", "hold_leave",
+    "my_requests", "requests_queue", "requests_queue_stream", "request_detail", "assign_item_copy", "unassign_item_copy", "mark_request_ready", "confirm_pickup", "cancel_request",
     "set_pickup_by",
     # staff
     "copy_status_update", "overdues_list", "fines_ledger", "fine_mark_paid", "book_create_manual", "reports_dashboard",
     "report_overdues_csv", "report_top_borrowed_csv", "report_fines_summary_csv", "loans_by_user",
+    "borrower_autocomplete", "checkin_batch", "scan_barcode",
+    # background reports
+    "report_jobs", "report_job_status", "report_job_download", "circulation_analytics",
 ]
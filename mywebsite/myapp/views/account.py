@@ -1,43 +1,58 @@
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from django.shortcuts import get_object_or_404, redirect, render
+from django.core.paginator import Paginator
+from django.shortcuts import redirect, render
 from django.utils import timezone
 
 from ..models import Loan, Fine
-from ..services.policy import can_renew, compute_renew_due_at
+from ..services.account import get_account_summary
+from ..services.circulation import renew_loans
+
+HISTORY_PAGE_SIZE = 20
+
+
+def report_renewals(request, outcomes):
+    """Flash one summary for renewed loans and one line per loan that was not renewed."""
+    renewed = [o for o in outcomes if o.renewed]
+    if len(renewed) == 1:
+        messages.success(request, f"Renewed {renewed[0].loan.copy.book.title}. New due: {renewed[0].due_at:%Y-%m-%d %H:%M}.")
+    elif renewed:
+        messages.success(request, f"Renewed {len(renewed)} loans.")
+    for o in outcomes:
+        if not o.renewed:
+            messages.error(request, f"Cannot renew {o.loan.copy.book.title}: {o.reason}.")
+    if not outcomes:
+        messages.info(request, "No active loans to renew.")
 
 
 @login_required(login_url='login')
 def my_loans(request):
-    loans_qs = Loan.objects.filter(borrower=request.user).select_related("copy", "copy__book").order_by("-checked_out_at")
-    active = [l for l in loans_qs if l.returned_at is None]
-    past = [l for l in loans_qs if l.returned_at is not None]
-
     if request.method == 'POST':
         action = (request.POST.get('action') or '').strip()
-        loan_id = request.POST.get('loan_id')
-        if action == 'renew' and loan_id:
-            loan = get_object_or_404(Loan, pk=loan_id, borrower=request.user)
-            if can_renew(loan):
-                new_due = compute_renew_due_at(timezone.now(), loan)
-                loan.due_at = new_due
-                loan.renew_count += 1
-                loan.save(update_fields=["due_at", "renew_count"])
-                messages.success(request, f"Renewed. New due: {new_due:%Y-%m-%d %H:%M}.")
-            else:
-                messages.error(request, "Cannot renew this loan.")
+        loan_id = (request.POST.get('loan_id') or '').strip()
+        mine = Loan.objects.filter(borrower=request.user, returned_at__isnull=True)
+        if action == 'renew' and loan_id.isdigit():
+            report_renewals(request, renew_loans(mine.filter(pk=loan_id), timezone.now()))
+            return redirect('my-loans')
+        if action == 'renew_all':
+            report_renewals(request, renew_loans(mine, timezone.now()))
             return redirect('my-loans')
 
+    loans_qs = Loan.objects.filter(borrower=request.user).select_related("copy", "copy__book")
+    active = list(loans_qs.filter(returned_at__isnull=True).order_by("-checked_out_at"))
+    past = Paginator(loans_qs.filter(returned_at__isnull=False).order_by("-checked_out_at"), HISTORY_PAGE_SIZE)
     return render(request, 'myapp/account/my_loans.html', {
         'active_loans': active,
-        'past_loans': past,
+        'past_loans': past.get_page(request.GET.get('page')),
     })
 
 
 @login_required(login_url='login')
 def my_fines(request):
     fines = Fine.objects.filter(loan__borrower=request.user).select_related('loan', 'loan__copy', 'loan__copy__book')
+    paid = Paginator(fines.filter(paid_at__isnull=False), HISTORY_PAGE_SIZE)
     return render(request, 'myapp/account/my_fines.html', {
-        'unpaid': [f for f in fines if not f.paid_at],
-        'paid': [f for f in fines if f.paid_at],
+        'summary': get_account_summary(request.user),
+        'unpaid': list(fines.filter(paid_at__isnull=True)),
+        'paid': paid.get_page(request.GET.get('page')),
     })
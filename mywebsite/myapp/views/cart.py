@@ -6,10 +6,37 @@ from django.shortcuts import get_object_or_404, redirect, render
 from django.db import transaction
 from django.utils import timezone
 
-from ..models import Book, Cart, CartItem, PickupRequest, PickupRequestItem, BookCopy
+from ..models import Book, Cart, CartItem
+from ..services.account import refresh_account_summary
+from ..services.pickups import place_request
 from ..services.policy import HOLD_PICKUP_DAYS
 
 
+PRESELECTED_SESSION_KEY = 'preselected_copies'
+
+
+def _get_preselected(session) -> dict:
+    """Return {cart_item_id: copy_id} stored in the session as "item:copy,item:copy"."""
+    raw = session.get(PRESELECTED_SESSION_KEY)
+    if isinstance(raw, dict):
+        # Older sessions stored {"item_id": copy_id}
+        pairs = ((str(k), str(v)) for k, v in raw.items())
+    else:
+        pairs = (p.split(':', 1) for p in (raw or '').split(',') if ':' in p)
+    return {int(k): int(v) for k, v in pairs if k.isdigit() and v.isdigit()}
+
+
+def _set_preselected(session, mapping) -> None:
+    """Store the mapping compactly, touching the session only when it changed."""
+    value = ','.join(f'{k}:{v}' for k, v in sorted(mapping.items()))
+    if session.get(PRESELECTED_SESSION_KEY) == value:
+        return
+    if value:
+        session[PRESELECTED_SESSION_KEY] = value
+    else:
+        session.pop(PRESELECTED_SESSION_KEY, None)
+
+
 def _get_or_create_cart(user) -> Cart:
     cart = Cart.objects.filter(owner=user).order_by('-updated_at').first()
     if cart is None:
@@ -23,17 +50,11 @@ def cart_view(request):
     # Prefetch copies for availability dropdowns
     items = list(cart.items.select_related('book').prefetch_related('book__copies').all())
     # Attach any pre-selected copy choices from session
-    preselected = request.session.get('preselected_copies', {})
-    valid_keys = set()
+    preselected = _get_preselected(request.session)
     for it in items:
-        key = str(it.id)
-        valid_keys.add(key)
-        setattr(it, 'preselected_copy_id', preselected.get(key))
+        setattr(it, 'preselected_copy_id', preselected.get(it.id))
     # Trim session mapping to only items still in cart
-    trimmed = {k: v for k, v in preselected.items() if k in valid_keys}
-    if trimmed != preselected:
-        request.session['preselected_copies'] = trimmed
-        request.session.modified = True
+    _set_preselected(request.session, {it.id: preselected[it.id] for it in items if it.id in preselected})
     # Suggest a default pickup date (same policy as place_request fallback)
     default_pickup_by = (timezone.now() + timedelta(days=HOLD_PICKUP_DAYS)).date()
     return render(request, 'myapp/cart/cart.html', {
@@ -44,27 +65,31 @@ def cart_view(request):
 
 
 @login_required(login_url='login')
+@transaction.atomic
 def cart_add(request, book_id):
     book = get_object_or_404(Book, pk=book_id)
     cart = _get_or_create_cart(request.user)
-    item, _ = CartItem.objects.get_or_create(cart=cart, book=book)
+    item, created = CartItem.objects.get_or_create(cart=cart, book=book)
+    if created:
+        refresh_account_summary(request.user)
     # Optional preselected copy id passed via querystring (?copy=ID)
     copy_param = (request.GET.get('copy') or '').strip()
     if copy_param.isdigit():
-        pre = request.session.get('preselected_copies', {})
-        pre[str(item.id)] = int(copy_param)
-        request.session['preselected_copies'] = pre
-        request.session.modified = True
+        pre = _get_preselected(request.session)
+        pre[item.id] = int(copy_param)
+        _set_preselected(request.session, pre)
     messages.success(request, f'Added "{book.title}" to your cart.')
     return redirect('catalog-detail', book_id=book.id)
 
 
 @login_required(login_url='login')
+@transaction.atomic
 def cart_remove(request, book_id):
     cart = _get_or_create_cart(request.user)
     try:
         item = CartItem.objects.get(cart=cart, book_id=book_id)
         item.delete()
+        refresh_account_summary(request.user)
         messages.success(request, 'Removed from cart.')
     except CartItem.DoesNotExist:
         messages.error(request, 'Item not found in your cart.')
@@ -91,28 +116,20 @@ def cart_place_request(request):
 
     pickup_location = (request.POST.get('pickup_location') or '').strip()
 
-    pr = PickupRequest.objects.create(
-        requester=request.user,
-        pickup_location=pickup_location,
-        pickup_by=pickup_by,
-        status=PickupRequest.STATUS_PENDING,
-    )
+    # Optional user-selected copy per item
+    selections = {}
     for it in items:
-        # Optional: user-selected copy per item
         selected_copy_id = (request.POST.get(f'copy_{it.id}') or '').strip()
-        pri = PickupRequestItem.objects.create(request=pr, book=it.book)
-        if selected_copy_id:
-            try:
-                copy = BookCopy.objects.select_for_update().get(id=selected_copy_id, book=it.book)
-            except BookCopy.DoesNotExist:
-                copy = None
-            if copy and copy.status == BookCopy.STATUS_AVAILABLE:
-                pri.assigned_copy = copy
-                pri.save(update_fields=['assigned_copy'])
-                copy.status = BookCopy.STATUS_RESERVED
-                copy.save(update_fields=['status'])
-    # Clear cart
-    cart.items.all().delete()
-
-    messages.success(request, 'Request placed. You will be notified when ready for pickup.')
+        if selected_copy_id.isdigit():
+            selections[it.id] = int(selected_copy_id)
+
+    pr, unreserved = place_request(request.user, items, selections, pickup_by, pickup_location)
+    _set_preselected(request.session, {})
+
+    for miss in unreserved:
+        if miss.fallback_barcode:
+            messages.warning(request, f'The copy you picked of "{miss.book.title}" was taken; reserved copy {miss.fallback_barcode} instead.')
+        else:
+            messages.warning(request, f'No copy of "{miss.book.title}" could be reserved right now; staff will assign one.')
+    messages.success(request, f'Request #{pr.id} placed. You will be notified when ready for pickup.')
     return redirect('my-requests')
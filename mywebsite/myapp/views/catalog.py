@@ -6,7 +6,7 @@ from django.views.decorators.cache import cache_page
 from django.core.cache import cache
 import difflib
 
-from ..models import Book, BookCopy, Category, Tag
+from ..models import Book, BookCopy, Category, HoldQueue, Tag
 
 
 def _descendant_ids(category: Category):
@@ -128,6 +128,9 @@ def book_detail(request, book_id):
         "copies": copies,
         "available_count": available_count,
     }
+    if not available_count:
+        queue = HoldQueue.objects.filter(book=book).values_list("last_seq", "head_seq").first()
+        context["waiting_count"] = queue[0] - queue[1] if queue else 0
     return render(request, "myapp/catalog/book_detail.html", context)
 
 
@@ -1,9 +1,13 @@
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required, user_passes_test
+from django.db import transaction
 from django.shortcuts import get_object_or_404, redirect, render
 
 from ..forms import LoanCreateForm, LoanUpdateForm
-from ..models import Loan, BookCopy
+from ..models import Loan, BookCopy, CirculationEvent
+from ..services.account import refresh_account_summary
+from ..services.circulation import return_loans
+from ..services.events import loan_event, record
 
 
 @login_required(login_url='login')
@@ -12,9 +16,12 @@ def loan_create(request):
     if request.method == "POST":
         form = LoanCreateForm(request.POST)
         if form.is_valid():
-            loan = form.save()
-            loan.copy.status = BookCopy.STATUS_ON_LOAN
-            loan.copy.save(update_fields=["status"])
+            with transaction.atomic():
+                loan = form.save()
+                loan.copy.status = BookCopy.STATUS_ON_LOAN
+                loan.copy.save(update_fields=["status"])
+                record([loan_event(CirculationEvent.CHECKOUT, loan, loan.checked_out_at)])
+                refresh_account_summary(loan.borrower_id)
             messages.success(request, "Loan created.")
             return redirect('catalog-list')
     else:
@@ -27,12 +34,23 @@ def loan_create(request):
 def loan_update(request, loan_id):
     loan = get_object_or_404(Loan, pk=loan_id)
     if request.method == "POST":
+        was_open = loan.returned_at is None
         form = LoanUpdateForm(request.POST, instance=loan)
         if form.is_valid():
-            loan = form.save()
-            if loan.returned_at:
-                loan.copy.status = BookCopy.STATUS_AVAILABLE
-                loan.copy.save(update_fields=["status"]) 
+            with transaction.atomic():
+                loan = form.save(commit=False)
+                returned_at = loan.returned_at
+                if was_open and returned_at:
+                    # Close it like any other return: freeze the fine, free the copy, offer it to holds
+                    loan.returned_at = None
+                    loan.save()
+                    return_loans([loan], returned_at)
+                else:
+                    loan.save()
+                    if loan.returned_at:
+                        loan.copy.status = BookCopy.STATUS_AVAILABLE
+                        loan.copy.save(update_fields=["status"])
+                    refresh_account_summary(loan.borrower_id)
             messages.success(request, "Loan updated.")
             return redirect('catalog-list')
     else:
@@ -0,0 +1,43 @@
+from django.contrib import messages
+from django.contrib.auth.decorators import login_required
+from django.shortcuts import get_object_or_404, redirect, render
+
+from ..models import Book, Hold
+from ..services.holds import HoldError, join_hold, leave_hold
+
+
+@login_required(login_url='login')
+def my_holds(request):
+    holds = (
+        Hold.objects.filter(patron=request.user)
+        .exclude(status=Hold.STATUS_CANCELED)
+        .select_related('book', 'book__hold_queue', 'request')
+        .order_by('status', '-created_at')
+    )
+    return render(request, 'myapp/account/my_holds.html', {'holds': holds})
+
+
+@login_required(login_url='login')
+def hold_join(request, book_id):
+    book = get_object_or_404(Book, pk=book_id)
+    if request.method != 'POST':
+        return redirect('catalog-detail', book_id=book.id)
+    try:
+        hold = join_hold(request.user, book)
+    except HoldError as exc:
+        messages.error(request, str(exc))
+        return redirect('catalog-detail', book_id=book.id)
+    hold = Hold.objects.select_related('book__hold_queue').get(pk=hold.pk)
+    messages.success(request, f'You are #{hold.position} on the waitlist for "{book.title}".')
+    return redirect('my-holds')
+
+
+@login_required(login_url='login')
+def hold_leave(request, hold_id):
+    hold = get_object_or_404(Hold, pk=hold_id, patron=request.user)
+    if request.method == 'POST':
+        if leave_hold(hold):
+            messages.success(request, 'Left the waitlist.')
+        else:
+            messages.info(request, 'This hold is no longer waiting.')
+    return redirect('my-holds')
@@ -0,0 +1,72 @@
+from django.contrib import messages
+from django.contrib.auth.decorators import login_required, user_passes_test
+from django.http import FileResponse, Http404, JsonResponse
+from django.shortcuts import get_object_or_404, redirect, render
+from django.urls import reverse
+
+from ..models import ReportJob
+from ..services import analytics
+from ..services.report_jobs import ReportError, clean_params, report_storage, request_report
+
+
+def _job_json(job):
+    return {
+        'id': job.pk,
+        'kind': job.kind,
+        'status': job.status,
+        'rows': job.rows,
+        'size': job.size,
+        'error': job.error,
+        'download_url': reverse('report-job-download', args=[job.pk]) if job.status == ReportJob.STATUS_DONE else None,
+    }
+
+
+# Background reports: request, poll, download
+@login_required(login_url='login')
+@user_passes_test(lambda user: user.is_staff or user.is_superuser, login_url='login')
+def report_jobs(request):
+    if request.method == 'POST':
+        kind = (request.POST.get('kind') or '').strip()
+        try:
+            params = clean_params(kind, request.POST.get('date_from'), request.POST.get('date_to'))
+        except ReportError as exc:
+            messages.error(request, str(exc))
+            return redirect('report-jobs')
+        job, created = request_report(kind, params, request.user)
+        if created:
+            messages.success(request, f'{job.get_kind_display()} report queued.')
+        else:
+            messages.info(request, f'An identical report is already {job.get_status_display().lower()} (#{job.pk}).')
+        return redirect('report-jobs')
+
+    jobs = ReportJob.objects.select_related('requested_by').order_by('-created_at')[:50]
+    return render(request, 'myapp/staff/report_jobs.html', {
+        'jobs': jobs,
+        'kinds': ReportJob.KIND_CHOICES,
+    })
+
+
+@login_required(login_url='login')
+@user_passes_test(lambda user: user.is_staff or user.is_superuser, login_url='login')
+def report_job_status(request, job_id):
+    return JsonResponse(_job_json(get_object_or_404(ReportJob, pk=job_id)))
+
+
+@login_required(login_url='login')
+@user_passes_test(lambda user: user.is_staff or user.is_superuser, login_url='login')
+def report_job_download(request, job_id):
+    job = get_object_or_404(ReportJob, pk=job_id, status=ReportJob.STATUS_DONE)
+    storage = report_storage()
+    if not job.artifact or not storage.exists(job.artifact):
+        raise Http404('Report file is no longer available.')
+    filename = f'{job.kind}-{job.finished_at:%Y%m%d-%H%M}.csv'
+    return FileResponse(storage.open(job.artifact, 'rb'), as_attachment=True, filename=filename, content_type='text/csv')
+
+
+# Circulation trends for the dashboard charts, computed once per day
+@login_required(login_url='login')
+@user_passes_test(lambda user: user.is_staff or user.is_superuser, login_url='login')
+def circulation_analytics(request):
+    if not analytics.available():
+        return JsonResponse({'error': 'Analytics need NumPy installed on the server.'}, status=503)
+    return JsonResponse(analytics.cached_analytics())
@@ -1,8 +1,12 @@
+import asyncio
 from datetime import timedelta
 
+from asgiref.sync import sync_to_async
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required, user_passes_test
+from django.core.handlers.asgi import ASGIRequest
 from django.db import transaction
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
 from django.utils import timezone
 
@@ -10,9 +14,22 @@ from ..models import (
     PickupRequest,
     PickupRequestItem,
     BookCopy,
+    CirculationEvent,
     Loan,
 )
-from ..services.policy import calculate_due_at, active_loan_limit
+from ..services.account import refresh_account_summary
+from ..services.barcodes import resolve_barcode
+from ..services.circulation import CirculationError, checkout_request
+from ..services.events import record, status_event
+from ..services.pickups import allocate_pending_requests, release_copies, try_reserve
+from ..services.policy import active_loan_limit
+from ..services.queue_feed import QUEUE_ORDERING, QueueFeed, latest_event_id, queue_requests
+
+# Live queue stream: how often it tails the ledger, and how long one response lasts
+STREAM_POLL_SECONDS = 1
+STREAM_KEEPALIVE_SECONDS = 15
+STREAM_SECONDS = 300
+STREAM_RETRY_MS = 3000
 
 
 @login_required(login_url='login')
@@ -28,17 +45,65 @@ def my_requests(request):
 @login_required(login_url='login')
 @user_passes_test(lambda u: u.is_staff or u.is_superuser, login_url='login')
 def requests_queue(request):
-    qs = (
-        PickupRequest.objects.filter(status__in=[
-            PickupRequest.STATUS_PENDING,
-            PickupRequest.STATUS_PREPARING,
-            PickupRequest.STATUS_READY,
-        ])
-        .prefetch_related('items', 'items__book', 'items__assigned_copy')
-        .select_related('requester')
-        .order_by('status', 'requested_at')
-    )
-    return render(request, 'myapp/staff/requests_list.html', {'requests': qs})
+    if request.method == 'POST' and request.POST.get('action') == 'allocate':
+        stats = allocate_pending_requests()
+        if stats['assigned']:
+            messages.success(request, f"Assigned {stats['assigned']} copies across {stats['requests']} pending requests.")
+        if stats['unfilled']:
+            messages.warning(request, f"{stats['unfilled']} items still have no available copy.")
+        if not stats['items']:
+            messages.info(request, 'No pending items to allocate.')
+        return redirect('staff-requests-queue')
+    # Read the ledger position first so the live feed replays anything that lands while the page renders
+    last_event_id = latest_event_id()
+    qs = queue_requests().order_by(*QUEUE_ORDERING)
+    return render(request, 'myapp/staff/requests_list.html', {'requests': qs, 'last_event_id': last_event_id})
+
+
+@login_required(login_url='login')
+@user_passes_test(lambda u: u.is_staff or u.is_superuser, login_url='login')
+async def requests_queue_stream(request):
+    """
+    Server-sent events patching the staff queue.
+
+    Under ASGI one response streams for STREAM_SECONDS. A WSGI server would
+    buffer an async iterator whole, so there each response carries a single
+    poll and the browser reconnects after STREAM_RETRY_MS, resuming from the
+    Last-Event-ID it was sent.
+    """
+    position = request.headers.get('Last-Event-ID') or request.GET.get('after') or 0
+    try:
+        feed = QueueFeed.resume(position)
+    except ValueError:
+        feed = QueueFeed(await sync_to_async(latest_event_id)())
+
+    if not isinstance(request, ASGIRequest):
+        frames = [f'retry: {STREAM_RETRY_MS}\n\n', *await sync_to_async(feed.messages)()]
+        return _event_stream(frames)
+
+    async def frames():
+        yield f'retry: {STREAM_RETRY_MS}\n\n'
+        loop = asyncio.get_running_loop()
+        started = idle_since = loop.time()
+        while loop.time() - started < STREAM_SECONDS:
+            batch = await sync_to_async(feed.messages)()
+            for frame in batch:
+                yield frame
+            if batch:
+                idle_since = loop.time()
+            elif loop.time() - idle_since >= STREAM_KEEPALIVE_SECONDS:
+                yield ': keepalive\n\n'
+                idle_since = loop.time()
+            await asyncio.sleep(STREAM_POLL_SECONDS)
+
+    return _event_stream(frames())
+
+
+def _event_stream(frames):
+    response = StreamingHttpResponse(frames, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
 
 
 @login_required(login_url='login')
@@ -59,8 +124,7 @@ def set_pickup_by(request, request_id):
         return redirect('staff-request-detail', request_id=pr.id)
     raw = (request.POST.get('pickup_by') or '').strip()
     if not raw:
-        pr.pickup_by = None
-        pr.save(update_fields=['pickup_by'])
+        _save_pickup_by(pr, None)
         messages.success(request, 'Cleared pickup date.')
         return redirect('staff-request-detail', request_id=pr.id)
     try:
@@ -71,12 +135,19 @@ def set_pickup_by(request, request_id):
     except Exception:
         messages.error(request, 'Invalid date format. Use YYYY-MM-DD.')
         return redirect('staff-request-detail', request_id=pr.id)
-    pr.pickup_by = value
-    pr.save(update_fields=['pickup_by'])
+    _save_pickup_by(pr, value)
     messages.success(request, 'Pickup date updated.')
     return redirect('staff-request-detail', request_id=pr.id)
 
 
+def _save_pickup_by(pr, value):
+    # The unchanged status event tells the live queue feed to re-render this request's row
+    with transaction.atomic():
+        pr.pickup_by = value
+        pr.save(update_fields=['pickup_by'])
+        record([status_event(pr.status, timezone.now(), user_id=pr.requester_id, request_id=pr.id)])
+
+
 @login_required(login_url='login')
 @user_passes_test(lambda u: u.is_staff or u.is_superuser, login_url='login')
 @transaction.atomic
@@ -88,26 +159,28 @@ def assign_item_copy(request, request_id, item_id):
         messages.error(request, 'Please enter a barcode to assign.')
         return redirect('staff-request-detail', request_id=pr.id)
 
-    copy = BookCopy.objects.filter(barcode=barcode).select_for_update().first()
+    copy = resolve_barcode(barcode)
     if copy is None:
         messages.error(request, 'Copy not found.')
         return redirect('staff-request-detail', request_id=pr.id)
     if copy.book_id != item.book_id:
         messages.error(request, 'This barcode does not match the requested title.')
         return redirect('staff-request-detail', request_id=pr.id)
-    if copy.status != BookCopy.STATUS_AVAILABLE:
+    # Reserve with a conditional UPDATE instead of locking the row first
+    if not try_reserve(copy.id):
         messages.error(request, 'This copy is not available to reserve.')
         return redirect('staff-request-detail', request_id=pr.id)
 
-    # Assign and reserve
     item.assigned_copy = copy
     item.save(update_fields=['assigned_copy'])
-    copy.status = BookCopy.STATUS_RESERVED
-    copy.save(update_fields=['status'])
+    now = timezone.now()
+    events = [CirculationEvent(kind=CirculationEvent.RESERVE, occurred_at=now, copy_id=copy.id, book_id=copy.book_id, request_id=pr.id)]
     if pr.status == PickupRequest.STATUS_PENDING:
         pr.status = PickupRequest.STATUS_PREPARING
-        pr.prepared_at = timezone.now()
+        pr.prepared_at = now
         pr.save(update_fields=['status', 'prepared_at'])
+        events.append(status_event(pr.status, now, request_id=pr.id))
+    record(events)
     messages.success(request, f'Assigned copy {copy.barcode}.')
     return redirect('staff-request-detail', request_id=pr.id)
 
@@ -123,9 +196,11 @@ def mark_request_ready(request, request_id):
     if not pr.pickup_by:
         messages.error(request, 'Set a pickup date before marking ready.')
         return redirect('staff-request-detail', request_id=pr.id)
-    pr.status = PickupRequest.STATUS_READY
-    pr.ready_at = timezone.now()
-    pr.save(update_fields=['status', 'ready_at'])
+    with transaction.atomic():
+        pr.status = PickupRequest.STATUS_READY
+        pr.ready_at = timezone.now()
+        pr.save(update_fields=['status', 'ready_at'])
+        record([status_event(pr.status, pr.ready_at, user_id=pr.requester_id, request_id=pr.id)])
     messages.success(request, 'Marked as ready for pickup.')
     return redirect('staff-requests-queue')
 
@@ -134,7 +209,10 @@ def mark_request_ready(request, request_id):
 @user_passes_test(lambda u: u.is_staff or u.is_superuser, login_url='login')
 @transaction.atomic
 def confirm_pickup(request, request_id):
-    pr = get_object_or_404(PickupRequest.objects.select_for_update(), pk=request_id)
+    pr = get_object_or_404(
+        PickupRequest.objects.select_for_update(of=('self',)).select_related('requester', 'requester__profile'),
+        pk=request_id,
+    )
     if pr.status not in (PickupRequest.STATUS_READY, PickupRequest.STATUS_PREPARING):
         messages.error(request, 'Request is not ready for pickup.')
         return redirect('staff-request-detail', request_id=pr.id)
@@ -143,7 +221,7 @@ def confirm_pickup(request, request_id):
         messages.error(request, 'All items need assigned copies before pickup.')
         return redirect('staff-request-detail', request_id=pr.id)
 
-    # Enforce loan limit for borrower
+    # Enforce loan limit for borrower; a live count, since the account summary row can lag admin edits
     current_active = Loan.objects.filter(borrower=pr.requester, returned_at__isnull=True).count()
     limit = active_loan_limit(pr.requester)
     limit_overrun = current_active + len(items) > limit
@@ -154,23 +232,11 @@ def confirm_pickup(request, request_id):
             f'Proceeding over limit: borrower limit {limit}, currently has {current_active}, adding {len(items)}.'
         )
 
-    now = timezone.now()
-    due_at = calculate_due_at(now, pr.requester)
-    for it in items:
-        copy = it.assigned_copy
-        if copy.status not in (BookCopy.STATUS_RESERVED, BookCopy.STATUS_AVAILABLE):
-            messages.error(request, f'Copy {copy.barcode} not reservable for checkout.')
-            return redirect('staff-request-detail', request_id=pr.id)
-    # Create loans and flip statuses
-    for it in items:
-        copy = it.assigned_copy
-        Loan.objects.create(borrower=pr.requester, copy=copy, due_at=due_at)
-        copy.status = BookCopy.STATUS_ON_LOAN
-        copy.save(update_fields=['status'])
-
-    pr.status = PickupRequest.STATUS_PICKED_UP
-    pr.picked_up_at = now
-    pr.save(update_fields=['status', 'picked_up_at'])
+    try:
+        checkout_request(pr, items, timezone.now())
+    except CirculationError as exc:
+        messages.error(request, str(exc))
+        return redirect('staff-request-detail', request_id=pr.id)
     if limit_overrun:
         messages.success(request, 'Pickup confirmed and loans created (limit override).')
     else:
@@ -189,6 +255,7 @@ def unassign_item_copy(request, request_id, item_id):
         if copy.status == BookCopy.STATUS_RESERVED:
             copy.status = BookCopy.STATUS_AVAILABLE
             copy.save(update_fields=['status'])
+            record([CirculationEvent(kind=CirculationEvent.RELEASE, occurred_at=timezone.now(), copy_id=copy.id, book_id=copy.book_id, request_id=pr.id)])
         item.assigned_copy = None
         item.save(update_fields=['assigned_copy'])
         messages.success(request, 'Unassigned copy and released reservation.')
@@ -203,12 +270,11 @@ def unassign_item_copy(request, request_id, item_id):
 def cancel_request(request, request_id):
     pr = get_object_or_404(PickupRequest.objects.select_for_update(), pk=request_id)
     # Release any reserved copies
-    for it in pr.items.select_related('assigned_copy'):
-        if it.assigned_copy_id and it.assigned_copy.status == BookCopy.STATUS_RESERVED:
-            it.assigned_copy.status = BookCopy.STATUS_AVAILABLE
-            it.assigned_copy.save(update_fields=['status'])
+    release_copies([pr.id])
     pr.status = PickupRequest.STATUS_CANCELED
     pr.canceled_at = timezone.now()
     pr.save(update_fields=['status', 'canceled_at'])
+    record([status_event(pr.status, pr.canceled_at, user_id=pr.requester_id, request_id=pr.id)])
+    refresh_account_summary(pr.requester_id)
     messages.success(request, 'Request canceled and reservations released.')
     return redirect('staff-requests-queue')
@@ -1,15 +1,29 @@
-import csv
+from datetime import date, timedelta
+from urllib.parse import urlencode
 
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required, user_passes_test
-from django.db.models import Q, Count, Sum
-from django.http import HttpResponse
+from django.db import transaction
+from django.http import JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
+from django.urls import reverse
 from django.utils import timezone
 from django.utils.text import slugify
 
-from ..models import Book, BookCopy, Loan, Fine, Author
-from ..services.policy import FINE_RATE_PER_DAY
+from ..models import Book, BookCopy, CirculationEvent, Loan, Fine, Author, ReminderLog
+from ..services.account import refresh_account_summary
+from ..services.barcodes import scan
+from ..services.borrowers import (
+    borrower_loans, borrower_summaries, borrower_summary, find_borrower, search_borrowers,
+)
+from ..services.circulation import CirculationError, checkin_barcodes, renew_loans, return_loans
+from ..services.events import loan_event, record, status_event
+from ..services.exports import csv_chunks, encode_chunks, gzip_chunks, overdue_rows
+from ..services.fines import ledger_borrower_page, ledger_fines, ledger_page, ledger_totals
+from ..services.overdue import WORKLIST_SORTS, open_overdue_loans, overdue_totals, overdue_worklist_page
+from ..services.reminders import send_reminders
+from ..services.rollups import fine_totals, rollups_as_of, top_borrowed, top_categories
+from .account import report_renewals
 
 
 @login_required(login_url='login')
@@ -19,8 +33,11 @@ def copy_status_update(request, copy_id, status):
     if status not in dict(BookCopy.STATUS_CHOICES):
         messages.error(request, 'Invalid status.')
         return redirect('catalog-detail', book_id=copy.book_id)
-    copy.status = status
-    copy.save(update_fields=['status'])
+    if copy.status != status:
+        with transaction.atomic():
+            copy.status = status
+            copy.save(update_fields=['status'])
+            record([status_event(status, timezone.now(), copy_id=copy.pk, book_id=copy.book_id)])
     messages.success(request, f'Copy {copy.barcode} set to {status}.')
     return redirect('catalog-detail', book_id=copy.book_id)
 
@@ -28,77 +45,132 @@ def copy_status_update(request, copy_id, status):
 @login_required(login_url='login')
 @user_passes_test(lambda user: user.is_staff or user.is_superuser, login_url='login')
 def overdues_list(request):
+    if request.method == 'POST' and request.POST.get('action') == 'remind':
+        ids = [int(pk) for pk in request.POST.getlist('borrower') if pk.isdigit()]
+        if not ids:
+            messages.error(request, 'Select at least one borrower.')
+        else:
+            stats = send_reminders(borrower_ids=ids, kinds={ReminderLog.KIND_OVERDUE})
+            if stats['sent']:
+                messages.success(request, f"Sent {stats['sent']} reminder(s).")
+            if stats['skipped']:
+                messages.info(request, f"{stats['skipped']} borrower(s) were already reminded about these loans.")
+            if stats['no_email']:
+                messages.warning(request, f"{stats['no_email']} borrower(s) have no email address.")
+            if stats['failed']:
+                messages.error(request, f"{stats['failed']} reminder(s) could not be sent; try again later.")
+        return redirect(request.get_full_path())
+
+    sort = request.GET.get('sort') if request.GET.get('sort') in WORKLIST_SORTS else 'days'
     now = timezone.now()
-    loans = Loan.objects.filter(returned_at__isnull=True, due_at__lt=now).select_related('borrower', 'copy', 'copy__book')
-    return render(request, 'myapp/staff/overdues.html', {'loans': loans, 'now': now})
+    page = overdue_worklist_page(now, sort, request.GET.get('after') or '')
+    return render(request, 'myapp/staff/overdues.html', {
+        'page': page,
+        'totals': overdue_totals(now),
+        'sort': sort,
+        'sorts': [('days', 'Most days overdue'), ('fine', 'Highest estimated fine'), ('loans', 'Most loans')],
+        'now': now,
+    })
 
 
 @login_required(login_url='login')
 @user_passes_test(lambda user: user.is_staff or user.is_superuser, login_url='login')
 def fines_ledger(request):
-    fines = Fine.objects.select_related('loan', 'loan__borrower', 'loan__copy', 'loan__copy__book')
-    unpaid = fines.filter(paid_at__isnull=True)
-    paid = fines.filter(paid_at__isnull=False)
-    return render(request, 'myapp/staff/fines_ledger.html', {'unpaid': unpaid, 'paid': paid})
+    borrower = (request.GET.get('borrower') or '').strip()
+    status = request.GET.get('status') or ''
+    group = request.GET.get('group') == 'borrower'
+    dates = {}
+    for name in ('date_from', 'date_to'):
+        raw = (request.GET.get(name) or '').strip()
+        try:
+            dates[name] = date.fromisoformat(raw) if raw else None
+        except ValueError:
+            messages.error(request, 'Dates must be YYYY-MM-DD.')
+            dates[name] = None
+
+    borrower_id = None
+    if borrower:
+        match = find_borrower(borrower)
+        borrower_id = match.pk if match else 0
+    fines = ledger_fines(borrower_id, dates['date_from'], dates['date_to'], status)
+    cursor = request.GET.get('after') or ''
+    page = ledger_borrower_page(fines, cursor) if group else ledger_page(fines, cursor)
+
+    filters = request.GET.copy()
+    for name in ('after', 'group'):
+        filters.pop(name, None)
+    return render(request, 'myapp/staff/fines_ledger.html', {
+        'page': page,
+        'totals': ledger_totals(fines),
+        'group': group,
+        'borrower': borrower,
+        'status': status,
+        'date_from': dates['date_from'],
+        'date_to': dates['date_to'],
+        'filters': filters.urlencode(),
+    })
 
 
 @login_required(login_url='login')
 @user_passes_test(lambda user: user.is_staff or user.is_superuser, login_url='login')
+@transaction.atomic
 def fine_mark_paid(request, fine_id):
-    fine = get_object_or_404(Fine, pk=fine_id)
-    fine.paid_at = timezone.now()
-    fine.save(update_fields=['paid_at'])
+    fine = get_object_or_404(Fine.objects.select_related('loan', 'loan__copy'), pk=fine_id)
+    if fine.paid_at is None:
+        fine.paid_at = timezone.now()
+        fine.accruing = False  # freeze a running overdue fine; accrual continues from the paid amount
+        fine.save(update_fields=['paid_at', 'accruing'])
+        record([loan_event(CirculationEvent.PAYMENT, fine.loan, fine.paid_at, amount=fine.amount)])
+    refresh_account_summary(fine.loan.borrower_id)
     messages.success(request, 'Fine marked as paid.')
+    # Back to the ledger page the link was on (its filters and cursor ride along in the query string)
+    if request.GET:
+        return redirect(f"{reverse('staff-fines')}?{request.GET.urlencode()}")
     return redirect('staff-fines')
 
 
 
 # Reports (CSV)
+# Rows fetched per round trip when streaming a report from the database
+REPORT_CHUNK_ROWS = 2000
+
+
+def _csv_response(request, filename, header, rows):
+    """Stream ``rows`` as a CSV download; ``?gzip=1`` sends it gzip-compressed as ``<filename>.gz``."""
+    chunks = encode_chunks(csv_chunks(header, rows))
+    if request.GET.get('gzip') == '1':
+        response = StreamingHttpResponse(gzip_chunks(chunks), content_type='application/gzip')
+        filename += '.gz'
+    else:
+        response = StreamingHttpResponse(chunks, content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
 @login_required(login_url='login')
 @user_passes_test(lambda user: user.is_staff or user.is_superuser, login_url='login')
 def report_overdues_csv(request):
-    now = timezone.now()
-    loans = Loan.objects.filter(returned_at__isnull=True, due_at__lt=now).select_related('borrower', 'copy', 'copy__book')
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename="overdues.csv"'
-    writer = csv.writer(response)
-    writer.writerow(['Book', 'Barcode', 'Borrower', 'Due At'])
-    for loan in loans:
-        writer.writerow([loan.copy.book.title, loan.copy.barcode, loan.borrower.username, loan.due_at.isoformat()])
-    return response
+    header, rows = overdue_rows(timezone.now(), chunk_size=REPORT_CHUNK_ROWS)
+    return _csv_response(request, 'overdues.csv', header, rows)
 
 
 @login_required(login_url='login')
 @user_passes_test(lambda user: user.is_staff or user.is_superuser, login_url='login')
 def report_top_borrowed_csv(request):
-    agg = (
-        Loan.objects.values('copy__book__title')
-        .annotate(count=Count('id'))
-        .order_by('-count')[:100]
-    )
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename="top_borrowed.csv"'
-    writer = csv.writer(response)
-    writer.writerow(['Title', 'Loans'])
-    for row in agg:
-        writer.writerow([row['copy__book__title'], row['count']])
-    return response
+    rows = top_borrowed(100).values_list('book__title', 'loans')
+    return _csv_response(request, 'top_borrowed.csv', ['Title', 'Loans'], rows)
 
 
 @login_required(login_url='login')
 @user_passes_test(lambda user: user.is_staff or user.is_superuser, login_url='login')
 def report_fines_summary_csv(request):
-    total = Fine.objects.aggregate(total=Sum('amount'))['total'] or 0
-    unpaid = Fine.objects.filter(paid_at__isnull=True).aggregate(total=Sum('amount'))['total'] or 0
-    paid = Fine.objects.filter(paid_at__isnull=False).aggregate(total=Sum('amount'))['total'] or 0
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename="fines_summary.csv"'
-    writer = csv.writer(response)
-    writer.writerow(['Metric', 'Amount'])
-    writer.writerow(['Total fines', total])
-    writer.writerow(['Unpaid fines', unpaid])
-    writer.writerow(['Paid fines', paid])
-    return response
+    fines = fine_totals()
+    rows = [
+        ['Total fines', fines['total']],
+        ['Unpaid fines', fines['unpaid']],
+        ['Paid fines', fines['paid']],
+    ]
+    return _csv_response(request, 'fines_summary.csv', ['Metric', 'Amount'], rows)
 
 
 # CSV import for books
@@ -193,26 +265,20 @@ def book_create_manual(request):
 @login_required(login_url='login')
 @user_passes_test(lambda user: user.is_staff or user.is_superuser, login_url='login')
 def reports_dashboard(request):
+    # Live overdue count is bounded by the open-loan partial index; history comes from the rollups
     now = timezone.now()
-    overdue_loans = Loan.objects.filter(returned_at__isnull=True, due_at__lt=now)
-    overdue_count = overdue_loans.count()
-
-    top_borrowed_qs = (
-        Loan.objects.values('copy__book__title')
-        .annotate(count=Count('id'))
-        .order_by('-count')[:10]
-    )
-    fines_total = Fine.objects.aggregate(total=Sum('amount'))['total'] or 0
-    fines_unpaid = Fine.objects.filter(paid_at__isnull=True).aggregate(total=Sum('amount'))['total'] or 0
-    fines_paid = Fine.objects.filter(paid_at__isnull=False).aggregate(total=Sum('amount'))['total'] or 0
+    overdue_count = open_overdue_loans(now).count()
+    fines = fine_totals()
 
     context = {
         'now': now,
         'overdue_count': overdue_count,
-        'top_borrowed': top_borrowed_qs,
-        'fines_total': fines_total,
-        'fines_unpaid': fines_unpaid,
-        'fines_paid': fines_paid,
+        'top_borrowed': top_borrowed(10),
+        'top_categories': top_categories(timezone.localdate() - timedelta(days=30)),
+        'fines_total': fines['total'],
+        'fines_unpaid': fines['unpaid'],
+        'fines_paid': fines['paid'],
+        'rollups_as_of': rollups_as_of(),
     }
     return render(request, 'myapp/staff/reports.html', context)
 
@@ -221,13 +287,8 @@ def reports_dashboard(request):
 @login_required(login_url='login')
 @user_passes_test(lambda user: user.is_staff or user.is_superuser, login_url='login')
 def loans_by_user(request):
-    from django.contrib.auth.models import User
-    borrower = None
     q = (request.GET.get('q') or '').strip()
-    if q:
-        borrower = (
-            User.objects.filter(Q(username__iexact=q) | Q(email__iexact=q)).first()
-        )
+    borrower = find_borrower(q) if q else None
 
     if request.method == 'POST':
         action = (request.POST.get('action') or '').strip()
@@ -235,26 +296,64 @@ def loans_by_user(request):
         if action == 'return' and loan_id:
             loan = get_object_or_404(Loan.objects.select_related('copy', 'borrower'), pk=loan_id)
             if loan.returned_at is None:
-                loan.returned_at = timezone.now()
-                loan.save(update_fields=['returned_at'])
-                if loan.copy and loan.copy.status != BookCopy.STATUS_AVAILABLE:
-                    loan.copy.status = BookCopy.STATUS_AVAILABLE
-                    loan.copy.save(update_fields=['status'])
-                # Overdue fine (same logic as circulation desk)
-                if loan.due_at and loan.returned_at > loan.due_at:
-                    days_over = (loan.returned_at.date() - loan.due_at.date()).days
-                    if days_over > 0:
-                        Fine.objects.create(loan=loan, amount=days_over * FINE_RATE_PER_DAY, reason=f"Overdue {days_over} day(s)")
-                messages.success(request, f"Marked returned: {loan.copy.barcode} for {loan.borrower.username}.")
-            return redirect(request.path + (f"?q={q}" if q else ""))
-
-    loans_qs = Loan.objects.filter(returned_at__isnull=True).select_related('borrower', 'copy', 'copy__book').order_by('borrower__username', 'due_at')
+                try:
+                    return_loans([loan], timezone.now())
+                except CirculationError as exc:
+                    messages.error(request, str(exc))
+                else:
+                    messages.success(request, f"Marked returned: {loan.copy.barcode} for {loan.borrower.username}.")
+            return redirect(request.get_full_path())
+        if action == 'renew_all' and borrower:
+            loans = Loan.objects.filter(borrower=borrower, returned_at__isnull=True)
+            report_renewals(request, renew_loans(loans, timezone.now()))
+            return redirect(request.get_full_path())
+
+    now = timezone.now()
+    cursor = request.GET.get('after') or ''
+    context = {'q': q, 'borrower': borrower, 'now': now, 'params': urlencode({'q': q}) if q else ''}
     if borrower:
-        loans_qs = loans_qs.filter(borrower=borrower)
+        # One borrower: their open loans page by page, soonest due first
+        context['loans'] = borrower_loans(borrower, cursor)
+        context['summary'] = borrower_summary(borrower, now)
+    else:
+        # Everyone (or the usernames/emails starting with q): one summary row per borrower
+        context['borrowers'] = borrower_summaries(now, q, cursor)
+    return render(request, 'myapp/staff/loans_by_user.html', context)
 
-    return render(request, 'myapp/staff/loans_by_user.html', {
-        'q': q,
-        'borrower': borrower,
-        'loans': loans_qs,
-        'now': timezone.now(),
-    })
+
+@login_required(login_url='login')
+@user_passes_test(lambda user: user.is_staff or user.is_superuser, login_url='login')
+def borrower_autocomplete(request):
+    users = search_borrowers(request.GET.get('q')).values('username', 'email')
+    return JsonResponse({'results': list(users)})
+
+
+# Batch check-in: scan many barcodes, close their loans in one transaction
+@login_required(login_url='login')
+@user_passes_test(lambda user: user.is_staff or user.is_superuser, login_url='login')
+def checkin_batch(request):
+    results = []
+    if request.method == 'POST':
+        raw = request.POST.get('barcodes') or ''
+        barcodes = raw.replace(',', '\n').splitlines()
+        try:
+            results = checkin_barcodes(barcodes, timezone.now())
+        except CirculationError as exc:
+            messages.error(request, str(exc))
+    counts = {
+        'returned': sum(1 for r in results if r.status == 'returned'),
+        'fined': sum(1 for r in results if r.fine),
+        'skipped': sum(1 for r in results if r.status != 'returned'),
+    }
+    return render(request, 'myapp/staff/checkin.html', {'results': results, 'counts': counts})
+
+
+# Scanner lookup: copy, title, active loan and open request in one JSON round-trip
+@login_required(login_url='login')
+@user_passes_test(lambda user: user.is_staff or user.is_superuser, login_url='login')
+def scan_barcode(request):
+    barcode = (request.GET.get('barcode') or '').strip()
+    if not barcode:
+        return JsonResponse({'error': 'barcode is required'}, status=400)
+    result = scan(barcode)
+    return JsonResponse(result, status=200 if result['found'] else 404)
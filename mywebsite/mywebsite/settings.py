@@ -106,6 +106,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'myapp.context_processors.account_summary',
             ],
         },
     },
@@ -177,9 +178,17 @@ USE_TZ = True
 
 # Caching Configuration
 # Using database cache for free PostgreSQL deployment
+# With CACHE_DEFERRED_CULL on, set() never culls inline; schedule
+# `python manage.py cull_cache` to expire rows and enforce MAX_ENTRIES instead.
+CACHE_DEFERRED_CULL = env_bool("CACHE_DEFERRED_CULL", True)
+
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'BACKEND': (
+            'myapp.backends.DeferredCullDatabaseCache'
+            if CACHE_DEFERRED_CULL
+            else 'django.core.cache.backends.db.DatabaseCache'
+        ),
         'LOCATION': 'django_cache_table',
         'OPTIONS': {
             'MAX_ENTRIES': 5000,  # Store up to 5000 cache entries
@@ -195,7 +204,9 @@ CACHE_MIDDLEWARE_SECONDS = 300  # Cache pages for 5 minutes
 CACHE_MIDDLEWARE_KEY_PREFIX = 'djshop'
 
 # Session configuration - use database sessions for consistency
-SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'  # Use cache + DB for sessions
+SESSION_ENGINE = 'myapp.sessions'  # cache + DB, skips writes when the data did not change
+# Per-worker in-memory L1 in front of the cache table (0 disables it)
+SESSION_L1_SECONDS = int(os.environ.get("SESSION_L1_SECONDS", "0"))
 SESSION_CACHE_ALIAS = 'default'
 SESSION_COOKIE_AGE = 1209600  # 2 weeks
 
@@ -241,3 +252,13 @@ if CLOUDINARY_URL:
     STORAGES["default"] = {
         "BACKEND": "cloudinary_storage.storage.MediaCloudinaryStorage",
     }
+
+# Outgoing mail (reminder digests). Console by default; point EMAIL_BACKEND at
+# smtp/file/locmem per environment.
+EMAIL_BACKEND = os.environ.get("EMAIL_BACKEND", "django.core.mail.backends.console.EmailBackend")
+EMAIL_HOST = os.environ.get("EMAIL_HOST", "localhost")
+EMAIL_PORT = int(os.environ.get("EMAIL_PORT", "25"))
+EMAIL_HOST_USER = os.environ.get("EMAIL_HOST_USER", "")
+EMAIL_HOST_PASSWORD = os.environ.get("EMAIL_HOST_PASSWORD", "")
+EMAIL_USE_TLS = env_bool("EMAIL_USE_TLS", False)
+DEFAULT_FROM_EMAIL = os.environ.get("DEFAULT_FROM_EMAIL", "library@localhost")